@@ -0,0 +1,428 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Benchmark of the website generation, on synthetic boards.
+
+Boards of each requested size are generated from a fixed seed, with the
+random-demo logic of ggi_deploy: issue bodies with random scorecards, one
+distinct activity id per issue, progress labels and the label events
+leading to them. Every stage is then run on a copy of the `web` template:
+
+    get_scorecard, extract_sections, extract_workflow,
+    write_activities_to_md, write_data_points, write_flow_metrics,
+    update_keywords
+
+Each board is processed several times for timings, keeping the fastest
+run of every stage, then once under tracemalloc for the peak memory of
+every stage, as tracing slows Python down. Modules imported lazily by
+the stages are imported beforehand, so the first run does not pay for
+them. The largest default board, of 100,000 issues, takes several
+minutes and about 1 GB of memory: use -n 100,1000,10000 for a quick check.
+
+Results are compared with a JSON baseline, and stages slower or bigger
+than the baseline by more than the threshold are flagged, in which case
+the exit status is 1. The baseline is created if missing, and replaced
+with --update-baseline.
+
+With --cold-start, the cold start of the entry scripts is measured
+instead: each one is run with --help in fresh interpreters, keeping the
+fastest run, which covers the imports. It is compared with the baseline
+in the same way, if recorded with the same Python version.
+
+usage: ggi_benchmark [-h] [-n SIZES] [-s SEED] [-r REPEAT] [-b BASELINE] [-t THRESHOLD] [-u] [-c]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -n SIZES, --sizes SIZES
+                        Comma-separated board sizes, in issues (default 100,1000,10000,100000)
+  -s SEED, --seed SEED  Seed of the synthetic boards (default 42)
+  -r REPEAT, --repeat REPEAT
+                        Number of timing runs per board (default 3)
+  -b BASELINE, --baseline BASELINE
+                        Baseline file (default .ggi_cache/benchmark.json)
+  -t THRESHOLD, --threshold THRESHOLD
+                        Relative increase flagged as a regression (default 0.25)
+  -u, --update-baseline
+                        Replace the baseline with the results of this run
+  -c, --cold-start      Measure the cold start of the entry scripts instead
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import timedelta
+
+import ggi_deploy
+import ggi_update_website as website
+from ggi_fake_forge import format_time, get_label_path, seed_start
+from ggi_scorecard import ScorecardCache
+from ggi_update_website import *
+
+default_baseline = os.path.join('.ggi_cache', 'benchmark.json')
+# Bump when synthetic boards change, to drop baselines measured on other boards.
+baseline_version = 2
+web_template_dir = 'web'
+
+# Differences below these are noise, whatever the threshold.
+min_seconds = 0.01
+min_peak_kib = 256
+min_cold_start_seconds = 0.1
+
+stages = ['get_scorecard', 'extract_sections', 'extract_workflow', 'write_activities_to_md',
+          'write_data_points', 'write_flow_metrics', 'update_keywords']
+
+cold_start_scripts = ['ggi_update_website_gitlab', 'ggi_update_website_github', 'ggi_fleet',
+                      'ggi_deploy_gitlab', 'ggi_deploy_github']
+
+
+def parse_args():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(prog='ggi_benchmark')
+    parser.add_argument('-n', '--sizes',
+                        dest='opt_sizes',
+                        default='100,1000,10000,100000',
+                        help='Comma-separated board sizes, in issues')
+    parser.add_argument('-s', '--seed',
+                        dest='opt_seed',
+                        type=int,
+                        default=42,
+                        help='Seed of the synthetic boards')
+    parser.add_argument('-r', '--repeat',
+                        dest='opt_repeat',
+                        type=int,
+                        default=3,
+                        help='Number of timing runs per board')
+    parser.add_argument('-b', '--baseline',
+                        dest='opt_baseline',
+                        default=default_baseline,
+                        help='Baseline file')
+    parser.add_argument('-t', '--threshold',
+                        dest='opt_threshold',
+                        type=float,
+                        default=0.25,
+                        help='Relative increase flagged as a regression')
+    parser.add_argument('-u', '--update-baseline',
+                        dest='opt_update_baseline',
+                        action='store_true',
+                        help='Replace the baseline with the results of this run')
+    parser.add_argument('-c', '--cold-start',
+                        dest='opt_cold_start',
+                        action='store_true',
+                        help='Measure the cold start of the entry scripts instead')
+    return parser.parse_args()
+
+
+def generate_bodies(size, metadata, init_scorecard, rnd):
+    """
+    Build `size` issue bodies as ggi_deploy does in random-demo mode,
+    cycling over activities, each with its own activity id.
+    """
+    args = argparse.Namespace(opt_random=True)
+    bodies = []
+    for idx in range(size):
+        activity = metadata['activities'][idx % len(metadata['activities'])]
+        body = ggi_deploy.extract_sections(args, init_scorecard, activity, rnd)
+        bodies.append(ggi_deploy.re_activity_id.sub(f"Activity ID: [GGI-A-{idx + 1}]", body, count=1))
+    return bodies
+
+
+def parse_bodies(bodies, metadata):
+    """
+    Parse issue bodies into issue and task lines, like the forge scripts.
+    """
+    issues = []
+    tasks = []
+    for idx, body in enumerate(bodies):
+        activity = metadata['activities'][idx % len(metadata['activities'])]
+        a_id, description, workflow, a_tasks = extract_workflow(body)
+        tasks += [[a_id, 'completed' if t['is_completed'] else 'open', t['task']] for t in a_tasks]
+        issues.append([idx + 1, a_id, 'opened', activity['name'], None, None,
+                       f"https://forge.invalid/ggi/benchmark/-/issues/{idx + 1}",
+                       '\n'.join(description), workflow,
+                       len(a_tasks), len([t for t in a_tasks if t['is_completed']])])
+    return issues, tasks
+
+
+def generate_history(issues, metadata, params, rnd):
+    """
+    Draw the labels of every issue, and generate the label events leading
+    to them. Fills the labels and updated_at fields of issue lines.
+    """
+    statuses = [params['progress_labels'][s] for s in ['not_started', 'in_progress', 'done']]
+    hist = []
+    for idx, issue in enumerate(issues):
+        activity = metadata['activities'][idx % len(metadata['activities'])]
+        final = rnd.choice(statuses + [None])
+        path = [('add', label) for label in [activity['goal']] + activity['roles']]
+        path += get_label_path(statuses, final, 2 * rnd.randint(0, 3), rnd)
+        when = seed_start + timedelta(hours=rnd.randint(0, 24 * 365))
+        for action, label in path:
+            when += timedelta(minutes=rnd.randint(1, 60 * 24 * 7))
+            hist.append([format_time(when), issue[0], f"{issue[0]}-{len(hist)}", 'label',
+                         'benchmark', f"{action} {label}", issue[6]])
+        issue[4] = ','.join([activity['goal']] + activity['roles'] + ([final] if final else []))
+        issue[5] = format_time(when)
+    return hist
+
+
+def update_keywords_all(params, web_dir):
+    """
+    Replace keywords in the website files, and in every generated
+    scorecard, so the stage grows with the board.
+    """
+    update_website_keywords(params, web_dir=web_dir)
+    keywords = {'[GGI_URL]': params['GGI_URL'], '[GGI_PAGES_URL]': params['GGI_PAGES_URL'],
+                '[GGI_ACTIVITIES_URL]': params['GGI_ACTIVITIES_URL']}
+    matcher = compile_keywords(keywords)
+    for file in glob.glob(f'{web_dir}/content/scorecards/activity_*.md'):
+        update_keywords(file, keywords, matcher)
+
+
+def import_stage_modules():
+    """
+    Import the modules that stages import lazily, so that their import is
+    not counted in the first timed run of a stage. Import times are
+    measured with --cold-start.
+    """
+    if has_pandas():
+        import ggi_history
+        import ggi_replay
+        import pandas
+
+
+def run_board(size, seed, metadata, params, init_scorecard, trace):
+    """
+    Generate a board and run all stages on it, in a temporary copy of
+    the website.
+
+    Returns stage: seconds, or stage: peak KiB if `trace` is set.
+    """
+    rnd = random.Random(seed)
+    results = {}
+    # Parse every body, as on a first run.
+    website.scorecards = ScorecardCache(path=None)
+    web_dir = tempfile.mkdtemp(prefix='ggi_benchmark_')
+    shutil.copytree(web_template_dir, web_dir, dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('public', 'resources', '*.bak', manifest_name))
+
+    def measure(stage, func, *args):
+        if trace:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            value = func(*args)
+        if trace:
+            results[stage] = (tracemalloc.get_traced_memory()[1] - current) / 1024
+        else:
+            results[stage] = time.perf_counter() - start
+        return value
+
+    try:
+        measure('get_scorecard', lambda: [ggi_deploy.get_scorecard(True, init_scorecard, rnd)
+                                          for _ in range(size)])
+        bodies = measure('extract_sections', generate_bodies, size, metadata, init_scorecard, rnd)
+        issues, tasks = measure('extract_workflow', parse_bodies, bodies, metadata)
+        hist = generate_history(issues, metadata, params, rnd)
+        issues, tasks, hist = to_tables(issues, tasks, hist)
+
+        measure('write_activities_to_md', write_activities_to_md, issues, web_dir)
+        measure('write_data_points', write_data_points, issues, params, web_dir,
+                os.path.join(web_dir, 'snapshots.csv'))
+        measure('write_flow_metrics', write_flow_metrics, issues, hist, params, web_dir)
+        measure('update_keywords', update_keywords_all, params, web_dir)
+    finally:
+        shutil.rmtree(web_dir)
+        generated_files.clear()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print results against the baseline, and return the regressions.
+    """
+    regressions = []
+    print(f"\n  {'Stage':24} {'Issues':>7} {'Time':>9} {'Base':>9} {'Diff':>7}  " +
+          f"{'Peak KiB':>10} {'Base':>10} {'Diff':>7}")
+    for size, board in results.items():
+        for stage in stages:
+            value = board[stage]
+            base = baseline.get(size, {}).get(stage)
+            line = f"  {stage:24} {size:>7} {value['seconds']:8.3f}s "
+            flags = []
+            if base is None:
+                print(line + f"{'-':>9} {'-':>7}  {value['peak_kib']:10.0f} {'-':>10} {'-':>7}")
+                continue
+            for key, noise in [('seconds', min_seconds), ('peak_kib', min_peak_kib)]:
+                if value[key] > base[key] * (1 + threshold) and value[key] - base[key] > noise:
+                    flags.append(key)
+                    regressions.append((size, stage, key, base[key], value[key]))
+
+            def diff(key):
+                return f"{(value[key] / base[key] - 1) * 100:+6.0f}%" if base[key] else f"{'-':>7}"
+            print(line + f"{base['seconds']:8.3f}s {diff('seconds')}  " +
+                  f"{value['peak_kib']:10.0f} {base['peak_kib']:10.0f} {diff('peak_kib')}" +
+                  (f"  REGRESSION ({', '.join(flags)})" if flags else ''))
+    return regressions
+
+
+def measure_cold_start(repeat):
+    """
+    Run every entry script with --help in a fresh interpreter, and return
+    script: fastest run in seconds.
+    """
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for script in cold_start_scripts:
+        runs = []
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(scripts_dir, script + '.py'), '--help'],
+                           stdout=subprocess.DEVNULL, check=True)
+            runs.append(time.perf_counter() - start)
+        results[script] = round(min(runs), 4)
+    return results
+
+
+def compare_cold_start(results, baseline, threshold):
+    """
+    Print cold starts against the baseline, and return the regressions.
+    """
+    regressions = []
+    print(f"\n  {'Script':30} {'Time':>9} {'Base':>9} {'Diff':>7}")
+    for script, value in results.items():
+        base = baseline.get(script)
+        if base is None:
+            print(f"  {script:30} {value:8.3f}s {'-':>9} {'-':>7}")
+            continue
+        regression = value > base * (1 + threshold) and value - base > min_cold_start_seconds
+        if regression:
+            regressions.append(('cold start', script, 'seconds', base, value))
+        print(f"  {script:30} {value:8.3f}s {base:8.3f}s {(value / base - 1) * 100:+6.0f}%" +
+              ('  REGRESSION' if regression else ''))
+    return regressions
+
+
+def read_baseline(file):
+    """
+    Read the stored baseline, or return an empty one.
+    """
+    if not os.path.isfile(file):
+        return {}
+    with open(file, 'r', encoding='utf-8') as f:
+        stored = json.load(f)
+    return stored if stored.get('version') == baseline_version else {}
+
+
+def write_baseline(file, stored):
+    os.makedirs(os.path.dirname(file) or '.', exist_ok=True)
+    with open(file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({**stored, 'version': baseline_version}, f, indent=2)
+    os.replace(file + '.tmp', file)
+    print(f"\n# Baseline written to {file}.")
+
+
+def check_regressions(regressions, threshold):
+    if regressions:
+        print(f"\n# {len(regressions)} regression(s) beyond {threshold:.0%} of the baseline:")
+        for size, stage, key, base, value in regressions:
+            print(f"- {stage} on {size}: {key} {base} -> {value}")
+        exit(1)
+    print(f"\n# No regression beyond {threshold:.0%} of the baseline.")
+
+
+def main_cold_start(args):
+    """
+    Measure and check the cold start of the entry scripts.
+    """
+    print(f"# Measuring the cold start of {len(cold_start_scripts)} script(s).")
+    results = measure_cold_start(args.opt_repeat)
+    stored = read_baseline(args.opt_baseline)
+    baseline = stored.get('cold_start', {})
+    if baseline.get('python') != platform.python_version():
+        if baseline:
+            print(f"- Cold start baseline was recorded with Python {baseline.get('python')}, ignoring it.")
+        baseline = {}
+    regressions = compare_cold_start(results, baseline.get('scripts', {}), args.opt_threshold)
+
+    if args.opt_update_baseline or not baseline:
+        stored['cold_start'] = {'python': platform.python_version(), 'scripts': results}
+        write_baseline(args.opt_baseline, stored)
+        return
+    check_regressions(regressions, args.opt_threshold)
+
+
+def main():
+    """
+    Main sequence.
+    """
+    args = parse_args()
+    if args.opt_cold_start:
+        main_cold_start(args)
+        return
+    sizes = [int(size) for size in args.opt_sizes.split(',')]
+
+    metadata = read_activities_metadata()
+    with open(file_conf, 'r', encoding='utf-8') as f:
+        params = json.load(f)
+    with open(ggi_deploy.init_scorecard_file, 'r', encoding='utf-8') as f:
+        init_scorecard = f.readlines()
+    params['metadata'] = metadata
+    params['GGI_URL'] = 'https://forge.invalid/ggi/benchmark'
+    params['GGI_PAGES_URL'] = 'https://ggi.pages.invalid/benchmark'
+    params['GGI_ACTIVITIES_URL'] = 'https://forge.invalid/ggi/benchmark/-/boards'
+    import_stage_modules()
+
+    results = {}
+    for size in sizes:
+        print(f"# Benchmarking a board of {size} issue(s).")
+        runs = [run_board(size, args.opt_seed, metadata, params, init_scorecard, trace=False)
+                for _ in range(max(1, args.opt_repeat))]
+        seconds = {stage: min(run[stage] for run in runs) for stage in stages}
+        tracemalloc.start()
+        peaks = run_board(size, args.opt_seed, metadata, params, init_scorecard, trace=True)
+        tracemalloc.stop()
+        results[str(size)] = {stage: {'seconds': round(seconds[stage], 4), 'peak_kib': round(peaks[stage], 1)}
+                              for stage in stages}
+        print(f"- Done in {sum(seconds.values()):.2f}s.")
+
+    stored = read_baseline(args.opt_baseline)
+    baseline = {}
+    if stored.get('seed') == args.opt_seed:
+        baseline = stored.get('results', {})
+    elif stored.get('results'):
+        print(f"- Baseline {args.opt_baseline} was recorded with another seed, ignoring it.")
+    regressions = compare(results, baseline, args.opt_threshold)
+
+    if args.opt_update_baseline or not baseline:
+        baseline.update(results)
+        stored.update({'seed': args.opt_seed, 'python': platform.python_version(), 'results': baseline})
+        write_baseline(args.opt_baseline, stored)
+        return
+    check_regressions([(f"{size} issue(s)", stage, key, base, value)
+                       for size, stage, key, base, value in regressions], args.opt_threshold)
+
+
+if __name__ == '__main__':
+    main()
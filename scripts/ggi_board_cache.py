@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Persistent board state cache, used for incremental updates.
+
+The cache stores, for every issue of a project, its last `updated_at`
+value along with the issue, tasks and history lines computed from it.
+It is a single JSON file per project in the `.ggi_cache` directory:
+
+    {
+      "version": 1,
+      "project": "ggi/my-ggi-board",
+      "last_sync": "2024-01-01T03:00:00+00:00",
+      "issues": {
+        "<issue id>": {"updated_at": ..., "issue": [...], "tasks": [...], "hist": [...]}
+      }
+    }
+
+Dates are stored as strings, which is also how they are rendered in the
+generated CSV and markdown files.
+"""
+
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+cache_version = 1
+cache_dir = '.ggi_cache'
+
+
+def get_cache_file(project: str):
+    """
+    Compute the cache file path for a project, e.g. `ggi/my-ggi-board`.
+    """
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', project)
+    return os.path.join(cache_dir, f'{slug}.json')
+
+
+def load_board_cache(project: str):
+    """
+    Read the board cache of a project.
+
+    Returns an empty cache if none exists, or if it was written with
+    another version of the cache format.
+    """
+    cache = {'version': cache_version, 'project': project,
+             'last_sync': None, 'issues': {}}
+    cache_file = get_cache_file(project)
+    if not os.path.isfile(cache_file):
+        print(f"- No board cache found at {cache_file}, doing a full sync.")
+        return cache
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        stored = json.load(f)
+    if stored.get('version') != cache_version or stored.get('project') != project:
+        print(f"- Ignoring board cache {cache_file} (version {stored.get('version')}), doing a full sync.")
+        return cache
+    print(f"- Using board cache {cache_file}, last sync at {stored['last_sync']}.")
+    return stored
+
+
+def save_board_cache(cache: dict):
+    """
+    Write the board cache of a project atomically.
+    """
+    cache_file = get_cache_file(cache['project'])
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(cache, f, default=str)
+    os.replace(cache_file + '.tmp', cache_file)
+    print(f"- Board cache saved to {cache_file} ({len(cache['issues'])} issues).")
+
+
+def get_sync_time():
+    """
+    Current time, to be recorded as `last_sync` once the fetch is done.
+
+    It must be taken before fetching, so that issues updated during the
+    fetch are retrieved again on the next run.
+    """
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def merge_board_cache(cache: dict, harvested, removed, sync_time):
+    """
+    Merge freshly fetched issues into the cache.
+
+    `harvested` is a list of (issue, tasks, hist) tuples as returned by the
+    harvest functions, and `removed` a list of issue ids to drop, e.g.
+    issues closed since the last sync.
+    """
+    for issue, tasks, hist in harvested:
+        cache['issues'][str(issue[0])] = {
+            'updated_at': str(issue[5]),
+            'issue': issue,
+            'tasks': tasks,
+            'hist': hist
+        }
+    for issue_id in removed:
+        cache['issues'].pop(str(issue_id), None)
+    cache['last_sync'] = sync_time.isoformat()
+    print(f"- Merged {len(harvested)} updated and {len(removed)} removed issue(s) into board cache.")
+    return cache
+
+
+def flatten_board_cache(cache: dict):
+    """
+    Rebuild the issues, tasks and hist lists from the cache.
+
+    Issues are ordered by decreasing id, like the default (newest first)
+    ordering of the forges.
+    """
+    issues = []
+    tasks = []
+    hist = []
+    for issue_id in sorted(cache['issues'], key=int, reverse=True):
+        entry = cache['issues'][issue_id]
+        issues.append(entry['issue'])
+        tasks.extend(entry['tasks'])
+        hist.extend(entry['hist'])
+    return issues, tasks, hist
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Aggregates of the board used by the dashboard plots.
+
+Labels are matched exactly, so e.g. a "Done" progress label does not
+match a "Nearly Done" label. Every issue has exactly one status, the
+first progress label it holds in (not started, in progress, done) order,
+or 'Unknown'.
+
+The goal x role x status cube is a nested list, `cube[goal][role][status]`.
+The last role is 'All', so that goal x status counts are read from the
+cube itself. Boards have only a handful of distinct label combinations:
+each of them is parsed and counted once, in plain Python, so the core
+path does not need numpy.
+
+It works on plain sequences, one item per issue, e.g. DataFrame columns.
+"""
+
+from collections import Counter, namedtuple
+
+all_roles = 'All'
+unknown_status = 'Unknown'
+
+Dashboard = namedtuple('Dashboard', ['goals', 'roles', 'statuses', 'status', 'cube'])
+
+
+def get_label_columns(issue_labels: str, index: dict):
+    """
+    Columns in `index` of the labels of a comma-joined label string.
+    Labels not in `index` are ignored.
+    """
+    return {index[label.strip()] for label in issue_labels.split(',') if label.strip() in index}
+
+
+def build_dashboard(labels, metadata: dict, progress_labels: dict):
+    """
+    Compute the goal x role x status cube of a sequence of label strings.
+
+    Goals and roles are read from the activities metadata, in the order
+    they are defined there.
+    """
+    goals = [goal['name'] for goal in metadata['goals']]
+    roles = list(metadata['roles'])
+    statuses = [progress_labels['not_started'], progress_labels['in_progress'],
+                progress_labels['done']]
+    index = {label: col for col, label in enumerate(goals + roles + statuses)}
+    n_goals = len(goals)
+    n_roles = len(roles)
+
+    cube = [[[0] * (len(statuses) + 1) for _ in range(n_roles + 1)] for _ in range(n_goals)]
+    combo_status = {}
+    for issue_labels, count in Counter(labels).items():
+        columns = get_label_columns(issue_labels, index)
+        # Exclusive status: first progress label held, else unknown (last).
+        status = next((s for s in range(len(statuses)) if n_goals + n_roles + s in columns), len(statuses))
+        combo_status[issue_labels] = status
+        held_roles = [r for r in range(n_roles) if n_goals + r in columns] + [n_roles]
+        for g in range(n_goals):
+            if g in columns:
+                for r in held_roles:
+                    cube[g][r][status] += count
+
+    status = [combo_status[issue_labels] for issue_labels in labels]
+    return Dashboard(goals, roles + [all_roles], statuses + [unknown_status], status, cube)
+
+
+def count_statuses(dashboard: Dashboard):
+    """
+    Number of issues of each status, goals or not.
+    """
+    counts = Counter(dashboard.status)
+    return [counts[s] for s in range(len(dashboard.statuses))]
+
+
+def count_goals(dashboard: Dashboard, status: str, role: str = all_roles):
+    """
+    Number of issues of each goal for a status, and optionally a role.
+    """
+    r = dashboard.roles.index(role)
+    s = dashboard.statuses.index(status)
+    return [per_role[r][s] for per_role in dashboard.cube]
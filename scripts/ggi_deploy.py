@@ -19,7 +19,7 @@ This script:
 The script expects your GitLab private key in the environment variable: GGI_GITLAB_TOKEN
 You may also set an environment variable 'GGI_DEMO_MODE' to 'true' to activate the demo mode.
 
-usage: ggi_deploy [-h] [-a] [-b] [-d] [-p]
+usage: ggi_deploy [-h] [-a] [-b] [-d] [-p] [-r] [-n] [-g] [--batch-size BATCH_SIZE] [--profile]
 
 optional arguments:
   -h, --help                  Show this help message and exit
@@ -28,6 +28,10 @@ optional arguments:
   -b, --board                 Create board
   -d, --project-description   Update Project Description with pointers to the Board and Dashboard
   -p, --schedule-pipeline     Schedule nightly pipeline to update dashboard
+  -n, --dry-run               Only print the deployment plan, do not apply it
+  -g, --graphql               Create activities with batched GraphQL mutations (GitHub only)
+  --batch-size                Number of activities created per GraphQL request
+  --profile                   Profile the run with cProfile, next to the run report in web/ggi_runs
 """
 
 import argparse
@@ -40,6 +44,9 @@ import re
 
 from collections import OrderedDict
 
+# Activity ids are read with the same regexp by the website.
+from ggi_scorecard import re_activity_id
+
 # Define some variables.
 conf_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/conf'
 activities_file = conf_dir + '/ggi_activities_full.json'
@@ -79,6 +86,23 @@ def parse_args():
                         dest='opt_random',
                         action='store_true',
                         help='Random Scorecard objectives and Activities status, for demo purposes')
+    parser.add_argument('-n', '--dry-run',
+                        dest='opt_dry_run',
+                        action='store_true',
+                        help='Only print the deployment plan, do not apply it')
+    parser.add_argument('-g', '--graphql',
+                        dest='opt_graphql',
+                        action='store_true',
+                        help='Create activities with batched GraphQL mutations (GitHub only)')
+    parser.add_argument('--batch-size',
+                        dest='opt_batch_size',
+                        type=int,
+                        default=10,
+                        help='Number of activities created per GraphQL request (default: 10)')
+    parser.add_argument('--profile',
+                        dest='opt_profile',
+                        action='store_true',
+                        help='Profile the run with cProfile, next to the run report in web/ggi_runs')
     args = parser.parse_args()
 
     if 'GGI_DEMO_MODE' in os.environ:
@@ -113,21 +137,23 @@ def retrieve_env():
     return metadata, params, init_scorecard
 
 
-def get_scorecard(opt_random, init_scorecard):
+def get_scorecard(opt_random, init_scorecard, rnd=random):
     """
     Build a scorecard with a random number of objectives,
     randomly checked, if required by user.
     Otherwise, simply return the untouched scorecard text
+
+    Random draws come from `rnd`, e.g. a seeded random.Random.
     """
 
     if opt_random:
         # Create between 4 and 10 objectives per Scorecard
-        num_lines = random.randint(4, 10)
+        num_lines = rnd.randint(4, 10)
         objectives_list = []
         for idx in range(num_lines):
             objectives = "- [ ] objective " + str(idx) + " \n"
             # aim at 25% of objectives done
-            if random.randint(1, 4) == 1:
+            if rnd.randint(1, 4) == 1:
                 objectives = objectives.replace("[ ]", "[x]")
             objectives_list.append(objectives)
         return ''.join(init_scorecard).replace("What we aim to achieve in this iteration.", ''.join(objectives_list))
@@ -135,7 +161,7 @@ def get_scorecard(opt_random, init_scorecard):
         return init_scorecard
 
 
-def extract_sections(args, init_scorecard, activity):
+def extract_sections(args, init_scorecard, activity, rnd=random):
     """
     Extracts the scorecard from the "Introduction" section in the
     description field of an issue.
@@ -154,10 +180,100 @@ def extract_sections(args, init_scorecard, activity):
     # Add Activity ID
     content_text = content['Introduction'][1] + '\n\n'
     # Add Scorecard
-    content_text += ''.join(get_scorecard(args.opt_random, init_scorecard))
+    content_text += ''.join(get_scorecard(args.opt_random, init_scorecard, rnd))
     del content['Introduction']
     # Add description content.
     for key in content.keys():
         content_text += f"\n\n### {key}\n\n"
         content_text += '\n\n'.join(content[key])
     return content_text
+
+
+def build_activity_issues(args, metadata, params, init_scorecard, rnd=random):
+    """
+    Build the payloads (title, body, labels) of all activity issues,
+    so they can be submitted in bulk.
+    """
+    payloads = []
+    for activity in metadata['activities']:
+        progress_label = params['progress_labels']['not_started']
+        if args.opt_random:
+            # randomly choose among valid progress labels
+            # + artificially introduce an extra option for no progress label
+            progress_idx = rnd.choice(list(params['progress_labels']) + ['none'])
+            if progress_idx != 'none':
+                progress_label = params['progress_labels'][progress_idx]
+        labels = [activity['goal']] + activity['roles']
+        if progress_label != '':
+            labels = labels + [progress_label]
+        payloads.append({'activity_id': activity['id'],
+                         'title': activity['name'],
+                         'body': extract_sections(args, init_scorecard, activity, rnd),
+                         'labels': labels})
+    return payloads
+
+
+def get_desired_labels(metadata, params):
+    """
+    Build the ordered mapping of all labels needed by the board (roles,
+    progress and goals) to their colour.
+    """
+    desired = OrderedDict()
+    for label, colour in metadata['roles'].items():
+        desired[label] = colour
+    for name, label in params['progress_labels'].items():
+        desired[label] = '#ed9121'
+    for goal in metadata['goals']:
+        desired[goal['name']] = goal['colour']
+    return desired
+
+
+def plan_labels(desired, existing):
+    """
+    Diff desired labels against existing ones, both given as name -> colour
+    mappings. Returns the lists of (name, colour) labels to create and
+    to update.
+    """
+    print(" Plan labels")
+    creates = []
+    updates = []
+    for name, colour in desired.items():
+        if name not in existing:
+            creates.append((name, colour))
+        elif existing[name].lstrip('#').lower() != colour.lstrip('#').lower():
+            updates.append((name, colour))
+        else:
+            print(f" Ignore label: {name}")
+    return creates, updates
+
+
+def get_activity_id(body):
+    """
+    Read the activity id (e.g. GGI-A-17) from the `Activity ID` marker
+    of an issue description, or return None if there is none.
+    """
+    match = re_activity_id.search(body or '')
+    return match.group('activity_id') if match else None
+
+
+def plan_activities(payloads, existing_bodies):
+    """
+    Select the activity payloads which have no matching issue yet, given
+    the descriptions of all existing issues (open or closed).
+    """
+    print(" Plan activities")
+    existing = {get_activity_id(body) for body in existing_bodies}
+    missing = [p for p in payloads if p['activity_id'] not in existing]
+    print(f"  {len(payloads) - len(missing)} activities already exist, {len(missing)} to create.")
+    return missing
+
+
+def plan_board_lists(metadata, existing_lists):
+    """
+    Select the goals which have no list on the board yet, in the order
+    of goals, given the label names of existing board lists.
+    """
+    print(" Plan board lists")
+    missing = [g['name'] for g in metadata['goals'] if g['name'] not in existing_lists]
+    print(f"  {len(metadata['goals']) - len(missing)} lists already exist, {len(missing)} to create.")
+    return missing
@@ -14,11 +14,13 @@
 """
 import time
 import urllib.parse
-import requests
 
 from ggi_deploy import *
 from github import Github, GithubException
 from github import Auth
+from ggi_graphql import GraphQLError, close_graphql_clients, get_graphql_client, get_graphql_url
+from ggi_http import ForgeSession, get_github_throttle, install_github_session, report_throttles
+from ggi_instrument import instrument
 
 
 def main():
@@ -26,70 +28,70 @@ def main():
     Main GITHUB.
     """
     args = parse_args()
+    instrument.start('ggi_deploy_github', profile=args.opt_profile)
 
     print("* Using GitHub backend.")
-    metadata, params, init_scorecard = retrieve_env()
+    with instrument.span('env'):
+        metadata, params, init_scorecard = retrieve_env()
     setup_github(metadata, params, init_scorecard, args)
 
     print("\nDone.")
 
-def create_github_label(repo, new_label, label_args):
-    existing_labels = {label.name for label in repo.get_labels()}
-
+def sync_github_labels(repo, metadata, params, dry_run=False):
     """
-    Creates a set of labels in the GitHub project.
+    Reconciles the labels of the GitHub project with the desired roles,
+    progress and goal labels, listing existing labels only once. Nothing
+    is changed if `dry_run` is set.
     """
-    if new_label in existing_labels:
-        print(f" Ignore label: {new_label}")
-    else:
-        print(f" Create label: {new_label}")
-        name = label_args['name']
-        color = label_args['color'].replace("#","")
-        repo.create_label(name, color)
-
-def get_owner_id(owner, gh_token):
-    url = 'https://api.github.com/graphql'
-
-    headers = {
-        'Authorization': f'bearer {gh_token}',
-        'Content-Type': 'application/json'
+    labels = {label.name: label for label in repo.get_labels()}
+    creates, updates = plan_labels(get_desired_labels(metadata, params),
+                                   {name: label.color for name, label in labels.items()})
+    if dry_run:
+        [print(f" Would create label: {name}") for name, colour in creates]
+        [print(f" Would update label: {name}") for name, colour in updates]
+        return
+    for name, colour in creates:
+        print(f" Create label: {name}")
+        labels[name] = repo.create_label(name, colour.lstrip('#'))
+    for name, colour in updates:
+        print(f" Update label: {name} ({labels[name].color} -> {colour})")
+        labels[name].edit(name, colour.lstrip('#'))
+
+graphql_labels_query = """
+    query GgiLabels($owner: String!, $name: String!, $cursor: String) {
+      rateLimit { cost remaining }
+      repository(owner: $owner, name: $name) {
+        labels(first: 100, after: $cursor) {
+          pageInfo { hasNextPage endCursor }
+          nodes { id name }
+        }
+      }
     }
+"""
 
-    query = """
-        query ($owner: String!) {
-          user(login: $owner) {
-            id
-            next_global_id
-          }
-          organization(login: $owner) {
-            id
-            next_global_id
-          }
-        }
+def get_label_ids(params):
     """
-
-    variables = {"owner": owner}
-    response = requests.post(url, headers=headers, json={'query': query, 'variables': variables})
-
-    if response.status_code == 200:
-        data = response.json()
-        print("Réponse GitHub pour owner ID:", data)  # DEBUG
-
-        # Vérifier si c'est un utilisateur
-        if data.get('data', {}).get('user'):
-            user_data = data['data']['user']
-            return user_data.get('next_global_id', user_data['id'])  # Utilise next_global_id si disponible
-
-        # Vérifier si c'est une organisation
-        elif data.get('data', {}).get('organization'):
-            org_data = data['data']['organization']
-            return org_data.get('next_global_id', org_data['id'])  # Utilise next_global_id si disponible
-
-        else:
-            raise Exception("Impossible de récupérer l'ID du propriétaire.")
-
-    else:
-        raise Exception(f"Query failed with status {response.status_code}: {response.text}")
+    Returns an index of label names to their GraphQL node id, listed with
+    one query per 100 labels.
+    """
+    client = get_github_graphql_client(params)
+    owner, name = params['github_project'].split('/')
+    label_ids = {}
+    cursor = None
+    while True:
+        page = client.query(graphql_labels_query,
+                            {'owner': owner, 'name': name, 'cursor': cursor})['repository']['labels']
+        label_ids.update({label['name']: label['id'] for label in page['nodes']})
+        if not page['pageInfo']['hasNextPage']:
+            return label_ids
+        cursor = page['pageInfo']['endCursor']
+
+def get_github_graphql_client(params):
+    """
+    Get the GraphQL client of the GitHub instance, shared by all phases.
+    """
+    api_url = None if params['github_url'].startswith('https://github.com') else params['github_url']
+    return get_graphql_client(get_graphql_url(api_url), params['github_token'])
 
 def setup_github(metadata, params: dict, init_scorecard, args: dict):
     """
@@ -121,15 +123,22 @@ def setup_github(metadata, params: dict, init_scorecard, args: dict):
         params['github_url'] = public_github
         print("- Using default public URL")
 
+    # Pacing and rate-limit retries are done by the shared throttle,
+    # instead of PyGithub's fixed delays between requests.
     if params['github_url'].startswith(public_github):
         # Public Web Github
         print("- Using public GitHub instance.")
-        g = Github(auth=auth)
+        install_github_session(ForgeSession(throttle=get_github_throttle('https://api.github.com')),
+                               'https://api.github.com')
+        g = Github(auth=auth, retry=0, seconds_between_requests=None, seconds_between_writes=None)
     else:
         print(f"- Using GitHub on-premise host {params['github_url']} ")
         # Github Enterprise with custom hostname
         params['github_url'] = f"{params['github_url']}/api/v3"
-        g = Github(auth=auth, base_url=params['github_url'])
+        install_github_session(ForgeSession(throttle=get_github_throttle(params['github_url'])),
+                               params['github_url'])
+        g = Github(auth=auth, base_url=params['github_url'], retry=0,
+                   seconds_between_requests=None, seconds_between_writes=None)
 
     # Gett conf: Project
     if 'GGI_GITHUB_PROJECT' in os.environ:
@@ -160,10 +169,11 @@ def setup_github(metadata, params: dict, init_scorecard, args: dict):
     # Connecting to the GitHub instance.
 
     print(f"\n# Retrieving project from GitHub at {params['github_repo_url']}.")
-    repo = g.get_repo(params['github_project'])
+    with instrument.span('connect'):
+        repo = g.get_repo(params['github_project'])
 
     # Update current project description with Website URL
-    if args.opt_projdesc:
+    if args.opt_projdesc and not args.opt_dry_run:
         print("\n# Update Project description")
         ggi_activities_url = params['github_activities_url']
 
@@ -183,436 +193,412 @@ def setup_github(metadata, params: dict, init_scorecard, args: dict):
     #
     # Create labels & activities
     #
+    failed = []
     if args.opt_activities:
 
         # Create labels.
         print("\n# Manage labels")
-
-        # Create role labels if needed
-        print("\n Roles labels")
-        for label, colour in metadata['roles'].items():
-            create_github_label(repo, label, {'name': label, 'color': colour})
-
-        # Create labels for activity tracking
-        print("\n Progress labels")
-        for name, label in params['progress_labels'].items():
-            create_github_label(repo, label, {'name': label, 'color': 'ed9121'})
-
-        # Create goal labels if needed
-        print("\n Goal labels")
-        for goal in metadata['goals']:
-            create_github_label(repo, goal['name'],
-                                {'name': goal['name'], 'color': goal['colour']})
-
-        # Create issues with their associated labels.
-        print("\n# Create activities.")
-        # First test the existence of Activities Issues:
-        #   if at least one Issue is found bearing one Goal label,
-        #   consider that all Issues exist and do not add any.
-        open_issues = repo.get_issues(state='open')
-        if open_issues.totalCount > 0:
-            print("Ignore, Issues already exist")
-        else:
-            for activity in metadata['activities']:
-                progress_label = params['progress_labels']['not_started']
-                if args.opt_random:
-                    # Choix aléatoire parmi les étiquettes de progression valides
-                    progress_idx = random.choice(list(params['progress_labels']) + ['none'])
-                    if progress_idx != 'none':
-                        progress_label = params['progress_labels'][progress_idx]
-                labels = [activity['goal']] + activity['roles']
-                if progress_label != '':
-                    labels = labels + [progress_label]
-
-                print(f"  - Issue: {activity['name']:<60} Labels: {labels}")
-                # Création de l'issue
-                try:
-                    issue = repo.create_issue(
-                        title=activity['name'],
-                        body=extract_sections(args, init_scorecard, activity),
-                        labels=labels
-                    )
-                    time.sleep(2)
-                except GithubException as e:
-                    print(f"Status: {e.status}, Data: {e.data}")
+        with instrument.span('labels'):
+            sync_github_labels(repo, metadata, params, args.opt_dry_run)
+
+        # Create the issues of activities which do not exist yet,
+        # matching existing issues (open or closed) by their Activity ID.
+        with instrument.span('activities'):
+            print("\n# Create activities.")
+            payloads = build_activity_issues(args, metadata, params, init_scorecard)
+            missing = plan_activities(payloads, [i.body for i in repo.get_issues(state='all')])
+            if args.opt_dry_run:
+                [print(f"  - Would create issue: {p['activity_id']} {p['title']}") for p in missing]
+            elif len(missing) == 0:
+                print("Ignore, all activities already exist")
+            elif args.opt_graphql:
+                failed = provision_issues_graphql(params, repo, get_label_ids(params), missing,
+                                                  args.opt_batch_size)
+            else:
+                failed = provision_issues_rest(repo, missing)
 
     # Create Goals board
+    board_failed = []
     if args.opt_board:
-        create_project_graphql(params)
+        with instrument.span('board'):
+            board_failed = create_project_graphql(params, args.opt_dry_run)
 
-    # Close the connection.
+    # Close the connections.
     g.close()
+    close_graphql_clients()
+    report_throttles()
+
+    if failed:
+        print(f"\n# {len(failed)} activities could not be created, re-run me to create them:")
+        [print(f"- {p['activity_id']} {p['title']}") for p in failed]
+    if board_failed:
+        print(f"\n# {len(board_failed)} issue(s) could not be put on the Goals board, re-run me to retry:")
+        [print(f"- {title}") for title in board_failed]
+    if failed or board_failed:
+        exit(1)
 
-def create_project_graphql(params):
-    print(f"\n# Create Goals board: {ggi_board_name}")
 
-    access_token = params['github_token']
-    headers = {'Authorization': f'bearer {access_token}'}
-    graphql_url = 'https://api.github.com/graphql'
-
-    repo_infos = params['github_project'].split("/")
-    repo_owner = repo_infos[0]
-    repo_name = repo_infos[1]
-
-    # Query to check for an existing project
-    query = """
-        query ($repo_owner: String!, $repo_name: String!, $project_name: String!) {
-          repository(owner: $repo_owner, name: $repo_name) {
-            projects(search: $project_name, first: 10) {
-              nodes {
-                id
-                name
-              }
-            }
-          }
-        }
-        """
-    variables = {
-        "repo_owner": repo_owner,
-        "repo_name": repo_name,
-        "project_name": "Goals Project"
-    }
-    response = requests.post(graphql_url, json={'query': query, 'variables': variables}, headers=headers)
-    projects_data = json.loads(response.text)
-
-    # Check if project exists and find its ID
-    project_id = None
-    for project in projects_data['data']['repository']['projects']['nodes']:
-        if project['name'] == variables['project_name']:
-            project_id = project['id']
-            break
+def provision_issues_rest(repo, payloads):
+    """
+    Creates activity issues through the REST API, in the order of the
+    activities. Pacing is left to the shared throttle.
 
-    # If the project does not exist, create it
-    if not project_id:
-        mutation_create_project = """
-            mutation ($title: String!, $owner_id: ID!) {
-              createProjectV2(input: {title: $title, ownerId: $owner_id}) {
-                projectV2 {
-                  id
-                  title
-                }
-              }
-            }
-        """
+    Returns the payloads of the issues which could not be created.
+    """
+    print(f"  Creating {len(payloads)} issues.")
+    failed = []
+    for payload in payloads:
+        print(f"  - Issue: {payload['title']:<60} Labels: {payload['labels']}")
+        try:
+            repo.create_issue(title=payload['title'], body=payload['body'], labels=payload['labels'])
+        except GithubException as e:
+            print(f"    Failed with status {e.status}: {e.data}")
+            failed.append(payload)
+    return failed
+
+
+def provision_issues_graphql(params, repo, label_ids, payloads, batch_size):
+    """
+    Creates activity issues with batched GraphQL `createIssue` mutations,
+    `batch_size` aliased mutations per request. Mutations of a request are
+    executed in order, so issues keep the order of the activities.
 
-        # Fetching the repository ID for ownerId in mutation
-        repo_id_query = """
-            query ($repo_owner: String!, $repo_name: String!) {
-              repository(owner: $repo_owner, name: $repo_name) {
-                id
-              }
+    Returns the payloads of the issues which could not be created. When a
+    request answers with errors, the mutations which succeeded are kept.
+    """
+    print(f"  Creating {len(payloads)} issues with GraphQL, {batch_size} per request.")
+    client = get_github_graphql_client(params)
+
+    # Label node ids come from the label index, the repository id is
+    # already known from the REST API.
+    repo_id = repo.raw_data['node_id']
+
+    failed = []
+    for start in range(0, len(payloads), batch_size):
+        batch = payloads[start:start + batch_size]
+        declarations = []
+        mutations = []
+        variables = {}
+        for idx, payload in enumerate(batch):
+            print(f"  - Issue: {payload['title']:<60} Labels: {payload['labels']}")
+            declarations.append(f"$i{idx}: CreateIssueInput!")
+            mutations.append(f"i{idx}: createIssue(input: $i{idx}) {{ issue {{ number }} }}")
+            variables[f"i{idx}"] = {
+                'repositoryId': repo_id,
+                'title': payload['title'],
+                'body': payload['body'],
+                'labelIds': [label_ids[label] for label in payload['labels'] if label in label_ids]
             }
-            """
-
-        variables = {
-            "repo_owner": repo_owner,
-            "repo_name": repo_name
+        mutation = f"mutation GgiCreateIssues({', '.join(declarations)}) {{\n  " + \
+                   '\n  '.join(mutations) + "\n}"
+        batch_start = time.perf_counter()
+        try:
+            data = client.query(mutation, variables)
+        except GraphQLError as e:
+            data = e.data or {}
+            for error in e.errors:
+                print(f"    Error on {'.'.join(str(p) for p in error.get('path') or ['request'])}: " +
+                      f"{error.get('message')}")
+        except Exception as e:
+            print(f"  Batch {start // batch_size + 1} failed: {e}")
+            failed.extend(batch)
+            continue
+        created = {idx: data[f"i{idx}"]['issue']['number'] for idx in range(len(batch)) if data.get(f"i{idx}")}
+        failed.extend(payload for idx, payload in enumerate(batch) if idx not in created)
+        if len(created) < len(batch):
+            print(f"    Created: {', '.join(f'i{idx} (#{number})' for idx, number in created.items()) or 'none'}.")
+        print(f"  Batch {start // batch_size + 1}: {len(created)} of {len(batch)} issue(s) created " +
+              f"in {time.perf_counter() - batch_start:.2f}s.")
+
+    client.report()
+    return failed
+
+
+goals_project_title = 'Goals Project'
+goals_field_name = 'Goal Category'
+goals_field_options = [
+    {"name": "Culture Goal", "description": "A culture-related goal", "color": "GREEN"},
+    {"name": "Engagement Goal", "description": "An engagement-related goal", "color": "GREEN"},
+    {"name": "Strategy Goal", "description": "A strategy-related goal", "color": "GREEN"},
+    {"name": "Trust Goal", "description": "A trust-related goal", "color": "GREEN"},
+    {"name": "Usage Goal", "description": "A usage-related goal", "color": "GREEN"}
+]
+
+graphql_resolve_board_query = """
+    query GgiResolveBoard($owner: String!, $name: String!, $title: String!, $field: String!) {
+      rateLimit { cost remaining }
+      repository(owner: $owner, name: $name) {
+        id
+        owner { id }
+        projectsV2(query: $title, first: 10) {
+          nodes {
+            id
+            title
+            field(name: $field) { ... on ProjectV2SingleSelectField { id } }
+          }
         }
-        repo_response = requests.post(graphql_url, json={'query': repo_id_query, 'variables': variables}, headers=headers)
-        repo_id = json.loads(repo_response.text)['data']['repository']['id']
-        print("repo ID = " + repo_id)
-
-        owner_id_query = """
-            query ($repo_owner: String!) {
-              user(login: $repo_owner) {
-                id
-              }
-              organization(login: $repo_owner) {
-                id
-              }
-            }
-        """
-
-        variables = {"repo_owner": repo_owner}
-        owner_response = requests.post(graphql_url, json={'query': owner_id_query, 'variables': variables},
-                                       headers=headers)
-        owner_data = owner_response.json()
-
-        print("Réponse GitHub pour owner ID:", owner_data)  # Vérification
+      }
+    }
+"""
 
-        # Vérifie si c'est un utilisateur ou une organisation
-        if owner_data.get('data', {}).get('user'):
-            owner_id = owner_data['data']['user']['id']
-        elif owner_data.get('data', {}).get('organization'):
-            owner_id = owner_data['data']['organization']['id']
-        else:
-            raise Exception("Impossible de récupérer l'ID du propriétaire.")
+graphql_create_project_mutation = """
+    mutation GgiCreateProject($title: String!, $owner_id: ID!, $repo_id: ID!) {
+      createProjectV2(input: {title: $title, ownerId: $owner_id, repositoryId: $repo_id}) {
+        projectV2 { id title }
+      }
+    }
+"""
 
-        print(f"Owner ID récupéré : {owner_id}")  # Vérifie que cet ID est correct
+graphql_create_field_mutation = """
+    mutation GgiCreateGoalField($project_id: ID!, $name: String!, $options: [ProjectV2SingleSelectFieldOptionInput!]!) {
+      createProjectV2Field(input: {projectId: $project_id, name: $name, dataType: SINGLE_SELECT,
+                                   singleSelectOptions: $options}) {
+        projectV2Field { ... on ProjectV2SingleSelectField { id name options { id name } } }
+      }
+    }
+"""
 
 
-        # Creating the project
-        create_variables = {
-            "title": "Goals Project",
-            "owner_id": owner_id
-        }
+def get_board_keys(owner, name):
+    return {'repo_id': f"repo {owner}/{name}",
+            'owner_id': f"owner {owner}",
+            'project_id': f"project {owner}/{name} {goals_project_title}",
+            'field_id': f"field {owner}/{name} {goals_project_title} {goals_field_name}"}
 
 
-        project_response = requests.post(graphql_url,
-                                         json={'query': mutation_create_project, 'variables': create_variables},
-                                         headers=headers)
-        project_data = json.loads(project_response.text)
-        # Print the entire response to inspect what GitHub API returned
-        print("GitHub API response:", project_data)
-
-        # Check if 'errors' key is present in the response
-        if 'errors' in project_data:
-            print("Errors returned from the GitHub API:", project_data['errors'])
-        else:
-            project_id = project_data['data']['createProjectV2']['projectV2']['id']
-            print(f"Created new project: {project_data['data']['createProjectV2']['projectV2']['title']} (ID: {project_data['data']['createProjectV2']['projectV2']['id']})")
-
-            # Définition des valeurs du champ "Single Select"
-            options = [
-                {"name": "Culture Goal", "description": "A culture-related goal", "color": "GREEN"},
-                {"name": "Engagement Goal", "description": "An engagement-related goal", "color": "GREEN"},
-                {"name": "Strategy Goal", "description": "A strategy-related goal", "color": "GREEN"},
-                {"name": "Trust Goal", "description": "A trust-related goal", "color": "GREEN"},
-                {"name": "Usage Goal", "description": "A usage-related goal", "color": "GREEN"}
-            ]
-
-            # Définition de la mutation GraphQL
-            mutation_add_field = """
-                mutation ($project_id: ID!, $name: String!, $options: [ProjectV2SingleSelectFieldOptionInput!]!) {
-                  createProjectV2Field(input: { 
-                    projectId: $project_id, 
-                    name: $name, 
-                    dataType: SINGLE_SELECT,
-                    singleSelectOptions: $options
-                  }) {
-                    projectV2Field {
-                      ... on ProjectV2SingleSelectField {
-                        id
-                        name
-                        options {
-                          id
-                          name
-                          description
-                          color
-                        }
-                      }
-                    }
-                  }
-                }
-            """
-
-            # Variables pour la mutation
-            variables = {
-                "project_id": project_id,
-                "name": "Goal Category",
-                "options": options
-            }
+def resolve_board(client, owner, name):
+    """
+    Resolve the node ids of the repository, its owner, the Goals project
+    and its Goal Category field, in a single query. Ids saved by previous
+    runs are used if they are all known.
 
-            # Exécution de la requête
-            response = requests.post(graphql_url, json={"query": mutation_add_field, "variables": variables},
-                                     headers=headers)
-            data = response.json()
+    Returns key: node id, with None for the project and field if missing.
+    """
+    keys = get_board_keys(owner, name)
+    ids = {key: client.nodes.get(client.url, node_key) for key, node_key in keys.items()}
+    if all(ids.values()):
+        print(" Using saved node ids.")
+        return ids
+
+    repo = client.query(graphql_resolve_board_query, {'owner': owner, 'name': name, 'title': goals_project_title,
+                                                      'field': goals_field_name})['repository']
+    if not repo:
+        raise Exception(f"Cannot find repository {owner}/{name}.")
+    project = next((p for p in repo['projectsV2']['nodes'] if p['title'] == goals_project_title), None)
+    ids = {'repo_id': repo['id'], 'owner_id': repo['owner']['id'],
+           'project_id': project['id'] if project else None,
+           'field_id': project['field']['id'] if project and project['field'] else None}
+    for key, node_id in ids.items():
+        if node_id:
+            client.nodes.set(client.url, keys[key], node_id)
+    return ids
+
+
+def create_project_graphql(params, dry_run=False):
+    """
+    Creates the Goals project of the repository and its Goal Category
+    field if they do not exist, then adds the issues to it. Only prints
+    what would be created if `dry_run` is set.
 
-            # Vérification de la réponse
-            print("Réponse GitHub:", json.dumps(data, indent=4))
+    When saved node ids turn out to be stale, they are forgotten and
+    resolved again.
 
-            if "errors" in data:
-                print("❌ Erreur:", data["errors"])
+    Returns the titles of the issues which could not be put on the board.
+    """
+    print(f"\n# Create Goals board: {ggi_board_name}")
+    client = get_github_graphql_client(params)
+    owner, name = params['github_project'].split('/')
+
+    for attempt in range(2):
+        ids = resolve_board(client, owner, name)
+        if dry_run:
+            if ids['project_id']:
+                print(" Board already exists")
             else:
-                print(f"✅ Champ créé: {data['data']['createProjectV2Field']['projectV2Field']['name']}")
-                for option in data['data']['createProjectV2Field']['projectV2Field']['options']:
-                    print(f"   - Option: {option['name']} (ID: {option['id']}, Color: {option['color']}, Description: {option['description']})")
-
-            # 🔹 Correspondance labels → options du champ "Goal Category"
-            goal_mapping = {
-                "Culture Goal": "Culture Goal",
-                "Engagement Goal": "Engagement Goal",
-                "Strategy Goal": "Strategy Goal",
-                "Trust Goal": "Trust Goal",
-                "Usage Goal": "Usage Goal"
+                print(" Would create board")
+            if not ids['field_id']:
+                print(f" Would create field: {goals_field_name} " +
+                      f"({', '.join(o['name'] for o in goals_field_options)})")
+            return []
+        try:
+            if not ids['project_id']:
+                project = client.query(graphql_create_project_mutation,
+                                       {'title': goals_project_title, 'owner_id': ids['owner_id'],
+                                        'repo_id': ids['repo_id']})['createProjectV2']['projectV2']
+                ids['project_id'] = project['id']
+                client.nodes.set(client.url, get_board_keys(owner, name)['project_id'], project['id'])
+                print(f" Created project: {project['title']} ({project['id']})")
+            if not ids['field_id']:
+                field = client.query(graphql_create_field_mutation,
+                                     {'project_id': ids['project_id'], 'name': goals_field_name,
+                                      'options': goals_field_options})['createProjectV2Field']['projectV2Field']
+                client.nodes.set(client.url, get_board_keys(owner, name)['field_id'], field['id'])
+                print(f" Created field: {field['name']} ({', '.join(o['name'] for o in field['options'])})")
+
+            # Add issues to the board and set their Goal Category.
+            return populate_project_graphql(params, ids['project_id'])
+        except GraphQLError as e:
+            if attempt > 0 or not e.is_not_found():
+                raise
+            print(" Saved node ids are stale, resolving them again.")
+            client.nodes.forget(client.url, get_board_keys(owner, name).values())
+
+
+graphql_board_query = """
+    query GgiProjectBoard($project_id: ID!, $cursor: String) {
+      rateLimit { cost remaining }
+      node(id: $project_id) {
+        ... on ProjectV2 {
+          field(name: "Goal Category") {
+            ... on ProjectV2SingleSelectField { id options { id name } }
+          }
+          items(first: 100, after: $cursor) {
+            pageInfo { hasNextPage endCursor }
+            nodes {
+              id
+              content { ... on Issue { id } }
+              fieldValueByName(name: "Goal Category") {
+                ... on ProjectV2ItemFieldSingleSelectValue { optionId }
+              }
             }
-
-            # # 🔹 Étape 1 : Récupérer les issues et leurs labels
-            # query_issues = """
-            #     query ($repo_owner: String!, $repo_name: String!) {
-            #       repository(owner: $repo_owner, name: $repo_name) {
-            #         issues(first: 25) {
-            #           nodes {
-            #             id
-            #             title
-            #             labels(first: 10) {
-            #               nodes {
-            #                 name
-            #               }
-            #             }
-            #           }
-            #         }
-            #       }
-            #     }
-            # """
-            #
-            # variables = {"repo_owner": repo_owner, "repo_name": repo_name}
-            # response = requests.post(graphql_url, json={"query": query_issues, "variables": variables}, headers=headers)
-            # issues_data = response.json()
-            #
-            # issues = issues_data.get("data", {}).get("repository", {}).get("issues", {}).get("nodes", [])
-            # print(f"🔹 {len(issues)} issues trouvées")
-            #
-            # # 🔹 Étape 2 : Ajouter chaque issue au projet et assigner le champ Goal Category
-            # mutation_add_issue = """
-            #     mutation ($project_id: ID!, $issue_id: ID!) {
-            #       addProjectV2ItemById(input: {projectId: $project_id, contentId: $issue_id}) {
-            #         item {
-            #           id
-            #         }
-            #       }
-            #     }
-            # """
-            #
-            # # Récupérer l'ID du champ "Goal Category" et ses options
-            # query_project_fields = """
-            #     query ($project_id: ID!) {
-            #       node(id: $project_id) {
-            #         ... on ProjectV2 {
-            #           fields(first: 20) {
-            #             nodes {
-            #               __typename
-            #               ... on ProjectV2Field {
-            #                 id
-            #                 name
-            #               }
-            #               ... on ProjectV2SingleSelectField {
-            #                 id
-            #                 name
-            #                 options {
-            #                   id
-            #                   name
-            #                 }
-            #               }
-            #             }
-            #           }
-            #         }
-            #       }
-            #     }
-            # """
-            #
-            # print(f"🔹 Vérification : Project ID utilisé = {project_id}")
-            #
-            # response = requests.post(graphql_url,
-            #                          json={"query": query_project_fields, "variables": {"project_id": project_id}},
-            #                          headers=headers)
-            # fields_data = response.json()
-            #
-            # # Vérifier que "data" est présent
-            # if "data" not in fields_data:
-            #     print("❌ Erreur: La réponse de GitHub ne contient pas 'data'. Voici la réponse complète :")
-            #     print(json.dumps(fields_data, indent=4))
-            #     exit()
-            #
-            # goal_field = None
-            # goal_options = {}
-            #
-            # for field in fields_data["data"]["node"]["fields"]["nodes"]:
-            #     if field["__typename"] == "ProjectV2SingleSelectField" and field["name"] == "Goal Category":
-            #         goal_field = field["id"]
-            #         for option in field["options"]:
-            #             goal_options[option["name"]] = option["id"]
-            #
-            # print("📌 Options disponibles pour 'Goal Category':", goal_options)
-            #
-            # if not goal_field:
-            #     print("❌ Le champ 'Goal Category' n'a pas été trouvé dans le projet.")
-            #     exit()
-            # else:
-            #     print(f"✅ Champ 'Goal Category' trouvé avec ID: {goal_field}")
-            #
-            # # 🔹 Étape 3 : Assigner la valeur correcte au champ "Goal Category"
-            # mutation_update_field = """
-            #     mutation ($project_id: ID!, $item_id: ID!, $field_id: ID!, $option_id: ID!) {
-            #       updateProjectV2ItemFieldValue(input: {
-            #         projectId: $project_id,
-            #         itemId: $item_id,
-            #         fieldId: $field_id,
-            #         value: {singleSelectOptionId: $option_id}
-            #       }) {
-            #         projectV2Item {
-            #           id
-            #         }
-            #       }
-            #     }
-            # """
-            #
-            # for issue in issues:
-            #     issue_id = issue["id"]
-            #     labels = [label["name"] for label in issue["labels"]["nodes"]]
-            #
-            #     # Déterminer l'option en fonction du label
-            #     goal_option_id = None
-            #     for label in labels:
-            #         if label in goal_mapping:
-            #             goal_option_name = goal_mapping[label]
-            #             goal_option_id = goal_options.get(goal_option_name)
-            #             break
-            #
-            #     # Ajouter l'issue au projet
-            #     add_response = requests.post(graphql_url, json={"query": mutation_add_issue,
-            #                                                     "variables": {"project_id": project_id,
-            #                                                                   "issue_id": issue_id}}, headers=headers)
-            #     add_data = add_response.json()
-            #
-            #     if "errors" in add_data:
-            #         print("❌ Erreur ajout issue:", add_data["errors"])
-            #         continue
-            #
-            #     item_id = add_data["data"]["addProjectV2ItemById"]["item"]["id"]
-            #
-            #     # Vérifier que l'option est trouvée
-            #     if not goal_option_id:
-            #         print(f"⚠️ Aucun ID d'option trouvé pour l'issue '{issue['title']}', vérifie les labels.")
-            #         continue  # Passe à l'issue suivante
-            #
-            #     # Mise à jour du champ
-            #     print(f"🔹 Mise à jour de l'issue {issue_id} avec {goal_option_id} pour le champ {goal_field}")
-            #     print(f"🛠 Vérification: Type de goal_option_id = {type(goal_option_id)}, valeur = {goal_option_id}")
-            #
-            #     update_response = requests.post(graphql_url, json={"query": mutation_update_field,
-            #                                                        "variables": {"project_id": project_id,
-            #                                                                      "item_id": item_id,
-            #                                                                      "field_id": goal_field,
-            #                                                                      "option_id": goal_option_id}},
-            #                                     headers=headers)
-            #     update_data = update_response.json()
-            #
-            #     print("Réponse GitHub mise à jour:", json.dumps(update_data, indent=4))
-            #
-            #     if "errors" in update_data:
-            #         print(f"❌ Erreur mise à jour du champ pour l'issue '{issue['title']}':", update_data["errors"])
-            #     else:
-            #         print(f"✅ Assigné {goal_option_name} à l'issue '{issue['title']}'")
-
-
-def get_repo_id(headers):
-    graphql_url = 'https://api.github.com/graphql'
-
-    # GraphQL query to get repository owner ID
-    query = """
-    query ($repo_owner: String!, $repo_name: String!) {
-      repository(owner: $repo_owner, name: $repo_name) {
-        owner {
-          id
-          login
-          __typename
+          }
         }
       }
     }
-    """
+"""
 
-    # Variables for the query
-    variables = {
-        "repo_owner": "Sebastienlejeune",  # e.g., 'octocat'
-        "repo_name": "my-ggi-board"  # e.g., 'Hello-World'
+graphql_board_issues_query = """
+    query GgiBoardIssues($owner: String!, $name: String!, $cursor: String) {
+      rateLimit { cost remaining }
+      repository(owner: $owner, name: $name) {
+        issues(first: 100, after: $cursor, states: OPEN) {
+          pageInfo { hasNextPage endCursor }
+          nodes { id title labels(first: 20) { nodes { name } } }
+        }
+      }
     }
+"""
+
+
+def query_batch(client, mutation, variables, batch_name):
+    """
+    Run a batch of aliased mutations, and return the answers by alias.
+    When the request answers with errors, they are printed and the
+    answers of the mutations which succeeded are returned.
+    """
+    try:
+        return client.query(mutation, variables)
+    except GraphQLError as e:
+        for error in e.errors:
+            print(f"    Error on {'.'.join(str(p) for p in error.get('path') or ['request'])}: " +
+                  f"{error.get('message')}")
+        return e.data or {}
+    except Exception as e:
+        print(f"  {batch_name} failed: {e}")
+        return {}
+
+
+def populate_project_graphql(params, project_id, batch_size=50):
+    """
+    Adds the open issues which are not on the Goals board yet, and sets
+    the `Goal Category` field of the board items which have none from
+    their goal label, e.g. items added by a run which failed midway.
 
-    # Make the request to GitHub GraphQL API
-    response = requests.post(graphql_url, json={'query': query, 'variables': variables}, headers=headers)
-    response_data = json.loads(response.text)
-    return response_data
+    The field, its options and the current board items are resolved in
+    one query (plus one per extra page of 100 items). Items are then added
+    and their field set with batches of `batch_size` aliased mutations
+    per request: about four requests for a 100-activity board.
 
+    Returns the titles of the issues which could not be added or set.
+    """
+    print("\n# Populate Goals board")
+    client = get_github_graphql_client(params)
+    owner, name = params['github_project'].split('/')
+
+    # Resolve field, options and issues already on the board, with the
+    # items which have no Goal Category yet.
+    on_board = set()
+    unset = {}
+    cursor = None
+    while True:
+        board = client.query(graphql_board_query, {'project_id': project_id, 'cursor': cursor})['node']
+        for item in board['items']['nodes']:
+            if item['content']:
+                on_board.add(item['content']['id'])
+                if not item['fieldValueByName']:
+                    unset[item['content']['id']] = item['id']
+        if not board['items']['pageInfo']['hasNextPage']:
+            break
+        cursor = board['items']['pageInfo']['endCursor']
+    if not board['field']:
+        print(" Cannot find field 'Goal Category' in project, skipping.")
+        return []
+    field_id = board['field']['id']
+    options = {option['name']: option['id'] for option in board['field']['options']}
+
+    # Select open issues which are not on the board yet, or not set.
+    issues = []
+    pending = []
+    cursor = None
+    while True:
+        page = client.query(graphql_board_issues_query,
+                            {'owner': owner, 'name': name, 'cursor': cursor})['repository']['issues']
+        issues.extend(i for i in page['nodes'] if i['id'] not in on_board)
+        pending.extend((i, unset[i['id']]) for i in page['nodes'] if i['id'] in unset)
+        if not page['pageInfo']['hasNextPage']:
+            break
+        cursor = page['pageInfo']['endCursor']
+    print(f" {len(on_board)} item(s) already on the board, {len(issues)} issue(s) to add, " +
+          f"{len(pending)} item(s) without Goal Category.")
+
+    # Add issues to the board.
+    failed = []
+    for start in range(0, len(issues), batch_size):
+        batch = issues[start:start + batch_size]
+        declarations = ['$project_id: ID!'] + [f"$c{idx}: ID!" for idx in range(len(batch))]
+        mutations = [f"a{idx}: addProjectV2ItemById(input: {{projectId: $project_id, contentId: $c{idx}}}) " +
+                     "{ item { id } }" for idx in range(len(batch))]
+        variables = {f"c{idx}": issue['id'] for idx, issue in enumerate(batch)}
+        variables['project_id'] = project_id
+        data = query_batch(client, f"mutation GgiAddItems({', '.join(declarations)}) {{\n  " +
+                           '\n  '.join(mutations) + "\n}", variables, f"Batch {start // batch_size + 1}")
+        added = 0
+        for idx, issue in enumerate(batch):
+            answer = data.get(f"a{idx}")
+            if answer and answer.get('item'):
+                pending.append((issue, answer['item']['id']))
+                added += 1
+            else:
+                failed.append(issue['title'])
+        print(f"  Batch {start // batch_size + 1}: {added} of {len(batch)} issue(s) added to the board.")
+
+    # Set Goal Category of the new items, and of the ones left unset.
+    updates = []
+    for issue, item_id in pending:
+        goals = [label['name'] for label in issue['labels']['nodes'] if label['name'] in options]
+        if not goals:
+            print(f"  - No goal label found for issue '{issue['title']}', skipping field.")
+            continue
+        updates.append((issue, item_id, options[goals[0]]))
+    for start in range(0, len(updates), batch_size):
+        batch = updates[start:start + batch_size]
+        declarations = ['$project_id: ID!', '$field_id: ID!']
+        mutations = []
+        variables = {'project_id': project_id, 'field_id': field_id}
+        for idx, (issue, item_id, option_id) in enumerate(batch):
+            declarations += [f"$i{idx}: ID!", f"$o{idx}: String!"]
+            mutations.append(f"u{idx}: updateProjectV2ItemFieldValue(input: {{projectId: $project_id, " +
+                             f"itemId: $i{idx}, fieldId: $field_id, value: {{singleSelectOptionId: $o{idx}}}}}) " +
+                             "{ projectV2Item { id } }")
+            variables.update({f"i{idx}": item_id, f"o{idx}": option_id})
+        data = query_batch(client, f"mutation GgiSetGoals({', '.join(declarations)}) {{\n  " +
+                           '\n  '.join(mutations) + "\n}", variables, f"Goals batch {start // batch_size + 1}")
+        done = [idx for idx in range(len(batch)) if data.get(f"u{idx}")]
+        failed.extend(issue['title'] for idx, (issue, _, _) in enumerate(batch) if idx not in done)
+        print(f"  Goals batch {start // batch_size + 1}: {len(done)} of {len(batch)} item(s) set.")
+
+    client.report()
+    return failed
 
 if __name__ == '__main__':
     main()
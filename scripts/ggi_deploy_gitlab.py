@@ -17,6 +17,8 @@ import urllib.parse
 import gitlab
 
 from ggi_deploy import *
+from ggi_http import ForgeSession, get_host_throttle, report_throttles
+from ggi_instrument import instrument
 
 
 def main():
@@ -24,23 +26,40 @@ def main():
     Main GITLAB.
     """
     args = parse_args()
+    instrument.start('ggi_deploy_gitlab', profile=args.opt_profile)
 
     print("* Using GitLab backend.")
-    metadata, params, init_scorecard = retrieve_env()
+    with instrument.span('env'):
+        metadata, params, init_scorecard = retrieve_env()
     setup_gitlab(metadata, params, init_scorecard, args)
 
     print("\nDone.")
 
 
-def create_gitlab_label(project, existing_labels, new_label, label_args):
+def sync_gitlab_labels(project, metadata, params, dry_run=False):
     """
-    Creates a set of labels in the GitLab project.
+    Reconciles the labels of the GitLab project with the desired roles,
+    progress and goal labels, listing existing labels only once. Nothing
+    is changed if `dry_run` is set.
+
+    Returns an index of label names to their id, to be reused by later
+    phases.
     """
-    if new_label in existing_labels:
-        print(f" Ignore label: {new_label}")
-    else:
-        print(f" Create label: {new_label}")
-        project.labels.create(label_args)
+    labels = {label.name: label for label in project.labels.list(all=True)}
+    creates, updates = plan_labels(get_desired_labels(metadata, params),
+                                   {name: label.color for name, label in labels.items()})
+    if dry_run:
+        [print(f" Would create label: {name}") for name, colour in creates]
+        [print(f" Would update label: {name}") for name, colour in updates]
+        return {name: label.id for name, label in labels.items()}
+    for name, colour in creates:
+        print(f" Create label: {name}")
+        labels[name] = project.labels.create({'name': name, 'color': colour})
+    for name, colour in updates:
+        print(f" Update label: {name} ({labels[name].color} -> {colour})")
+        labels[name].color = colour
+        labels[name].save()
+    return {name: label.id for name, label in labels.items()}
 
 
 def setup_gitlab(metadata, params: dict, init_scorecard, args: dict):
@@ -98,11 +117,13 @@ def setup_gitlab(metadata, params: dict, init_scorecard, args: dict):
     print(f"\n# Connection to GitLab at {params['gitlab_url']} ")
     gl = gitlab.Gitlab(url=params['gitlab_url'],
                        per_page=50,
-                       private_token=params['gitlab_token'])
-    project = gl.projects.get(params['gitlab_project'])
+                       private_token=params['gitlab_token'],
+                       session=ForgeSession(throttle=get_host_throttle(params['gitlab_url'])))
+    with instrument.span('connect'):
+        project = gl.projects.get(params['gitlab_project'])
 
     # Update current project description with Website URL
-    if args.opt_projdesc:
+    if args.opt_projdesc and not args.opt_dry_run:
         print("\n# Update Project description")
         if 'CI_PAGES_URL' in os.environ:
             ggi_activities_url = params['gitlab_activities_url']
@@ -127,99 +148,82 @@ def setup_gitlab(metadata, params: dict, init_scorecard, args: dict):
     #
     # Create labels & activities
     #
+    label_ids = None
     if args.opt_activities:
 
         print("\n# Manage labels")
-        existing_labels = [i.name for i in project.labels.list()]
-
-        # Create role labels if needed
-        print("\n Roles labels")
-        for label, colour in metadata['roles'].items():
-            create_gitlab_label(project, existing_labels, label, {'name': label, 'color': colour})
-
-        # Create labels for activity tracking
-        print("\n Progress labels")
-        for name, label in params['progress_labels'].items():
-            create_gitlab_label(project, existing_labels, label, {'name': label, 'color': '#ed9121'})
-
-        # Create goal labels if needed
-        print("\n Goal labels")
-        for goal in metadata['goals']:
-            create_gitlab_label(project, existing_labels, goal['name'],
-                         {'name': goal['name'], 'color': goal['colour']})
+        with instrument.span('labels'):
+            label_ids = sync_gitlab_labels(project, metadata, params, args.opt_dry_run)
 
         # # Read the custom scorecard init file.
         # print(f"\n# Reading scorecard init file from {init_scorecard_file}.")
         # with open(init_scorecard_file, 'r', encoding='utf-8') as f:
         #     init_scorecard = f.readlines()
 
-        # Create issues with their associated labels.
-        print("\n# Create activities.")
-        # First test the existence of Activities Issues:
-        #   if at least one Issue is found bearing one Goal label,
-        #   consider that all Issues exist and do not add any.
-        issues_test = project.issues.list(state='opened')
-        if len(issues_test) > 0:
-            print(" Ignore, Issues already exist")
-        else:
-            for activity in metadata['activities']:
-                progress_label = params['progress_labels']['not_started']
-                if args.opt_random:
-                    # randomly choose among valid progress labels
-                    # + artificially introduce an extra option for no progress label
-                    progress_idx = random.choice(list(params['progress_labels']) + ['none'])
-                    if progress_idx != 'none':
-                        progress_label = params['progress_labels'][progress_idx]
-                labels = \
-                    [activity['goal']] + \
-                    activity['roles'] + \
-                    [progress_label]
-                print(f"  - Issue: {activity['name']:<60} Labels: {labels}")
-                ret = project.issues.create({'title': activity['name'],
-                                             'description': extract_sections(args, init_scorecard, activity),
-                                             'labels': labels})
+        # Create the issues of activities which do not exist yet,
+        # matching existing issues (open or closed) by their Activity ID.
+        with instrument.span('activities'):
+            print("\n# Create activities.")
+            payloads = build_activity_issues(args, metadata, params, init_scorecard)
+            missing = plan_activities(payloads, [i.description for i in project.issues.list(all=True)])
+            for payload in missing:
+                if args.opt_dry_run:
+                    print(f"  - Would create issue: {payload['activity_id']} {payload['title']}")
+                    continue
+                print(f"  - Issue: {payload['title']:<60} Labels: {payload['labels']}")
+                ret = project.issues.create({'title': payload['title'],
+                                             'description': payload['body'],
+                                             'labels': payload['labels']})
 
     #
     # Create Goals board
     #
     if args.opt_board:
-        print(f"\n# Create Goals board: {ggi_board_name}")
-        boards_list=project.boards.list()
-        board_exists=False
-        for b in boards_list:
-            if b.name == ggi_board_name:
-                board_exists=True
-                break
-        if board_exists:
-            print(" Ignore, Board already exists")
-        else:
-            board = project.boards.create({'name': ggi_board_name})
-            print('\n# Create Goals board lists.')
-            # First build an ordered list of goals
-            goal_lists = []
-            for g in metadata['goals']:
-                for l in project.labels.list():
-                    if l.name == g['name']:
-                        goal_lists.append(l)
-                        break
-
-            # Then create the lists in gitlab
-            for goal_label in goal_lists:
-                print(f"  - Create list for {goal_label.name}")
-                b_list = board.lists.create({'label_id': goal_label.id})
+        with instrument.span('board'):
+            print(f"\n# Create Goals board: {ggi_board_name}")
+            board = None
+            for b in project.boards.list(all=True):
+                if b.name == ggi_board_name:
+                    board = b
+                    break
+            if board is not None:
+                print(" Board already exists")
+                existing_lists = [l.label['name'] for l in board.lists.list(all=True) if l.label]
+            elif args.opt_dry_run:
+                print(" Would create board")
+                existing_lists = []
+            else:
+                board = project.boards.create({'name': ggi_board_name})
+                existing_lists = []
+            missing_lists = plan_board_lists(metadata, existing_lists)
+            if len(missing_lists) > 0:
+                print('\n# Create Goals board lists.')
+                # Reuse the label index, or list labels once if they were not synced.
+                if label_ids is None:
+                    label_ids = {label.name: label.id for label in project.labels.list(all=True)}
+                # Create the lists in gitlab, in the order of goals
+                for name in missing_lists:
+                    if args.opt_dry_run:
+                        print(f"  - Would create list for {name}")
+                    elif name in label_ids:
+                        print(f"  - Create list for {name}")
+                        b_list = board.lists.create({'label_id': label_ids[name]})
 
     # Create a scheduled pipeline trigger, if none exist yet.
-    if args.opt_schedulepipeline:
-        print(f"\n# Schedule nightly pipeline to refresh the Dashboard")
-        nb_pipelines=len(project.pipelineschedules.list())
-        if nb_pipelines > 0:
-            print(f" Ignore, already {nb_pipelines} scheduled pipeline(s)")
-        else:
-            sched = project.pipelineschedules.create({
-                'ref': 'main',
-                'description': 'Nightly Update',
-                'cron': '0 3 * * *'})
-            print(f" Pipeline created: '{sched.description}'")
+    if args.opt_schedulepipeline and not args.opt_dry_run:
+        with instrument.span('schedule'):
+            print(f"\n# Schedule nightly pipeline to refresh the Dashboard")
+            nb_pipelines=len(project.pipelineschedules.list())
+            if nb_pipelines > 0:
+                print(f" Ignore, already {nb_pipelines} scheduled pipeline(s)")
+            else:
+                sched = project.pipelineschedules.create({
+                    'ref': 'main',
+                    'description': 'Nightly Update',
+                    'cron': '0 3 * * *'})
+                print(f" Pipeline created: '{sched.description}'")
+
+    report_throttles()
 
 if __name__ == '__main__':
     main()
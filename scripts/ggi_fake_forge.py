@@ -0,0 +1,1069 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+This script runs a local stand-in for the GitLab and GitHub APIs, so the
+deploy and update scripts can be measured offline and reproducibly.
+
+It serves the subset of the APIs used by the GGI scripts:
+- GitLab REST, under `/api/v4`: projects, issues, resource label events,
+  labels, boards and board lists, pipeline schedules.
+- GitHub REST, under `/api/v3`: repositories, issues, issue events, labels.
+- GitHub GraphQL, at `/api/graphql`: the named operations of the scripts
+  (GgiIssues, GgiIssueTimeline, GgiLabels, GgiCreateIssues, GgiResolveBoard,
+  GgiCreateProject, GgiCreateGoalField, GgiProjectBoard, GgiBoardIssues,
+  GgiAddItems, GgiSetGoals).
+
+Every project is seeded on first access with one issue per activity of
+`conf/ggi_activities_full.json`, with random scorecards, progress labels
+and label events drawn from a fixed seed, unless `--empty` is given. Answers are paginated, carry
+ETags and rate-limit headers, and can be delayed by a configurable latency.
+Any token is accepted.
+
+Point the scripts at the server like a self-hosted instance, e.g. with
+`conf/ggi_fleet_fake.json`:
+- GitLab: `gitlab_url` http://127.0.0.1:8765
+- GitHub: `github_host` http://127.0.0.1:8765 (GitHub Enterprise layout)
+
+With `--record UPSTREAM`, requests are forwarded to a real forge and the
+answers saved to a cassette; with `--replay CASSETTE` they are served
+from it. Credentials are never written to cassettes.
+
+usage: ggi_fake_forge [-h] [-p PORT] [-l LATENCY] [-j JITTER] [--page-size PAGE_SIZE]
+                      [--rate-limit RATE_LIMIT] [--rate-window RATE_WINDOW] [-s SEED]
+                      [-c COPIES] [-e EVENTS] [--empty] [--record UPSTREAM] [--replay CASSETTE]
+                      [--cassette CASSETTE]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -p PORT, --port PORT  Port to listen on (default 8765)
+  -l LATENCY, --latency LATENCY
+                        Delay added to every answer, in milliseconds (default 0)
+  -j JITTER, --jitter JITTER
+                        Random extra delay, up to this many milliseconds (default 0)
+  --page-size PAGE_SIZE
+                        Maximum number of items per page (default 100)
+  --rate-limit RATE_LIMIT
+                        Requests allowed per window and per API (default 5000)
+  --rate-window RATE_WINDOW
+                        Rate-limit window, in seconds (default 3600)
+  -s SEED, --seed SEED  Seed of the generated projects (default 42)
+  -c COPIES, --copies COPIES
+                        Number of issues seeded per activity (default 1)
+  -e EVENTS, --events EVENTS
+                        Extra label events seeded per issue (default 0)
+  --empty               Do not seed projects, e.g. to measure deployments
+  --record UPSTREAM     Forward requests to UPSTREAM and record them to the cassette
+  --replay CASSETTE     Serve recorded answers from CASSETTE
+  --cassette CASSETTE   Cassette written in record mode (default .ggi_cache/cassette.json)
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import signal
+import threading
+import time
+import urllib.parse
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from ggi_deploy import activities_file, build_activity_issues, conf_file, get_desired_labels, init_scorecard_file
+
+default_port = 8765
+default_cassette = os.path.join('.ggi_cache', 'cassette.json')
+# Stands for the server base URL in cassettes.
+cassette_base = '{{base}}'
+# Date of the first seeded label event.
+seed_start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# Headers of upstream answers kept in cassettes.
+cassette_headers = ['content-type', 'link', 'etag', 'last-modified',
+                    'x-page', 'x-per-page', 'x-total', 'x-total-pages', 'x-next-page', 'x-prev-page']
+
+re_operation = re.compile(r"^\s*(?:query|mutation)\s+(?P<name>\w+)")
+re_newest_first = re.compile(r"orderBy: \{field: CREATED_AT, direction: DESC\}")
+# Aliased mutations of the board, with the variables holding their ids.
+re_add_item = re.compile(r'(?P<alias>\w+): addProjectV2ItemById\(input: \{[^}]*contentId: \$(?P<content>\w+)')
+re_set_goal = re.compile(r'(?P<alias>\w+): updateProjectV2ItemFieldValue\(input: \{[^}]*itemId: \$(?P<item>\w+)' +
+                         r'.*?singleSelectOptionId: \$(?P<option>\w+)')
+
+
+def parse_args():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(prog='ggi_fake_forge')
+    parser.add_argument('-p', '--port',
+                        dest='opt_port',
+                        type=int,
+                        default=default_port,
+                        help='Port to listen on')
+    parser.add_argument('-l', '--latency',
+                        dest='opt_latency',
+                        type=float,
+                        default=0,
+                        help='Delay added to every answer, in milliseconds')
+    parser.add_argument('-j', '--jitter',
+                        dest='opt_jitter',
+                        type=float,
+                        default=0,
+                        help='Random extra delay, up to this many milliseconds')
+    parser.add_argument('--page-size',
+                        dest='opt_page_size',
+                        type=int,
+                        default=100,
+                        help='Maximum number of items per page')
+    parser.add_argument('--rate-limit',
+                        dest='opt_rate_limit',
+                        type=int,
+                        default=5000,
+                        help='Requests allowed per window and per API')
+    parser.add_argument('--rate-window',
+                        dest='opt_rate_window',
+                        type=float,
+                        default=3600,
+                        help='Rate-limit window, in seconds')
+    parser.add_argument('-s', '--seed',
+                        dest='opt_seed',
+                        type=int,
+                        default=42,
+                        help='Seed of the generated projects')
+    parser.add_argument('-c', '--copies',
+                        dest='opt_copies',
+                        type=int,
+                        default=1,
+                        help='Number of issues seeded per activity')
+    parser.add_argument('-e', '--events',
+                        dest='opt_events',
+                        type=int,
+                        default=0,
+                        help='Extra label events seeded per issue')
+    parser.add_argument('--empty',
+                        dest='opt_empty',
+                        action='store_true',
+                        help='Do not seed projects, e.g. to measure deployments')
+    parser.add_argument('--record',
+                        dest='opt_record',
+                        help='Forward requests to UPSTREAM and record them to the cassette')
+    parser.add_argument('--replay',
+                        dest='opt_replay',
+                        help='Serve recorded answers from CASSETTE')
+    parser.add_argument('--cassette',
+                        dest='opt_cassette',
+                        default=default_cassette,
+                        help='Cassette written in record mode')
+    return parser.parse_args()
+
+
+def format_time(value: datetime):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_time(value: str):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class RateLimit:
+    """
+    Fixed-window request budget of one API.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.reset = time.time() + window
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def consume(self):
+        """
+        Use one request of the budget.
+
+        Returns whether the request is allowed, and the rate-limit state.
+        """
+        with self.lock:
+            if time.time() >= self.reset:
+                self.reset = time.time() + self.window
+                self.used = 0
+            allowed = self.used < self.limit
+            if allowed:
+                self.used += 1
+            return allowed, self.limit - self.used, int(math.ceil(self.reset))
+
+    def refund(self):
+        with self.lock:
+            self.used = max(0, self.used - 1)
+
+
+class FakeProject:
+    """
+    A seeded GitLab project or GitHub repository, with its labels, issues,
+    label events, boards, pipeline schedules and projectsV2.
+    """
+
+    def __init__(self, pid, path):
+        self.pid = pid
+        self.path = path
+        self.description = ''
+        self.labels = OrderedDict()
+        self.issues = []
+        self.boards = []
+        self.schedules = []
+        self.projects = []
+        self.next_id = 1
+
+    def get_id(self):
+        self.next_id += 1
+        return self.pid * 1000000 + self.next_id
+
+    def add_label(self, name, color):
+        label = {'id': self.get_id(), 'name': name, 'color': color}
+        label['node_id'] = f"LA_{label['id']}"
+        self.labels[name] = label
+        return label
+
+    def add_issue(self, title, body, labels, user, created_at):
+        """
+        Create an open issue, and the label events of its labels.
+        """
+        issue = {'id': self.get_id(), 'number': len(self.issues) + 1, 'title': title,
+                 'body': body, 'state': 'opened', 'labels': [],
+                 'created_at': created_at, 'updated_at': created_at, 'events': []}
+        issue['node_id'] = f"I_{issue['id']}"
+        self.issues.append(issue)
+        for name in labels:
+            self.add_event(issue, 'add', name, user, created_at)
+        return issue
+
+    def add_event(self, issue, action, name, user, created_at):
+        """
+        Add or remove a label of an issue, recording the label event.
+        """
+        if name not in self.labels:
+            self.add_label(name, '#428bca')
+        if action == 'add' and name not in issue['labels']:
+            issue['labels'].append(name)
+        elif action == 'remove' and name in issue['labels']:
+            issue['labels'].remove(name)
+        event = {'id': self.get_id(), 'action': action, 'label': name, 'user': user,
+                 'created_at': created_at}
+        event['node_id'] = f"LE_{event['id']}"
+        issue['events'].append(event)
+        issue['updated_at'] = max(issue['updated_at'], created_at)
+
+    def get_issue(self, number):
+        if 1 <= number <= len(self.issues):
+            return self.issues[number - 1]
+        return None
+
+
+def get_label_path(statuses, final, extra_events, rnd):
+    """
+    Generate the progress label events of an issue: `extra_events` events
+    of label churn, then the statuses leading to `final`, if any.
+
+    Returns a list of (action, label), with actions 'add' or 'remove'.
+    """
+    path = []
+    for idx in range(extra_events // 2):
+        status = rnd.choice(statuses)
+        path += [('add', status), ('remove', status)]
+    if final:
+        last = statuses.index(final)
+        for idx in range(last + 1):
+            path.append(('add', statuses[idx]))
+            if idx < last:
+                path.append(('remove', statuses[idx]))
+    return path
+
+
+def seed_project(project: FakeProject, seed: int, copies=1, extra_events=0):
+    """
+    Fill a project with one issue per activity and copy, as deployed by
+    ggi_deploy with random scorecards, and label events leading to their
+    progress label.
+    """
+    with open(activities_file, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    with open(conf_file, 'r', encoding='utf-8') as f:
+        params = json.load(f)
+    with open(init_scorecard_file, 'r', encoding='utf-8') as f:
+        init_scorecard = f.readlines()
+
+    rng = random.Random(seed)
+    for name, colour in get_desired_labels(metadata, params).items():
+        project.add_label(name, colour)
+    statuses = [params['progress_labels'][s] for s in ['not_started', 'in_progress', 'done']]
+
+    for copy in range(copies):
+        payloads = build_activity_issues(argparse.Namespace(opt_random=True), metadata, params, init_scorecard, rng)
+        for payload in payloads:
+            title = payload['title'] if copies == 1 else f"{payload['title']} ({copy + 1})"
+            static = [label for label in payload['labels'] if label not in statuses]
+            final = [label for label in payload['labels'] if label in statuses]
+            when = seed_start + timedelta(hours=rng.randint(0, 24 * 30))
+            issue = project.add_issue(title, payload['body'], static, 'ggi-deploy', format_time(when))
+
+            for action, name in get_label_path(statuses, final[0] if final else None, extra_events, rng):
+                when += timedelta(minutes=rng.randint(1, 60 * 24 * 7))
+                project.add_event(issue, action, name, rng.choice(['alice', 'bob', 'carol']),
+                                  format_time(when))
+    return project
+
+
+class Cassette:
+    """
+    Recorded answers of a real forge, keyed by method, path and a hash of
+    the request body. Identical requests are answered in recording order,
+    the last answer being repeated once they are exhausted.
+    """
+
+    def __init__(self, path, upstream=None):
+        self.path = path
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.interactions = {}
+        self.served = Counter()
+        self.lock = threading.Lock()
+        if upstream is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                for interaction in json.load(f)['interactions']:
+                    self.interactions.setdefault(self.get_key(interaction['method'], interaction['path'],
+                                                              interaction['body_sha']), []).append(interaction)
+            print(f"- Replaying {sum(len(v) for v in self.interactions.values())} answer(s) from {path}.")
+
+    @staticmethod
+    def get_body_sha(body: bytes):
+        return hashlib.sha256(body or b'').hexdigest()
+
+    @staticmethod
+    def get_key(method, path, body_sha):
+        return f"{method} {path} {body_sha}"
+
+    def get_upstream_url(self, path):
+        """
+        Map a local path to the upstream URL. Public GitHub serves REST at
+        the root and GraphQL at /graphql, not under /api/v3 and /api/graphql.
+        """
+        if urllib.parse.urlsplit(self.upstream).hostname == 'api.github.com':
+            if path.startswith('/api/v3/'):
+                path = path[len('/api/v3'):]
+            elif path.startswith('/api/graphql'):
+                path = path[len('/api'):]
+        return self.upstream + path
+
+    def get_upstream_base(self):
+        if urllib.parse.urlsplit(self.upstream).hostname == 'api.github.com':
+            return self.upstream, cassette_base + '/api/v3'
+        return self.upstream, cassette_base
+
+    def record(self, method, path, headers, body):
+        """
+        Forward a request upstream, and record its answer.
+        """
+        forwarded = {k: v for k, v in headers.items()
+                     if k.lower() in ['authorization', 'private-token', 'content-type', 'accept']}
+        response = requests.request(method, self.get_upstream_url(path), headers=forwarded, data=body)
+        upstream, local = self.get_upstream_base()
+        interaction = {
+            'method': method,
+            'path': path,
+            'body_sha': self.get_body_sha(body),
+            'status': response.status_code,
+            'headers': {k: v.replace(upstream, local) for k, v in response.headers.items()
+                        if k.lower() in cassette_headers},
+            'body': response.text.replace(upstream, local)
+        }
+        with self.lock:
+            self.interactions.setdefault(self.get_key(method, path, interaction['body_sha']), []).append(interaction)
+            self.save()
+        return interaction
+
+    def replay(self, method, path, body):
+        key = self.get_key(method, path, self.get_body_sha(body))
+        with self.lock:
+            answers = self.interactions.get(key)
+            if not answers:
+                return None
+            idx = min(self.served[key], len(answers) - 1)
+            self.served[key] += 1
+            return answers[idx]
+
+    def save(self):
+        interactions = [i for answers in self.interactions.values() for i in answers]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'upstream': self.upstream, 'interactions': interactions}, f, indent=1)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class FakeForge(ThreadingHTTPServer):
+    """
+    The HTTP server, holding the seeded projects and the simulation options.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, args):
+        super().__init__(address, FakeForgeHandler)
+        self.args = args
+        self.lock = threading.Lock()
+        self.projects = {}
+        self.nodes = {}
+        self.rate_limits = {api: RateLimit(args.opt_rate_limit, args.opt_rate_window)
+                            for api in ['gitlab', 'github', 'graphql']}
+        self.stats = Counter()
+        self.cassette = None
+        if args.opt_record:
+            self.cassette = Cassette(args.opt_cassette, args.opt_record)
+        elif args.opt_replay:
+            self.cassette = Cassette(args.opt_replay)
+
+    def get_project(self, forge, path):
+        """
+        Get a project by forge and path (or GitLab numeric id), seeding it
+        on first access.
+        """
+        with self.lock:
+            if path.isdigit():
+                return next((p for (f, _), p in self.projects.items() if f == forge and p.pid == int(path)), None)
+            if (forge, path) not in self.projects:
+                project = FakeProject(len(self.projects) + 1, path)
+                if not self.args.opt_empty:
+                    seed_project(project, self.args.opt_seed, self.args.opt_copies, self.args.opt_events)
+                self.projects[(forge, path)] = project
+                print(f"- Seeded {forge} project {path}: {len(project.issues)} issue(s), " +
+                      f"{sum(len(i['events']) for i in project.issues)} label event(s).")
+            return self.projects[(forge, path)]
+
+    def report(self):
+        print(f"\n# Fake forge: {sum(self.stats.values())} request(s) served.")
+        for route, count in self.stats.most_common():
+            print(f"  {count:7} {route}")
+
+
+class FakeForgeHandler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the GitLab, GitHub and GraphQL handlers.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    routes = [
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)', 'gitlab_get_project'),
+        ('PUT', r'/api/v4/projects/(?P<project>[^/]+)', 'gitlab_edit_project'),
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)/issues', 'gitlab_list_issues'),
+        ('POST', r'/api/v4/projects/(?P<project>[^/]+)/issues', 'gitlab_create_issue'),
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)/issues/(?P<number>\d+)/resource_label_events',
+         'gitlab_list_label_events'),
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)/labels', 'gitlab_list_labels'),
+        ('POST', r'/api/v4/projects/(?P<project>[^/]+)/labels', 'gitlab_create_label'),
+        ('PUT', r'/api/v4/projects/(?P<project>[^/]+)/labels(?:/(?P<label>[^/]+))?', 'gitlab_edit_label'),
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)/boards', 'gitlab_list_boards'),
+        ('POST', r'/api/v4/projects/(?P<project>[^/]+)/boards', 'gitlab_create_board'),
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)/boards/(?P<board>\d+)/lists', 'gitlab_list_board_lists'),
+        ('POST', r'/api/v4/projects/(?P<project>[^/]+)/boards/(?P<board>\d+)/lists', 'gitlab_create_board_list'),
+        ('GET', r'/api/v4/projects/(?P<project>[^/]+)/pipeline_schedules', 'gitlab_list_schedules'),
+        ('POST', r'/api/v4/projects/(?P<project>[^/]+)/pipeline_schedules', 'gitlab_create_schedule'),
+        ('GET', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)', 'github_get_repo'),
+        ('PATCH', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)', 'github_edit_repo'),
+        ('GET', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/issues', 'github_list_issues'),
+        ('POST', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/issues', 'github_create_issue'),
+        ('GET', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/issues/(?P<number>\d+)/events',
+         'github_list_issue_events'),
+        ('GET', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/labels', 'github_list_labels'),
+        ('POST', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/labels', 'github_create_label'),
+        ('GET', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/labels/(?P<label>[^/]+)', 'github_get_label'),
+        ('PATCH', r'/api/v3/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/labels/(?P<label>[^/]+)', 'github_edit_label'),
+        ('POST', r'/api/graphql', 'graphql'),
+    ]
+    compiled_routes = [(method, re.compile(pattern + '$'), name) for method, pattern, name in routes]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def get_base(self):
+        return f"http://{self.headers.get('Host', '127.0.0.1')}"
+
+    def handle_request(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urllib.parse.urlsplit(self.path)
+        self.query = dict(urllib.parse.parse_qsl(url.query))
+        self.base = self.get_base()
+        self.extra_headers = {}
+
+        args = self.server.args
+        if args.opt_record:
+            self.server.stats[f"{method} (recorded)"] += 1
+            return self.send_answer(self.server.cassette.record(method, self.path, self.headers, body))
+
+        delay = args.opt_latency + random.uniform(0, args.opt_jitter)
+        if delay:
+            time.sleep(delay / 1000)
+
+        if args.opt_replay:
+            answer = self.server.cassette.replay(method, self.path, body)
+            self.server.stats[f"{method} (replayed)" if answer else f"{method} (missing)"] += 1
+            if answer is None:
+                return self.send_json(404, {'message': f"No recorded answer for {method} {self.path}"})
+            return self.send_answer(answer)
+
+        for route_method, pattern, name in self.compiled_routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                self.server.stats[f"{method} {name}"] += 1
+                api = 'graphql' if name == 'graphql' else name.split('_')[0]
+                allowed, remaining, reset = self.server.rate_limits[api].consume()
+                self.rate_remaining = remaining
+                self.set_rate_limit_headers(api, remaining, reset)
+                if not allowed:
+                    return self.send_rate_limited(api, reset)
+                kwargs = {k: urllib.parse.unquote(v) for k, v in match.groupdict().items() if v is not None}
+                data = json.loads(body) if body else {}
+                try:
+                    status, answer = getattr(self, name)(data, **kwargs)
+                except LookupError as e:
+                    status, answer = 404, {'message': f"Not Found: {e}"}
+                if method == 'GET' and status == 200 and self.is_not_modified(answer):
+                    self.server.rate_limits[api].refund()
+                    return self.send_text(304, '', {})
+                return self.send_json(status, answer)
+
+        self.server.stats[f"{method} (unknown)"] += 1
+        self.send_json(404, {'message': f"Not Found: {method} {url.path}"})
+
+    def set_rate_limit_headers(self, api, remaining, reset):
+        limit = self.server.args.opt_rate_limit
+        if api == 'gitlab':
+            self.extra_headers.update({'RateLimit-Limit': str(limit), 'RateLimit-Remaining': str(remaining),
+                                       'RateLimit-Reset': str(reset)})
+        else:
+            self.extra_headers.update({'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining),
+                                       'X-RateLimit-Reset': str(reset), 'X-RateLimit-Used': str(limit - remaining)})
+
+    def send_rate_limited(self, api, reset):
+        self.extra_headers['Retry-After'] = str(max(1, int(reset - time.time())))
+        if api == 'gitlab':
+            return self.send_json(429, {'message': 'Retry later'})
+        return self.send_json(403, {'message': 'API rate limit exceeded'})
+
+    def is_not_modified(self, answer):
+        etag = 'W/"' + hashlib.sha1(json.dumps(answer, sort_keys=True).encode()).hexdigest() + '"'
+        self.extra_headers['ETag'] = etag
+        return self.headers.get('If-None-Match') == etag
+
+    def send_answer(self, answer):
+        """
+        Send a cassette answer, with URLs pointing to this server.
+        """
+        self.send_text(answer['status'], answer['body'].replace(cassette_base, self.base),
+                       {k: v.replace(cassette_base, self.base) for k, v in answer['headers'].items()})
+
+    def send_json(self, status, answer):
+        self.extra_headers.setdefault('Content-Type', 'application/json; charset=utf-8')
+        self.send_text(status, json.dumps(answer), {})
+
+    def send_text(self, status, text, headers):
+        payload = text.encode('utf-8')
+        self.send_response(status)
+        for key, value in {**self.extra_headers, **headers}.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def paginate(self, items, default_per_page, gitlab=False):
+        """
+        Select the requested page of a list and set the Link header, and
+        the X-Page / X-Total headers on GitLab.
+        """
+        per_page = min(int(self.query.get('per_page', default_per_page)), self.server.args.opt_page_size, 100)
+        page = max(1, int(self.query.get('page', 1)))
+        pages = max(1, math.ceil(len(items) / per_page))
+        path = urllib.parse.urlsplit(self.path).path
+
+        def page_url(number):
+            return f"{self.base}{path}?" + urllib.parse.urlencode({**self.query, 'page': number})
+
+        links = []
+        if page < pages:
+            links += [f'<{page_url(page + 1)}>; rel="next"', f'<{page_url(pages)}>; rel="last"']
+        if page > 1:
+            links += [f'<{page_url(1)}>; rel="first"', f'<{page_url(page - 1)}>; rel="prev"']
+        if links:
+            self.extra_headers['Link'] = ', '.join(links)
+        if gitlab:
+            self.extra_headers.update({
+                'X-Page': str(page), 'X-Per-Page': str(per_page), 'X-Total': str(len(items)),
+                'X-Total-Pages': str(pages), 'X-Next-Page': str(page + 1) if page < pages else '',
+                'X-Prev-Page': str(page - 1) if page > 1 else ''})
+        return items[(page - 1) * per_page:page * per_page]
+
+    #
+    # GitLab REST
+    #
+
+    def get_gitlab_project(self, project):
+        found = self.server.get_project('gitlab', project)
+        if found is None:
+            raise LookupError(f"project {project}")
+        return found
+
+    def gitlab_project(self, project: FakeProject):
+        return {'id': project.pid, 'path_with_namespace': project.path, 'name': project.path.split('/')[-1],
+                'description': project.description, 'web_url': f"{self.base}/{project.path}"}
+
+    def gitlab_issue(self, project: FakeProject, issue):
+        return {'id': issue['id'], 'iid': issue['number'], 'project_id': project.pid, 'title': issue['title'],
+                'description': issue['body'], 'state': issue['state'], 'labels': list(issue['labels']),
+                'created_at': issue['created_at'], 'updated_at': issue['updated_at'],
+                'web_url': f"{self.base}/{project.path}/-/issues/{issue['number']}"}
+
+    def gitlab_label(self, label):
+        return {'id': label['id'], 'name': label['name'], 'color': label['color']}
+
+    def gitlab_board(self, board):
+        return {'id': board['id'], 'name': board['name'], 'lists': board['lists']}
+
+    def gitlab_get_project(self, data, project):
+        return 200, self.gitlab_project(self.get_gitlab_project(project))
+
+    def gitlab_edit_project(self, data, project):
+        found = self.get_gitlab_project(project)
+        with self.server.lock:
+            found.description = data.get('description', found.description)
+        return 200, self.gitlab_project(found)
+
+    def gitlab_list_issues(self, data, project):
+        found = self.get_gitlab_project(project)
+        # Newest first, the default order of the API.
+        with self.server.lock:
+            issues = found.issues[::-1]
+        state = self.query.get('state')
+        if state in ['opened', 'closed']:
+            issues = [i for i in issues if i['state'] == state]
+        if 'updated_after' in self.query:
+            since = parse_time(self.query['updated_after'])
+            issues = [i for i in issues if parse_time(i['updated_at']) >= since]
+        return 200, [self.gitlab_issue(found, i) for i in self.paginate(issues, 20, gitlab=True)]
+
+    def gitlab_create_issue(self, data, project):
+        found = self.get_gitlab_project(project)
+        labels = data.get('labels') or []
+        if isinstance(labels, str):
+            labels = [label for label in labels.split(',') if label]
+        with self.server.lock:
+            issue = found.add_issue(data['title'], data.get('description', ''), labels,
+                                    'ggi-deploy', format_time(datetime.now(timezone.utc)))
+        return 201, self.gitlab_issue(found, issue)
+
+    def gitlab_list_label_events(self, data, project, number):
+        found = self.get_gitlab_project(project)
+        issue = found.get_issue(int(number))
+        if issue is None:
+            raise LookupError(f"issue {number}")
+        events = [{'id': e['id'], 'action': e['action'], 'created_at': e['created_at'],
+                   'resource_type': 'Issue', 'resource_id': issue['id'],
+                   'label': self.gitlab_label(found.labels[e['label']]), 'user': {'username': e['user']}}
+                  for e in issue['events']]
+        return 200, self.paginate(events, 20, gitlab=True)
+
+    def gitlab_list_labels(self, data, project):
+        found = self.get_gitlab_project(project)
+        return 200, [self.gitlab_label(label) for label in self.paginate(list(found.labels.values()), 20, gitlab=True)]
+
+    def gitlab_create_label(self, data, project):
+        found = self.get_gitlab_project(project)
+        with self.server.lock:
+            if data['name'] in found.labels:
+                return 409, {'message': 'Label already exists'}
+            label = found.add_label(data['name'], data.get('color', '#428bca'))
+        return 201, self.gitlab_label(label)
+
+    def gitlab_edit_label(self, data, project, label=None):
+        found = self.get_gitlab_project(project)
+        name = label or data.get('name')
+        if name not in found.labels:
+            raise LookupError(f"label {name}")
+        with self.server.lock:
+            found.labels[name]['color'] = data.get('color', found.labels[name]['color'])
+        return 200, self.gitlab_label(found.labels[name])
+
+    def gitlab_list_boards(self, data, project):
+        found = self.get_gitlab_project(project)
+        return 200, [self.gitlab_board(b) for b in self.paginate(found.boards, 20, gitlab=True)]
+
+    def gitlab_create_board(self, data, project):
+        found = self.get_gitlab_project(project)
+        with self.server.lock:
+            board = {'id': found.get_id(), 'name': data.get('name', 'Development'), 'lists': []}
+            found.boards.append(board)
+        return 201, self.gitlab_board(board)
+
+    def get_gitlab_board(self, found, board):
+        for b in found.boards:
+            if b['id'] == int(board):
+                return b
+        raise LookupError(f"board {board}")
+
+    def gitlab_list_board_lists(self, data, project, board):
+        found = self.get_gitlab_project(project)
+        return 200, self.paginate(self.get_gitlab_board(found, board)['lists'], 20, gitlab=True)
+
+    def gitlab_create_board_list(self, data, project, board):
+        found = self.get_gitlab_project(project)
+        b = self.get_gitlab_board(found, board)
+        label = next((label for label in found.labels.values() if label['id'] == int(data['label_id'])), None)
+        if label is None:
+            raise LookupError(f"label {data['label_id']}")
+        with self.server.lock:
+            board_list = {'id': found.get_id(), 'label': self.gitlab_label(label), 'position': len(b['lists'])}
+            b['lists'].append(board_list)
+        return 201, board_list
+
+    def gitlab_list_schedules(self, data, project):
+        found = self.get_gitlab_project(project)
+        return 200, self.paginate(found.schedules, 20, gitlab=True)
+
+    def gitlab_create_schedule(self, data, project):
+        found = self.get_gitlab_project(project)
+        with self.server.lock:
+            schedule = {'id': found.get_id(), 'description': data.get('description'), 'ref': data.get('ref'),
+                        'cron': data.get('cron'), 'active': True}
+            found.schedules.append(schedule)
+        return 201, schedule
+
+    #
+    # GitHub REST
+    #
+
+    def get_github_project(self, owner, repo):
+        return self.server.get_project('github', f"{owner}/{repo}")
+
+    def github_api(self, project: FakeProject):
+        return f"{self.base}/api/v3/repos/{project.path}"
+
+    def github_repo(self, project: FakeProject):
+        owner, name = project.path.split('/')
+        return {'id': project.pid, 'node_id': f"R_{project.pid}", 'name': name, 'full_name': project.path,
+                'owner': {'login': owner, 'id': project.pid, 'node_id': f"U_{project.pid}", 'type': 'User'},
+                'description': project.description, 'private': False,
+                'url': self.github_api(project), 'html_url': f"{self.base}/{project.path}"}
+
+    def github_label(self, project: FakeProject, label):
+        return {'id': label['id'], 'node_id': label['node_id'], 'name': label['name'],
+                'color': label['color'].lstrip('#'),
+                'url': f"{self.github_api(project)}/labels/{urllib.parse.quote(label['name'])}"}
+
+    def github_issue(self, project: FakeProject, issue):
+        return {'id': issue['id'], 'node_id': issue['node_id'], 'number': issue['number'],
+                'title': issue['title'], 'body': issue['body'],
+                'state': 'open' if issue['state'] == 'opened' else 'closed',
+                'labels': [self.github_label(project, project.labels[name]) for name in issue['labels']],
+                'created_at': issue['created_at'], 'updated_at': issue['updated_at'],
+                'url': f"{self.github_api(project)}/issues/{issue['number']}",
+                'html_url': f"{self.base}/{project.path}/issues/{issue['number']}",
+                'repository_url': self.github_api(project)}
+
+    def github_get_repo(self, data, owner, repo):
+        return 200, self.github_repo(self.get_github_project(owner, repo))
+
+    def github_edit_repo(self, data, owner, repo):
+        found = self.get_github_project(owner, repo)
+        with self.server.lock:
+            found.description = data.get('description', found.description)
+        return 200, self.github_repo(found)
+
+    def github_list_issues(self, data, owner, repo):
+        found = self.get_github_project(owner, repo)
+        # Newest first, the default order of the API.
+        with self.server.lock:
+            issues = found.issues[::-1]
+        state = self.query.get('state', 'open')
+        if state != 'all':
+            issues = [i for i in issues if (i['state'] == 'opened') == (state == 'open')]
+        if 'since' in self.query:
+            since = parse_time(self.query['since'])
+            issues = [i for i in issues if parse_time(i['updated_at']) >= since]
+        return 200, [self.github_issue(found, i) for i in self.paginate(issues, 30)]
+
+    def github_create_issue(self, data, owner, repo):
+        found = self.get_github_project(owner, repo)
+        with self.server.lock:
+            issue = found.add_issue(data['title'], data.get('body', ''), data.get('labels', []),
+                                    'ggi-deploy', format_time(datetime.now(timezone.utc)))
+        return 201, self.github_issue(found, issue)
+
+    def github_list_issue_events(self, data, owner, repo, number):
+        found = self.get_github_project(owner, repo)
+        issue = found.get_issue(int(number))
+        if issue is None:
+            raise LookupError(f"issue {number}")
+        events = [{'id': e['id'], 'node_id': e['node_id'], 'created_at': e['created_at'],
+                   'event': 'labeled' if e['action'] == 'add' else 'unlabeled',
+                   'label': {'name': e['label'], 'color': found.labels[e['label']]['color'].lstrip('#')},
+                   'actor': {'login': e['user']}}
+                  for e in issue['events']]
+        return 200, self.paginate(events, 30)
+
+    def github_list_labels(self, data, owner, repo):
+        found = self.get_github_project(owner, repo)
+        return 200, [self.github_label(found, label) for label in self.paginate(list(found.labels.values()), 30)]
+
+    def github_create_label(self, data, owner, repo):
+        found = self.get_github_project(owner, repo)
+        with self.server.lock:
+            if data['name'] in found.labels:
+                return 422, {'message': 'Validation Failed'}
+            label = found.add_label(data['name'], '#' + data.get('color', 'ededed').lstrip('#'))
+        return 201, self.github_label(found, label)
+
+    def github_get_label(self, data, owner, repo, label):
+        found = self.get_github_project(owner, repo)
+        if label not in found.labels:
+            raise LookupError(f"label {label}")
+        return 200, self.github_label(found, found.labels[label])
+
+    def github_edit_label(self, data, owner, repo, label):
+        found = self.get_github_project(owner, repo)
+        if label not in found.labels:
+            raise LookupError(f"label {label}")
+        with self.server.lock:
+            found.labels[label]['color'] = '#' + data.get('color', found.labels[label]['color']).lstrip('#')
+        return 200, self.github_label(found, found.labels[label])
+
+    #
+    # GitHub GraphQL
+    #
+
+    def graphql(self, data):
+        query = data.get('query', '')
+        match = re_operation.match(query)
+        name = match.group('name') if match else None
+        handler = getattr(self, f"graphql_{name}", None) if name else None
+        if handler is None:
+            return 200, {'errors': [{'message': f"Operation {name} is not supported by the fake forge."}]}
+        self.server.stats[f"POST graphql {name}"] += 1
+        try:
+            answer = handler(query, data.get('variables') or {})
+        except LookupError as e:
+            return 200, {'errors': [{'type': 'NOT_FOUND', 'message': f"Could not resolve {e}."}]}
+        # Errors of single aliases, the others succeeded.
+        errors = answer.pop('errors', None)
+        answer['rateLimit'] = {'cost': 1, 'remaining': self.rate_remaining}
+        return 200, {'data': answer, 'errors': errors} if errors else {'data': answer}
+
+    def get_cursor_page(self, items, cursor, first=100):
+        start = int(cursor) if cursor else 0
+        end = start + min(first, self.server.args.opt_page_size)
+        return items[start:end], {'hasNextPage': end < len(items), 'endCursor': str(min(end, len(items)))}
+
+    def graphql_timeline(self, issue, cursor=None):
+        nodes, page_info = self.get_cursor_page(issue['events'], cursor)
+        return {'pageInfo': page_info,
+                'nodes': [{'__typename': 'LabeledEvent' if e['action'] == 'add' else 'UnlabeledEvent',
+                           'id': e['node_id'], 'createdAt': e['created_at'],
+                           'actor': {'login': e['user']}, 'label': {'name': e['label']}}
+                          for e in nodes]}
+
+    def graphql_open_issues(self, query, variables):
+        found = self.get_github_project(variables['owner'], variables['name'])
+        # Oldest first, unless asked otherwise, as GitHub does.
+        with self.server.lock:
+            issues = [i for i in found.issues if i['state'] == 'opened']
+        if re_newest_first.search(query):
+            issues.reverse()
+        nodes, page_info = self.get_cursor_page(issues, variables.get('cursor'))
+        return found, nodes, page_info
+
+    def graphql_GgiIssues(self, query, variables):
+        found, nodes, page_info = self.graphql_open_issues(query, variables)
+        return {'repository': {'issues': {'pageInfo': page_info, 'nodes': [{
+            'databaseId': i['id'], 'number': i['number'], 'title': i['title'], 'body': i['body'],
+            'state': 'OPEN', 'updatedAt': i['updated_at'],
+            'url': f"{self.base}/{found.path}/issues/{i['number']}",
+            'labels': {'nodes': [{'name': name} for name in i['labels']]},
+            'timelineItems': self.graphql_timeline(i)} for i in nodes]}}}
+
+    def graphql_GgiIssueTimeline(self, query, variables):
+        found = self.get_github_project(variables['owner'], variables['name'])
+        issue = found.get_issue(variables['number'])
+        if issue is None:
+            raise LookupError(f"issue {variables['number']}")
+        return {'repository': {'issue': {'timelineItems': self.graphql_timeline(issue, variables.get('cursor'))}}}
+
+    def graphql_GgiBoardIssues(self, query, variables):
+        found, nodes, page_info = self.graphql_open_issues(query, variables)
+        return {'repository': {'issues': {'pageInfo': page_info, 'nodes': [{
+            'id': i['node_id'], 'title': i['title'],
+            'labels': {'nodes': [{'name': name} for name in i['labels']]}} for i in nodes]}}}
+
+    def graphql_GgiLabels(self, query, variables):
+        found = self.get_github_project(variables['owner'], variables['name'])
+        with self.server.lock:
+            labels = list(found.labels.values())
+        nodes, page_info = self.get_cursor_page(labels, variables.get('cursor'))
+        return {'repository': {'labels': {'pageInfo': page_info,
+                                          'nodes': [{'id': label['node_id'], 'name': label['name']}
+                                                    for label in nodes]}}}
+
+    def graphql_GgiCreateIssues(self, query, variables):
+        answer = {}
+        for alias, issue_input in variables.items():
+            found, _ = self.server.nodes.get(issue_input['repositoryId']) or \
+                self.get_repository_node(issue_input['repositoryId'])
+            names = [label['name'] for label in found.labels.values() if label['node_id'] in issue_input.get('labelIds', [])]
+            with self.server.lock:
+                issue = found.add_issue(issue_input['title'], issue_input.get('body', ''), names,
+                                        'ggi-deploy', format_time(datetime.now(timezone.utc)))
+            answer[alias] = {'issue': {'number': issue['number']}}
+        return answer
+
+    def get_repository_node(self, node_id):
+        for (forge, path), project in self.server.projects.items():
+            if forge == 'github' and f"R_{project.pid}" == node_id:
+                self.server.nodes[node_id] = (project, None)
+                return project, None
+        raise LookupError(f"repository {node_id}")
+
+    def graphql_GgiResolveBoard(self, query, variables):
+        found = self.get_github_project(variables['owner'], variables['name'])
+        projects = [board for board in found.projects if variables['title'] in board['title']]
+        return {'repository': {
+            'id': f"R_{found.pid}", 'owner': {'id': f"U_{found.pid}"},
+            'projectsV2': {'nodes': [{
+                'id': board['id'], 'title': board['title'],
+                'field': {'id': board['fields'][variables['field']]['id']}
+                if variables['field'] in board['fields'] else None} for board in projects]}}}
+
+    def graphql_GgiCreateProject(self, query, variables):
+        found, _ = self.server.nodes.get(variables['repo_id']) or self.get_repository_node(variables['repo_id'])
+        if variables['owner_id'] != f"U_{found.pid}":
+            raise LookupError(f"owner {variables['owner_id']}")
+        with self.server.lock:
+            board = {'id': f"PVT_{found.get_id()}", 'title': variables['title'], 'fields': {}, 'items': []}
+            found.projects.append(board)
+            self.server.nodes[board['id']] = (found, board)
+        return {'createProjectV2': {'projectV2': {'id': board['id'], 'title': board['title']}}}
+
+    def graphql_GgiCreateGoalField(self, query, variables):
+        found, board = self.get_project_v2(variables['project_id'])
+        with self.server.lock:
+            field = {'id': f"PVTSSF_{found.get_id()}",
+                     'options': [{'id': f"PVTSO_{found.get_id()}", 'name': option['name']}
+                                 for option in variables['options']]}
+            board['fields'][variables['name']] = field
+        return {'createProjectV2Field': {'projectV2Field': {'id': field['id'], 'name': variables['name'],
+                                                            'options': field['options']}}}
+
+    def get_project_v2(self, node_id):
+        if node_id not in self.server.nodes:
+            raise LookupError(f"project {node_id}")
+        return self.server.nodes[node_id]
+
+    def graphql_GgiProjectBoard(self, query, variables):
+        found, board = self.get_project_v2(variables['project_id'])
+        nodes, page_info = self.get_cursor_page(board['items'], variables.get('cursor'))
+        field = board['fields'].get('Goal Category')
+        return {'node': {
+            'field': {'id': field['id'], 'options': field['options']} if field else None,
+            'items': {'pageInfo': page_info, 'nodes': [{
+                'id': item['id'], 'content': {'id': item['content']},
+                'fieldValueByName': {'optionId': item['values'][field['id']]}
+                if field and field['id'] in item['values'] else None} for item in nodes]}}}
+
+    def set_alias_error(self, answer, alias, message):
+        answer[alias] = None
+        answer.setdefault('errors', []).append({'type': 'NOT_FOUND', 'path': [alias],
+                                                'message': f"Could not resolve {message}."})
+
+    def graphql_GgiAddItems(self, query, variables):
+        found, board = self.get_project_v2(variables['project_id'])
+        answer = {}
+        with self.server.lock:
+            contents = {i['node_id'] for i in found.issues}
+            for match in re_add_item.finditer(query):
+                content = variables[match.group('content')]
+                if content not in contents:
+                    self.set_alias_error(answer, match.group('alias'), f"issue {content}")
+                    continue
+                item = {'id': f"PVTI_{found.get_id()}", 'content': content, 'values': {}}
+                board['items'].append(item)
+                answer[match.group('alias')] = {'item': {'id': item['id']}}
+        return answer
+
+    def graphql_GgiSetGoals(self, query, variables):
+        found, board = self.get_project_v2(variables['project_id'])
+        items = {item['id']: item for item in board['items']}
+        answer = {}
+        with self.server.lock:
+            for match in re_set_goal.finditer(query):
+                item_id = variables[match.group('item')]
+                if item_id not in items:
+                    self.set_alias_error(answer, match.group('alias'), f"item {item_id}")
+                    continue
+                items[item_id]['values'][variables['field_id']] = variables[match.group('option')]
+                answer[match.group('alias')] = {'projectV2Item': {'id': item_id}}
+        return answer
+
+
+def main():
+    """
+    Main sequence.
+    """
+    args = parse_args()
+
+    server = FakeForge(('127.0.0.1', args.opt_port), args)
+    base = f"http://127.0.0.1:{args.opt_port}"
+    print(f"# Fake forge listening on {base}.")
+    if args.opt_record:
+        print(f"- Recording answers of {args.opt_record} to {args.opt_cassette}.")
+    else:
+        print(f"- Latency {args.opt_latency:.0f}ms (+{args.opt_jitter:.0f}ms), " +
+              f"{args.opt_page_size} item(s) per page, {args.opt_rate_limit} request(s) " +
+              f"per {args.opt_rate_window:.0f}s.")
+    print(f"- GitLab: gitlab_url {base}")
+    print(f"- GitHub: github_host {base}")
+
+    # Stop cleanly when the CI job kills the server.
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    server.report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+This script refreshes many GGI boards from a single process:
+- reads the list of boards from `conf/ggi_fleet.json`,
+- retrieves the issues of every board concurrently, GitLab or GitHub,
+- writes every board to its own copy of the static website, in
+  `<output_dir>/<board name>/`.
+
+Board websites are copied from the `web` template as committed, read
+with `git archive`: the working `web` directory holds the files
+generated by single-board runs, and their keywords are replaced in place.
+
+All boards on the same forge host share one rate-limit budget (see
+ggi_http.Throttle), and the activities metadata, HTTP cache and scorecard
+memo are loaded once for the whole fleet.
+
+Each board reads its token from the environment variable named by its
+`token_env` field, GGI_GITLAB_TOKEN or GGI_GITHUB_TOKEN by default.
+
+The run report, with timings of every board, is written to
+`web/ggi_runs/ggi_fleet.json`, see ggi_instrument.
+
+usage: ggi_fleet [-h] [-f FLEET] [-j JOBS] [-w WORKERS] [-g] [-i] [-c] [-u] [-s] [--profile]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -f FLEET, --fleet FLEET
+                        Fleet configuration file (default conf/ggi_fleet.json)
+  -j JOBS, --jobs JOBS  Number of boards refreshed concurrently (default 4)
+  -w WORKERS, --workers WORKERS
+                        Number of fetch workers per board (default 4)
+  -g, --graphql         Fetch GitHub boards with the GraphQL API
+  -i, --incremental     Only fetch issues updated since the last sync
+  -c, --http-cache      Revalidate cached API responses with ETags
+  -u, --unchanged-status
+                        Exit with status 3 if no board changed
+  -s, --history-store   Keep label events in the history store of each board
+  --profile             Profile the run with cProfile, next to the run report
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ggi_update_website_github as github_board
+import ggi_update_website_gitlab as gitlab_board
+from ggi_http import HttpCache, report_throttles
+from ggi_instrument import instrument, run_report_dir
+from ggi_update_website import *
+
+file_fleet = 'conf/ggi_fleet.json'
+web_template_dir = 'web'
+
+default_token_env = {
+    'gitlab': 'GGI_GITLAB_TOKEN',
+    'github': 'GGI_GITHUB_TOKEN'
+}
+
+
+def parse_args():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(prog='ggi_fleet')
+    parser.add_argument('-f', '--fleet',
+                        dest='opt_fleet',
+                        default=file_fleet,
+                        help='Fleet configuration file')
+    parser.add_argument('-j', '--jobs',
+                        dest='opt_jobs',
+                        type=int,
+                        default=4,
+                        help='Number of boards refreshed concurrently')
+    parser.add_argument('-w', '--workers',
+                        dest='opt_workers',
+                        type=int,
+                        default=4,
+                        help='Number of fetch workers per board')
+    parser.add_argument('-g', '--graphql',
+                        dest='opt_graphql',
+                        action='store_true',
+                        help='Fetch GitHub boards with the GraphQL API')
+    parser.add_argument('-i', '--incremental',
+                        dest='opt_incremental',
+                        action='store_true',
+                        help='Only fetch issues updated since the last sync')
+    parser.add_argument('-c', '--http-cache',
+                        dest='opt_http_cache',
+                        action='store_true',
+                        help='Revalidate cached API responses with ETags')
+    parser.add_argument('-u', '--unchanged-status',
+                        dest='opt_unchanged_status',
+                        action='store_true',
+                        help=f'Exit with status {unchanged_exit_status} if no board changed')
+    parser.add_argument('-s', '--history-store',
+                        dest='opt_history_store',
+                        action='store_true',
+                        help='Keep label events in the history store of each board')
+    parser.add_argument('--profile',
+                        dest='opt_profile',
+                        action='store_true',
+                        help='Profile the run with cProfile, next to the run report')
+    return parser.parse_args()
+
+
+def get_board_params(board: dict, defaults: dict):
+    """
+    Build the parameters of a board, as retrieve_env does for a single one.
+
+    Progress labels default to the ones of the deployment configuration.
+    """
+    forge = board.get('forge', 'gitlab')
+    params = {'progress_labels': defaults['progress_labels']}
+    params.update(board)
+
+    token_env = board.get('token_env', default_token_env[forge])
+    if token_env not in os.environ:
+        raise ValueError(f"Cannot find env var {token_env} for board {board['name']}.")
+
+    if forge == 'gitlab':
+        params['GGI_GITLAB_URL'] = params['gitlab_url']
+        params['GGI_GITLAB_PROJECT'] = params['gitlab_project']
+        params['GGI_GITLAB_TOKEN'] = os.environ[token_env]
+        params['GGI_PAGES_URL'] = board.get('pages_url')
+        gitlab_board.set_board_urls(params)
+    elif forge == 'github':
+        params['GGI_GITHUB_PROJECT'] = params['github_project']
+        params['GGI_GITHUB_TOKEN'] = os.environ[token_env]
+        github_board.set_board_urls(params)
+        if board.get('pages_url'):
+            params['GGI_PAGES_URL'] = board['pages_url']
+    else:
+        raise ValueError(f"Unknown forge {forge} for board {board['name']}.")
+    return params
+
+
+def export_web_template():
+    """
+    Write the website template, as committed, to a temporary directory and
+    return it. If git cannot read it, the working `web` directory is used
+    without its generated files, and with the keywords already replaced
+    by previous runs.
+    """
+    template_dir = tempfile.mkdtemp(prefix='ggi_fleet_template_')
+    try:
+        archive = subprocess.run(['git', 'archive', '--format=tar', f'HEAD:{web_template_dir}'],
+                                 capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"- Cannot read the website template from git ({e}), copying {web_template_dir}.")
+        shutil.copytree(web_template_dir, template_dir, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('public', 'resources', '*.bak', manifest_name,
+                                                      'ggi_snapshots.csv', os.path.basename(run_report_dir),
+                                                      'activity_*.md', '*.csv'))
+        return template_dir
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(template_dir)
+    return template_dir
+
+
+def refresh_board(params: dict, web_dir: str, graphql=False, template_dir=web_template_dir):
+    """
+    Retrieve the issues of a board and write its website to `web_dir`,
+    from a copy of `template_dir`.
+
+    Returns the timings of the board.
+    """
+    timing = {'issues': 0, 'changed': 0, 'fetch': 0.0, 'write': 0.0}
+    with instrument.span(params['name']):
+        start = time.perf_counter()
+        with instrument.span('fetch'):
+            if params['forge'] == 'gitlab':
+                issues, tasks, hist = gitlab_board.retrieve_gitlab_issues(params)
+            elif graphql:
+                issues, tasks, hist = github_board.retrieve_github_issues_graphql(params)
+            else:
+                issues, tasks, hist = github_board.retrieve_github_issues(params)
+        timing['issues'] = len(issues)
+        timing['fetch'] = time.perf_counter() - start
+
+        with instrument.span('aggregate'):
+            issues, tasks, hist = to_tables(issues, tasks, hist)
+            if params.get('history_store'):
+                hist = store_history(params, hist, web_dir)
+        start = time.perf_counter()
+        print(f"\n# Writing board {params['name']} to {web_dir}.")
+        with instrument.span('write'):
+            shutil.copytree(template_dir, web_dir, dirs_exist_ok=True)
+            write_to_csv(issues, tasks, hist, web_dir=web_dir)
+            write_activities_to_md(issues, web_dir=web_dir)
+            write_data_points(issues, params, web_dir=web_dir)
+            write_flow_metrics(issues, hist, params, web_dir=web_dir)
+        with instrument.span('keywords'):
+            update_website_keywords(params, web_dir=web_dir)
+        timing['changed'] = len(save_manifest(web_dir))
+        timing['write'] = time.perf_counter() - start
+    return timing
+
+
+def print_summary(results):
+    """
+    Print the timings of every board.
+    """
+    print("\n# Fleet summary")
+    print(f"  {'Board':30} {'Forge':7} {'Issues':>7} {'Changed':>8} {'Fetch':>8} {'Write':>8} {'Total':>8}  Status")
+    for name, forge, timing, status in results:
+        total = timing['fetch'] + timing['write']
+        print(f"  {name:30} {forge:7} {timing['issues']:7} {timing['changed']:8} {timing['fetch']:7.1f}s " +
+              f"{timing['write']:7.1f}s {total:7.1f}s  {status}")
+
+
+def main():
+    """
+    Main sequence.
+    """
+    args = parse_args()
+    instrument.start('ggi_fleet', profile=args.opt_profile)
+
+    with instrument.span('env'):
+        print(f"# Reading fleet configuration from {args.opt_fleet}.")
+        with open(args.opt_fleet, 'r', encoding='utf-8') as f:
+            fleet = json.load(f)
+        with open(file_conf, 'r', encoding='utf-8') as f:
+            defaults = json.load(f)
+        metadata = read_activities_metadata()
+        http_cache = HttpCache() if args.opt_http_cache else None
+        scorecards.load()
+    output_dir = fleet.get('output_dir', 'fleet')
+
+    boards = []
+    results = []
+    for board in fleet['boards']:
+        try:
+            params = get_board_params(board, defaults)
+        except ValueError as e:
+            print(f"- {e} Skipping board.")
+            results.append((board['name'], board.get('forge', 'gitlab'),
+                            {'issues': 0, 'changed': 0, 'fetch': 0.0, 'write': 0.0}, 'skipped'))
+            continue
+        params['forge'] = board.get('forge', 'gitlab')
+        params['metadata'] = metadata
+        params['http_cache'] = http_cache
+        params['fetch_workers'] = max(1, args.opt_workers)
+        params['incremental'] = args.opt_incremental
+        params['history_store'] = args.opt_history_store
+        boards.append(params)
+    print(f"- Refreshing {len(boards)} board(s) with {args.opt_jobs} job(s).")
+    template_dir = export_web_template()
+
+    with instrument.span('boards'), ThreadPoolExecutor(max_workers=max(1, args.opt_jobs)) as executor:
+        futures = [(params, executor.submit(instrument.bind(refresh_board), params,
+                                            os.path.join(output_dir, params['name']),
+                                            args.opt_graphql, template_dir))
+                   for params in boards]
+        for params, future in futures:
+            try:
+                results.append((params['name'], params['forge'], future.result(), 'ok'))
+            except Exception as e:
+                print(f"- Board {params['name']} failed: {e}")
+                results.append((params['name'], params['forge'],
+                                {'issues': 0, 'changed': 0, 'fetch': 0.0, 'write': 0.0}, 'failed'))
+    shutil.rmtree(template_dir)
+
+    if http_cache:
+        http_cache.report()
+    report_throttles()
+    scorecards.save()
+    scorecards.report()
+    print_summary(results)
+
+    if any(status != 'ok' for _, _, _, status in results):
+        exit(1)
+    print("Done.")
+
+    if args.opt_unchanged_status and not any(timing['changed'] for _, _, timing, _ in results):
+        print("No content change.")
+        exit(unchanged_exit_status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Minimal GitHub GraphQL client used by the GGI scripts.
+
+It keeps track of the number of requests sent and of the rate-limit
+points consumed, as reported by the `rateLimit` field of the queries.
+Requests are paced by the Throttle shared with REST calls to the same host.
+
+* Clients are shared by endpoint and token with `get_graphql_client`, so
+  that all queries of a run reuse the same pooled keep-alive connections.
+  Answers are gzip-compressed.
+* Every request has a timeout. Queries failing with a connection error,
+  a timeout or a 502/503/504 answer are retried with exponential
+  back-off. Mutations may have been applied in that case, and are only
+  retried when the connection could not be opened.
+* Node ids resolved by the scripts (owner, repository, project, field)
+  are kept in a NodeIdCache saved in the `.ggi_cache` directory, to skip
+  lookups on later runs.
+"""
+
+import json
+import os
+import threading
+import time
+
+import requests
+import urllib3
+
+from ggi_http import ForgeSession, get_github_throttle
+
+public_graphql_url = 'https://api.github.com/graphql'
+
+# Seconds to open a connection, and to receive an answer.
+graphql_timeout = (10, 60)
+# Retry a failing request at most this many times.
+graphql_max_retries = 4
+# First back-off delay, doubled on every retry.
+graphql_backoff = 1
+graphql_retry_statuses = [502, 503, 504]
+
+node_cache_file = os.path.join('.ggi_cache', 'graphql_nodes.json')
+
+
+def get_graphql_url(api_url):
+    """
+    Compute the GraphQL endpoint from the REST API URL.
+
+    Public GitHub uses api.github.com, GitHub Enterprise serves GraphQL
+    at `<host>/api/graphql` next to the REST API at `<host>/api/v3`.
+    """
+    if api_url is None or api_url.startswith('https://api.github.com'):
+        return public_graphql_url
+    return api_url.rstrip('/').removesuffix('/v3') + '/graphql'
+
+
+def is_unsent(error):
+    """
+    Tell if a request failed before it could be sent, i.e. when opening
+    the connection.
+    """
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectTimeout) or \
+        isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class GraphQLError(Exception):
+    """
+    A GraphQL answer with an `errors` member, and the `data` member of
+    the fields which succeeded, if any.
+    """
+
+    def __init__(self, errors, data=None):
+        super().__init__(f"Query failed with errors: {errors}")
+        self.errors = errors
+        self.data = data
+
+    def is_not_found(self):
+        return any(error.get('type') == 'NOT_FOUND' for error in self.errors)
+
+
+class NodeIdCache:
+    """
+    GraphQL node ids by endpoint and key, e.g. `repo ospo-alliance/my-ggi-board`.
+
+    Node ids never change, but their objects can be deleted: callers
+    forget the ids answered as not found, and resolve them again.
+    """
+
+    def __init__(self, path=node_cache_file):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.changed = False
+
+    def get(self, url, key):
+        return self.entries.get(f"{url} {key}")
+
+    def set(self, url, key, node_id):
+        with self.lock:
+            if self.entries.get(f"{url} {key}") != node_id:
+                self.entries[f"{url} {key}"] = node_id
+                self.changed = True
+
+    def forget(self, url, keys):
+        with self.lock:
+            for key in keys:
+                if self.entries.pop(f"{url} {key}", None) is not None:
+                    self.changed = True
+
+    def load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.entries = json.load(f)
+
+    def save(self):
+        """
+        Write the node ids if they changed, atomically.
+        """
+        if self.path is None or not self.changed:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+            self.changed = False
+
+
+class GraphQLClient:
+    """
+    Sends GraphQL queries to GitHub and accounts for their cost.
+    """
+
+    def __init__(self, url, token, nodes=None):
+        self.url = url
+        self.session = ForgeSession(throttle=get_github_throttle(url))
+        self.session.headers.update({
+            'Authorization': f'bearer {token}',
+            'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip'
+        })
+        self.nodes = nodes or NodeIdCache(path=None)
+        self.requests = 0
+        self.retries = 0
+        self.cost = 0
+        self.remaining = None
+
+    def post(self, query, variables):
+        """
+        Send a query, retrying transient failures. Mutations are only
+        retried if they could not be sent.
+        """
+        is_mutation = query.lstrip().startswith('mutation')
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.url, json={'query': query, 'variables': variables or {}},
+                                             timeout=graphql_timeout)
+                if response.status_code not in graphql_retry_statuses or is_mutation:
+                    return response
+                error = f"status {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if is_mutation and not is_unsent(e):
+                    raise
+                error = e
+            if attempt >= graphql_max_retries:
+                raise Exception(f"Query failed after {attempt + 1} attempt(s): {error}")
+            delay = graphql_backoff * 2 ** attempt
+            print(f"  GraphQL request failed ({error}), retrying in {delay}s.")
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+    def query(self, query, variables=None):
+        """
+        Execute a query and return its `data` member.
+
+        Raises an exception if the server answers with an error status, or
+        a GraphQLError for a GraphQL `errors` member.
+        """
+        response = self.post(query, variables)
+        self.requests += 1
+        if response.status_code != 200:
+            raise Exception(f"Query failed with status {response.status_code}: {response.text}")
+        data = response.json()
+        if 'errors' in data:
+            raise GraphQLError(data['errors'], data.get('data'))
+        rate_limit = data['data'].get('rateLimit')
+        if rate_limit:
+            self.cost += rate_limit['cost']
+            self.remaining = rate_limit['remaining']
+        return data['data']
+
+    def report(self):
+        """
+        Print the number of requests and rate-limit points used so far.
+        """
+        print(f"  GraphQL: {self.requests} request(s), {self.retries} retry(ies), " +
+              f"{self.cost} rate-limit point(s) used, {self.remaining} remaining.")
+
+    def close(self):
+        self.session.close()
+
+
+# Shared clients, by endpoint and token.
+graphql_clients = {}
+graphql_clients_lock = threading.Lock()
+node_ids = None
+
+
+def get_graphql_client(url, token):
+    """
+    Get the client shared by all queries to `url` with `token`, creating
+    it if needed. Clients share the node ids saved by previous runs.
+    """
+    global node_ids
+    with graphql_clients_lock:
+        if node_ids is None:
+            node_ids = NodeIdCache()
+            node_ids.load()
+        if (url, token) not in graphql_clients:
+            graphql_clients[(url, token)] = GraphQLClient(url, token, node_ids)
+        return graphql_clients[(url, token)]
+
+
+def close_graphql_clients():
+    """
+    Close the shared clients, and save the node ids they resolved.
+    """
+    with graphql_clients_lock:
+        for client in graphql_clients.values():
+            client.close()
+        graphql_clients.clear()
+        if node_ids is not None:
+            node_ids.save()
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Append-only store of the label events of a board.
+
+Events are kept in the `.ggi_cache/history/<project>/` directory, one
+gzipped CSV partition per month of event time:
+
+    .ggi_cache/history/ggi_my-ggi-board/2024-01.csv.gz
+
+New events are de-duplicated against the partition of their month by
+issue, time and action, which are the same whether events were fetched
+with the REST API (numeric event ids) or with GraphQL (node ids). Only
+the partitions that received new events are rewritten.
+Events are never removed, so the history of closed issues is kept. The
+store is only kept by the CI cache: a warning is printed if it is lost,
+see check_store in ggi_update_website.
+
+Once read, author, action and type columns are categoricals, and time is
+a UTC datetime.
+"""
+
+import os
+import re
+
+import pandas as pd
+
+history_dir = '.ggi_cache/history'
+hist_cols = ['time', 'issue_id', 'event_id', 'type', 'author', 'action', 'url']
+category_cols = ['type', 'author', 'action']
+# Identify an event whatever the API it was fetched with.
+key_cols = ['issue_id', 'time', 'action']
+
+
+def get_history_dir(project: str):
+    """
+    Compute the history directory of a project, e.g. `ggi/my-ggi-board`.
+    """
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', project)
+    return os.path.join(history_dir, slug)
+
+
+def normalize_history(hist: pd.DataFrame):
+    """
+    Apply the store dtypes to a hist dataframe.
+    """
+    hist = hist[hist_cols].copy()
+    hist['time'] = pd.to_datetime(hist['time'], utc=True, format='ISO8601')
+    hist['event_id'] = hist['event_id'].astype(str)
+    for col in category_cols:
+        hist[col] = hist[col].astype('category')
+    return hist
+
+
+def get_event_keys(hist: pd.DataFrame):
+    return pd.MultiIndex.from_arrays([hist['issue_id'].astype(str), hist['time'], hist['action'].astype(str)])
+
+
+def read_history_partition(project: str, month: str):
+    """
+    Read the events of a month, or an empty dataframe.
+    """
+    path = os.path.join(get_history_dir(project), f'{month}.csv.gz')
+    if not os.path.isfile(path):
+        return normalize_history(pd.DataFrame(columns=hist_cols))
+    return normalize_history(pd.read_csv(path, dtype={'event_id': str}))
+
+
+def write_history_partition(project: str, month: str, hist: pd.DataFrame):
+    """
+    Write the events of a month atomically, ordered by time.
+    """
+    directory = get_history_dir(project)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{month}.csv.gz')
+    hist = hist.sort_values(['time', 'event_id'], kind='stable')
+    hist.to_csv(path + '.tmp', index=False, compression='gzip')
+    os.replace(path + '.tmp', path)
+
+
+def append_history(project: str, hist: pd.DataFrame):
+    """
+    Append new events to the history store of a project.
+
+    Returns the number of events added.
+    """
+    hist = normalize_history(hist)
+    months = hist['time'].dt.strftime('%Y-%m')
+    added = 0
+    for month, events in hist.groupby(months, sort=True):
+        stored = read_history_partition(project, month)
+        new = events[~get_event_keys(events).isin(get_event_keys(stored))]
+        new = new[~get_event_keys(new).duplicated()]
+        if len(new) > 0:
+            if len(stored) > 0:
+                new = pd.concat([stored, new], ignore_index=True)
+            write_history_partition(project, month, new)
+            added += len(new) - len(stored)
+    print(f"- History store {get_history_dir(project)}: {added} new event(s) in " +
+          f"{months.nunique()} month(s).")
+    return added
+
+
+def read_history(project: str):
+    """
+    Read all events of a project, ordered by time. Events stored twice by
+    previous versions, with both kinds of event ids, are only returned once.
+    """
+    directory = get_history_dir(project)
+    months = sorted(f[:-len('.csv.gz')] for f in os.listdir(directory)
+                    if f.endswith('.csv.gz')) if os.path.isdir(directory) else []
+    if not months:
+        return normalize_history(pd.DataFrame(columns=hist_cols))
+    hist = pd.concat([pd.read_csv(os.path.join(directory, f'{month}.csv.gz'), dtype={'event_id': str})
+                      for month in months], ignore_index=True)
+    hist = normalize_history(hist)
+    return hist[~get_event_keys(hist).duplicated()].reset_index(drop=True)
@@ -0,0 +1,471 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+HTTP plumbing shared by the GitHub and GitLab clients.
+
+* HttpCache stores GET responses on disk along with their ETag and
+  Last-Modified headers.
+* ForgeSession is a requests session that replays cached GET requests
+  with If-None-Match / If-Modified-Since, and serves 304 answers from
+  the cache. On GitHub, 304 answers do not count against the rate limit.
+* Throttle paces requests to a forge host with a token bucket, waits
+  when the X-RateLimit-* / RateLimit-* headers say the budget is spent,
+  and backs off exponentially on 403/429 rate-limit answers. There is
+  one Throttle per host, shared by every session talking to it. GraphQL
+  queries are paced as reads, only mutations as writes.
+* install_github_session makes PyGithub send its requests through a
+  given session, python-gitlab accepts one directly. It relies on
+  PyGithub internals, hence the exact version in requirements.txt.
+  PyGithub is only imported then, so GitLab boards never load it.
+
+Every answer received by a ForgeSession is accounted for by
+ggi_instrument, including retried and revalidated requests.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from ggi_instrument import instrument
+
+http_cache_dir = os.path.join('.ggi_cache', 'http')
+# Entries older than this are dropped, whatever their validity.
+http_cache_ttl = 7 * 24 * 3600
+# Least recently used entries are dropped beyond this size.
+http_cache_max_bytes = 100 * 1024 * 1024
+
+# GitHub secondary rate limit: at most 80 content-creating requests per minute.
+github_write_rate = 80 / 60
+# Give up after this many rate-limited answers for the same request.
+throttle_max_retries = 6
+# First back-off delay, doubled on every retry.
+throttle_backoff = 2
+
+# GraphQL mutations, the only GraphQL requests counted as writes.
+re_mutation = re.compile(r"^\s*mutation\b")
+
+# Headers describing the payload, which must not be replayed as is.
+payload_headers = ['content-encoding', 'content-length', 'transfer-encoding']
+
+
+class HttpCache:
+    """
+    On-disk store of GET responses, with hit/miss accounting.
+
+    Each entry is made of a `<key>.json` metadata file and a `<key>.body`
+    file holding the decoded response body.
+    """
+
+    def __init__(self, directory=http_cache_dir, ttl=http_cache_ttl, max_bytes=http_cache_max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_key(self, url, headers):
+        """
+        Compute the key of a request from its URL and credentials, so
+        that tokens with different scopes never share entries.
+        """
+        auth = headers.get('Authorization') or headers.get('PRIVATE-TOKEN') or ''
+        return hashlib.sha256(f"{url}\n{auth}".encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Read an entry, or return None if it is missing or expired.
+        """
+        meta_file = os.path.join(self.directory, key + '.json')
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(os.path.join(self.directory, key + '.body'), 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if time.time() - meta['stored_at'] > self.ttl:
+            return None
+        return meta, body
+
+    def put(self, key, response):
+        """
+        Store a response if it carries a validator.
+        """
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in payload_headers}
+        meta = {
+            'url': response.url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'headers': headers,
+            'encoding': response.encoding,
+            'stored_at': time.time()
+        }
+        body_file = os.path.join(self.directory, key + '.body')
+        with open(body_file + '.tmp', 'wb') as f:
+            f.write(response.content)
+        os.replace(body_file + '.tmp', body_file)
+        meta_file = os.path.join(self.directory, key + '.json')
+        with open(meta_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_file + '.tmp', meta_file)
+
+    def touch(self, key):
+        """
+        Mark an entry as recently used, for size-based eviction.
+        """
+        for ext in ['.json', '.body']:
+            try:
+                os.utime(os.path.join(self.directory, key + ext))
+            except OSError:
+                pass
+
+    def record(self, hit, size=0):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.bytes_saved += size
+            else:
+                self.misses += 1
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used entries until the
+        cache fits in `max_bytes`.
+        """
+        entries = {}
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext not in ['.json', '.body']:
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            size, used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        now = time.time()
+        evicted = 0
+        total = sum(size for size, used in entries.values())
+        for key, (size, used) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if now - used > self.ttl or total > self.max_bytes:
+                for ext in ['.json', '.body']:
+                    try:
+                        os.remove(os.path.join(self.directory, key + ext))
+                    except OSError:
+                        pass
+                total -= size
+                evicted += 1
+        return evicted, total
+
+    def report(self):
+        """
+        Evict stale entries and print hit/miss statistics.
+        """
+        evicted, total = self.evict()
+        print(f"\n# HTTP cache: {self.hits} hit(s), {self.misses} miss(es), " +
+              f"{self.bytes_saved / 1024:.1f} KiB saved, {evicted} evicted, " +
+              f"{total / 1024:.1f} KiB stored in {self.directory}.")
+
+
+class Throttle:
+    """
+    Rate-limit aware pacing of the requests sent to one forge host.
+
+    Writes are paced by a token bucket of `write_rate` tokens per second
+    holding at most `burst` tokens; reads are only paced by `read_rate` if
+    set. See get_request_kind for what is a write. Rate-limit headers of every
+    answer are recorded, and when the remaining budget is spent all
+    requests wait for its reset.
+    """
+
+    def __init__(self, read_rate=None, write_rate=None, burst=10):
+        self.rates = {'read': read_rate, 'write': write_rate}
+        self.burst = burst
+        self.tokens = {'read': burst, 'write': burst}
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0
+        self.remaining = None
+        self.waited = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def wait(self, kind):
+        """
+        Block until a request of the given kind, 'read' or 'write', may
+        be sent.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                elapsed = now - self.last_refill
+                self.last_refill = now
+                for k, rate in self.rates.items():
+                    if rate:
+                        self.tokens[k] = min(self.burst, self.tokens[k] + elapsed * rate)
+                delay = max(0, self.blocked_until - time.time())
+                if delay == 0:
+                    if not self.rates[kind]:
+                        return
+                    if self.tokens[kind] >= 1:
+                        self.tokens[kind] -= 1
+                        return
+                    delay = (1 - self.tokens[kind]) / self.rates[kind]
+                self.waited += delay
+            time.sleep(delay)
+
+    def update(self, response, attempt):
+        """
+        Record the rate-limit headers of an answer.
+
+        Returns the delay to wait before retrying the request if it was
+        rejected by a rate limit, or None if it must not be retried.
+        """
+        headers = response.headers
+        remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+        reset = headers.get('X-RateLimit-Reset', headers.get('RateLimit-Reset'))
+        retry_after = headers.get('Retry-After')
+        with self.lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+                if self.remaining == 0 and reset is not None:
+                    self.blocked_until = max(self.blocked_until, float(reset) + 1)
+
+        if response.status_code not in [403, 429]:
+            return None
+        # A 403 is only a rate limit if the server says so, otherwise it
+        # is a genuine permission error which retrying would not fix.
+        rate_limited = response.status_code == 429 or retry_after is not None or \
+            remaining == '0' or 'rate limit' in response.text.lower()
+        if not rate_limited or attempt >= throttle_max_retries:
+            return None
+
+        if retry_after is not None:
+            delay = float(retry_after)
+        elif remaining == '0' and reset is not None:
+            delay = float(reset) + 1 - time.time()
+        else:
+            delay = throttle_backoff * 2 ** attempt
+        delay = max(delay, throttle_backoff * 2 ** attempt)
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+            self.retries += 1
+        print(f"  Rate limited ({response.status_code}), retrying in {delay:.0f}s.")
+        return delay
+
+    def report(self, host):
+        print(f"# Throttle for {host}: waited {self.waited:.1f}s, {self.retries} retry(ies), " +
+              f"{self.remaining} request(s) remaining.")
+
+
+throttles = {}
+throttles_lock = threading.Lock()
+
+
+def get_host_throttle(url, **kwargs):
+    """
+    Get the Throttle shared by all requests to the host of `url`,
+    creating it with the given arguments if needed.
+    """
+    host = urllib.parse.urlparse(url).netloc or url
+    with throttles_lock:
+        if host not in throttles:
+            throttles[host] = Throttle(**kwargs)
+        return throttles[host]
+
+
+def get_github_throttle(url):
+    """
+    Get the Throttle of a GitHub host, whose writes are paced to stay
+    below the secondary rate limit.
+    """
+    return get_host_throttle(url, write_rate=github_write_rate)
+
+
+def report_throttles():
+    for host, throttle in throttles.items():
+        throttle.report(host)
+
+
+def get_request_kind(method, url, json_body=None, data=None):
+    """
+    Tell if a request is a 'read' or a 'write'. Anything but GET/HEAD is a
+    write, except GraphQL requests: they are all POSTs, and only mutations
+    write.
+    """
+    if method.upper() in ['GET', 'HEAD']:
+        return 'read'
+    if not urllib.parse.urlsplit(url).path.rstrip('/').endswith('/graphql'):
+        return 'write'
+    if json_body is None and data:
+        try:
+            json_body = json.loads(data)
+        except ValueError:
+            return 'write'
+    query = json_body.get('query', '') if isinstance(json_body, dict) else ''
+    return 'write' if re_mutation.match(query) else 'read'
+
+
+class ForgeSession(requests.Session):
+    """
+    A requests session that revalidates GET requests against an HttpCache,
+    and paces all its requests with a Throttle.
+    """
+
+    def __init__(self, cache=None, pool_size=requests.adapters.DEFAULT_POOLSIZE, throttle=None):
+        super().__init__()
+        self.cache = cache
+        self.throttle = throttle
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        attempt = 0
+        while True:
+            if self.throttle:
+                self.throttle.wait(get_request_kind(method, url, kwargs.get('json'), kwargs.get('data')))
+            response = self.cached_request(method, url, params=params, headers=headers, **kwargs)
+            if self.throttle is None:
+                return response
+            delay = self.throttle.update(response, attempt)
+            if delay is None:
+                return response
+            attempt += 1
+            time.sleep(delay)
+
+    def cached_request(self, method, url, params=None, headers=None, **kwargs):
+        if self.cache is None or method.upper() != 'GET':
+            return super().request(method, url, params=params, headers=headers, **kwargs)
+
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        headers = dict(headers or {})
+        key = self.cache.get_key(full_url, {**self.headers, **headers})
+        entry = self.cache.get(key)
+        if entry:
+            meta, body = entry
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = super().request(method, url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self.cache.touch(key)
+            self.cache.record(True, len(body))
+            return self.build_cached_response(response, meta, body)
+        self.cache.record(False)
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            self.cache.put(key, response)
+        return response
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # Streamed bodies are not read yet, only count what was announced.
+        size = int(response.headers.get('Content-Length', 0)) if kwargs.get('stream') else None
+        instrument.record_response(response, size)
+        return response
+
+    @staticmethod
+    def build_cached_response(response, meta, body):
+        """
+        Turn a 304 answer into the 200 answer stored in the cache, keeping
+        fresh headers (e.g. rate limit) from the 304 answer.
+        """
+        cached = requests.models.Response()
+        cached.status_code = 200
+        cached.reason = 'OK'
+        cached.headers = CaseInsensitiveDict(meta['headers'])
+        cached.headers.update({k: v for k, v in response.headers.items()
+                               if k.lower() not in payload_headers})
+        cached._content = body
+        cached.encoding = meta['encoding']
+        cached.url = response.url
+        cached.request = response.request
+        cached.connection = response.connection
+        cached.elapsed = response.elapsed
+        return cached
+
+
+# PyGithub sessions, by API host.
+github_sessions = {}
+# PyGithub connection classes using these sessions, built on first use.
+session_connection_classes = None
+github_sessions_lock = threading.Lock()
+
+
+def use_host_session(connection):
+    """
+    Make a PyGithub connection send its requests through the session
+    installed for its host, if any.
+    """
+    session = github_sessions.get(connection.host)
+    if session is not None:
+        session.auth = connection.session.auth
+        session.mount(f'{connection.protocol}://', connection.adapter)
+        connection.session = session
+
+
+def get_session_connection_classes():
+    """
+    Build the PyGithub HTTP and HTTPS connection classes using the session
+    of their host, e.g. a local test forge for HTTP.
+    """
+    from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass
+
+    class SessionHTTPConnection(HTTPRequestsConnectionClass):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            use_host_session(self)
+
+    class SessionHTTPSConnection(HTTPSRequestsConnectionClass):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            use_host_session(self)
+
+    return SessionHTTPConnection, SessionHTTPSConnection
+
+
+def install_github_session(session, url):
+    """
+    Make PyGithub send its requests to the host of `url` through the
+    given session.
+
+    Must be called before creating the Github object. Sessions are kept
+    per host, so boards on several hosts can be refreshed concurrently.
+    """
+    global session_connection_classes
+    from github.Requester import Requester
+
+    # PyGithub has no public way to use a session: connection classes are
+    # injected with its test hook, which is only known to work with the
+    # version pinned in requirements.txt.
+    if not hasattr(Requester, 'injectConnectionClasses') or not hasattr(Requester, '_Requester__persist'):
+        print("- This PyGithub version cannot use a shared session, " +
+              "requests are neither cached nor throttled.")
+        return
+    github_sessions[urllib.parse.urlsplit(url).hostname] = session
+    with github_sessions_lock:
+        if session_connection_classes is None:
+            session_connection_classes = get_session_connection_classes()
+    Requester.injectConnectionClasses(*session_connection_classes)
+    # Injecting connection classes disables persistent connections,
+    # which is only meant for PyGithub's own tests.
+    Requester._Requester__persist = True
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Instrumentation of the GGI scripts, through the `instrument` singleton.
+
+* Timing spans: `with instrument.span('fetch'):` times a phase. Spans
+  nest within a thread and are aggregated by path, e.g. `fetch/parse`,
+  with their count and cumulated time. Functions run by worker pools are
+  wrapped with `instrument.bind` to nest under the span submitting them.
+* API accounting: every answer received by a ggi_http.ForgeSession is
+  counted per endpoint, i.e. method, host and path with ids replaced by
+  placeholders, or GraphQL operation name. Bytes received, time spent,
+  status codes and the last rate-limit remaining are recorded.
+* Profiling: if requested, the main thread is profiled with cProfile and
+  the dump is written next to the run report, to be read with pstats.
+
+The run report is written at exit to `web/ggi_runs/<script>.json`, out of
+the pages published by Hugo.
+"""
+
+import atexit
+import cProfile
+import json
+import os
+import platform
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+run_report_dir = os.path.join('web', 'ggi_runs')
+
+# Path segments following these ones are names, not routes.
+named_segments = {
+    'repos': ['{owner}', '{repo}'],
+    'users': ['{owner}'],
+    'orgs': ['{owner}'],
+    'labels': ['{name}'],
+    'blobs': ['{sha}'],
+}
+re_id_segment = re.compile(r"^(\d+|[0-9a-f]{40})$")
+re_graphql_operation = re.compile(rb"\b(?:query|mutation)\s+(\w+)\s*[({]")
+
+
+def get_endpoint(method, url, body=None):
+    """
+    Compute the endpoint of a request, e.g.
+    `GET gitlab.com/api/v4/projects/{project}/issues/{id}/resource_label_events`
+    or `POST api.github.com/graphql GgiIssues`.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path.rstrip('/')
+    if path.endswith('/graphql'):
+        if isinstance(body, str):
+            body = body.encode()
+        match = re_graphql_operation.search(body[:300]) if body else None
+        return f"{method} {parts.netloc}{path} {match.group(1).decode() if match else '(anonymous)'}"
+
+    segments = []
+    names = []
+    for segment in path.split('/'):
+        if names:
+            segments.append(names.pop(0))
+        elif re_id_segment.match(segment):
+            segments.append('{id}')
+        elif '%2f' in segment.lower():
+            segments.append('{project}')
+        else:
+            segments.append(segment)
+            names = list(named_segments.get(segment, []))
+    return f"{method} {parts.netloc}{'/'.join(segments)}"
+
+
+class Instrument:
+    """
+    Timing spans, API accounting and profiling of a script run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = {}
+        self.endpoints = {}
+        self.remaining = {}
+        self.script = None
+        self.report_dir = run_report_dir
+        self.profiler = None
+        self.started = time.perf_counter()
+        self.started_at = None
+        self.finished = False
+
+    def start(self, script, report_dir=run_report_dir, profile=False):
+        """
+        Start recording a run of `script`, optionally profiled. The report
+        is written at exit.
+        """
+        self.script = script
+        self.report_dir = report_dir
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        atexit.register(self.finish)
+
+    def get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the enclosed block as `name`, nested in the current span.
+        """
+        stack = self.get_stack()
+        stack.append(name)
+        path = '/'.join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                span = self.spans.setdefault(path, [0, 0.0])
+                span[0] += 1
+                span[1] += elapsed
+
+    def bind(self, func):
+        """
+        Wrap `func` so that spans opened by it, e.g. in a worker thread,
+        nest under the current span.
+        """
+        parent = list(self.get_stack())
+
+        def run(*args, **kwargs):
+            stack = self.get_stack()
+            saved = stack[:]
+            stack[:] = parent
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stack[:] = saved
+        return run
+
+    def record_response(self, response, size=None):
+        """
+        Account for a requests answer. `size` defaults to the length of
+        its content, and must be given for streamed answers.
+        """
+        request = response.request
+        endpoint = get_endpoint(request.method, request.url, request.body)
+        if size is None:
+            size = len(response.content or b'')
+        headers = response.headers
+        remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+        status = str(response.status_code)
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {'requests': 0, 'bytes': 0, 'seconds': 0.0,
+                                                         'status': {}, 'rate_limit_remaining': None})
+            stats['requests'] += 1
+            stats['bytes'] += size
+            stats['seconds'] += response.elapsed.total_seconds()
+            stats['status'][status] = stats['status'].get(status, 0) + 1
+            if remaining is not None:
+                stats['rate_limit_remaining'] = int(remaining)
+                self.remaining[urllib.parse.urlsplit(request.url).netloc] = int(remaining)
+
+    def get_report(self):
+        """
+        Build the run report, as a dict.
+        """
+        with self.lock:
+            spans = [{'path': path, 'count': count, 'seconds': round(seconds, 4)}
+                     for path, (count, seconds) in sorted(self.spans.items())]
+            endpoints = [{'endpoint': endpoint, **stats, 'seconds': round(stats['seconds'], 4)}
+                         for endpoint, stats in sorted(self.endpoints.items(),
+                                                       key=lambda e: -e[1]['requests'])]
+        return {
+            'script': self.script,
+            'started_at': self.started_at,
+            'seconds': round(time.perf_counter() - self.started, 4),
+            'python': platform.python_version(),
+            'argv': sys.argv[1:],
+            'spans': spans,
+            'api': {
+                'requests': sum(e['requests'] for e in endpoints),
+                'bytes': sum(e['bytes'] for e in endpoints),
+                'rate_limit_remaining': dict(self.remaining),
+                'endpoints': endpoints,
+            },
+            'profile': self.get_file('.prof') if self.profiler else None,
+        }
+
+    def get_file(self, ext):
+        return os.path.join(self.report_dir, self.script + ext)
+
+    def print_summary(self, report):
+        print(f"\n# Run summary of {report['script']}: {report['seconds']:.2f}s.")
+        for span in report['spans']:
+            print(f"  {span['path']:50} {span['count']:6} {span['seconds']:9.2f}s")
+        api = report['api']
+        print(f"  API: {api['requests']} request(s), {api['bytes'] / 1024:.1f} KiB received.")
+        for e in api['endpoints'][:10]:
+            print(f"  {e['endpoint']:70} {e['requests']:6} {e['bytes'] / 1024:9.1f} KiB " +
+                  f"{e['seconds']:7.2f}s  remaining {e['rate_limit_remaining']}")
+
+    def finish(self):
+        """
+        Stop profiling, print a summary and write the run report. Only the
+        first call does anything.
+        """
+        if self.script is None or self.finished:
+            return
+        self.finished = True
+        if self.profiler:
+            self.profiler.disable()
+        report = self.get_report()
+        self.print_summary(report)
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        file = self.get_file('.json')
+        with open(file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(file + '.tmp', file)
+        print(f"# Run report written to {file}.")
+        if self.profiler:
+            self.profiler.dump_stats(report['profile'])
+            print(f"# Profile written to {report['profile']}.")
+
+
+instrument = Instrument()
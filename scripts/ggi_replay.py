@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Replay of the progress label events of a board.
+
+Label events (e.g. "add In Progress" on GitLab, "labeled In Progress" on
+GitHub) are sorted and grouped by (issue, label) once, and turned into
+the intervals during which every issue held every progress label. From
+these intervals are computed:
+
+* the time spent in each status per activity, and per goal,
+* the daily cumulative flow: issues holding each status at the end of
+  every day.
+
+Everything is done with vectorized pandas / numpy operations, there is
+no Python loop over events.
+
+Labels still held are counted up to the last label event of the board,
+not up to the current time, so that outputs only change with the board.
+
+The `issue_id` of label events is the issue number (iid) on both forges,
+so events are matched to activities through the trailing number of the
+issue URL.
+"""
+
+import numpy as np
+import pandas as pd
+
+add_verbs = ['add', 'labeled']
+remove_verbs = ['remove', 'unlabeled']
+
+
+def get_status_intervals(hist: pd.DataFrame, statuses, now=None):
+    """
+    Compute the intervals during which issues held each status label.
+
+    Returns a dataframe with columns issue, label, start, end and open;
+    labels still held are open and end at `now`, by default the time of
+    the last label event of the board.
+    """
+    # A board has only a few distinct actions: split each of them once.
+    codes, actions = pd.factorize(hist['action'].astype(str))
+    parts = pd.Series(actions).str.split(' ', n=1, expand=True).reindex(columns=[0, 1])
+    verbs = parts[0].to_numpy(dtype=object)[codes]
+    labels = parts[1].to_numpy(dtype=object)[codes]
+    events = pd.DataFrame({
+        'issue': pd.to_numeric(hist['issue_id']),
+        'label': labels,
+        'added': np.isin(verbs, add_verbs),
+        'time': pd.to_datetime(hist['time'], utc=True, format='ISO8601'),
+    })
+    if now is None:
+        now = events['time'].max() if len(events) else pd.Timestamp.now(tz='UTC')
+    events = events[np.isin(labels, statuses) & np.isin(verbs, add_verbs + remove_verbs)]
+    events = events.sort_values(['issue', 'label', 'time'], kind='stable')
+
+    # Only keep events changing the state, e.g. drop a second "add".
+    groups = events.groupby(['issue', 'label'], sort=False)
+    previous = groups['added'].shift(1, fill_value=False)
+    events = events[events['added'] != previous]
+
+    # After filtering, every add is followed by the matching remove, if any.
+    end = events.groupby(['issue', 'label'], sort=False)['time'].shift(-1)
+    added = events['added']
+    return pd.DataFrame({
+        'issue': events.loc[added, 'issue'].to_numpy(),
+        'label': events.loc[added, 'label'].to_numpy(),
+        'start': events.loc[added, 'time'].to_numpy(),
+        'end': end[added].fillna(now).to_numpy(),
+        'open': end[added].isna().to_numpy(),
+    }).astype({'start': 'datetime64[ns, UTC]', 'end': 'datetime64[ns, UTC]'})
+
+
+def get_issue_activities(issues: pd.DataFrame, metadata: dict):
+    """
+    Map issue numbers to their activity id and goal.
+    """
+    goals = {a['id']: a['goal'] for a in metadata['activities']}
+    activities = pd.DataFrame({
+        'issue': pd.to_numeric(issues['url'].astype(str).str.extract(r'(\d+)$')[0]),
+        'activity_id': issues['activity_id'],
+    })
+    activities['goal'] = activities['activity_id'].map(goals).fillna('Unknown')
+    return activities.dropna(subset=['issue']).astype({'issue': 'int64'})
+
+
+def time_in_status(intervals: pd.DataFrame, activities: pd.DataFrame):
+    """
+    Total days spent in each status per activity.
+
+    Returns a dataframe with columns activity_id, goal, status and days.
+    """
+    days = (intervals['end'] - intervals['start']).dt.total_seconds() / 86400
+    per_issue = days.groupby([intervals['issue'], intervals['label']]).sum()
+    per_issue = per_issue.rename('days').reset_index().rename(columns={'label': 'status'})
+    merged = per_issue.merge(activities, on='issue', how='inner')
+    merged = merged[['activity_id', 'goal', 'status', 'days']]
+    return merged.sort_values(['activity_id', 'status'], kind='stable').reset_index(drop=True)
+
+
+def time_in_status_by_goal(per_activity: pd.DataFrame, goals, statuses):
+    """
+    Average days spent in each status by the activities of each goal.
+
+    Returns a dict status: list of days, in the order of `goals`.
+    """
+    means = per_activity.pivot_table(index='goal', columns='status', values='days', aggfunc='mean')
+    means = means.reindex(index=goals, columns=statuses).fillna(0).round(1)
+    return {status: means[status].tolist() for status in statuses}
+
+
+def cumulative_flow(intervals: pd.DataFrame, statuses, now=None):
+    """
+    Number of issues holding each status at the end of every day, from
+    the first label event to `now`, by default the last one.
+
+    Returns the list of days and a dict status: list of counts.
+    """
+    if intervals.empty:
+        return [], {status: [] for status in statuses}
+    if now is None:
+        now = intervals['end'].max()
+    first = intervals['start'].min().floor('D')
+    n_days = (now.floor('D') - first).days + 1
+    start_day = ((intervals['start'].dt.floor('D') - first).dt.days).to_numpy()
+    end_day = ((intervals['end'].dt.floor('D') - first).dt.days).to_numpy()
+    ended = ~intervals['open'].to_numpy(dtype=bool)
+
+    flow = {}
+    for status in statuses:
+        held = (intervals['label'] == status).to_numpy()
+        delta = np.bincount(start_day[held], minlength=n_days) - \
+            np.bincount(end_day[held & ended], minlength=n_days)
+        flow[status] = np.cumsum(delta)[:n_days].tolist()
+    days = pd.date_range(first, periods=n_days, freq='D').strftime('%Y-%m-%d').tolist()
+    return days, flow
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Scorecard parser for GGI activity issues.
+
+An issue body is read line by line, once: the activity id, the
+Description section and the Scorecard section (split into subsections
+and tasks) are collected on the way. The result is an immutable
+`Scorecard` tuple, which can safely be shared between issues with the
+same body.
+
+Results are memoized by a hash of the body in a `ScorecardCache`, which
+can be saved in the `.ggi_cache` directory so that unchanged bodies are
+not parsed again on the next run.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+# Identify tasks in description:
+re_tasks = re.compile(r"^\s*- \[(?P<is_completed>.)\] (?P<task>.+)$")
+# Identify the activity id of an issue, also used by ggi_deploy.
+re_activity_id = re.compile(r"^Activity ID: \[(?P<activity_id>GGI-A-\d+)\]", re.MULTILINE)
+# Identify sections for workflow parsing.
+re_section = re.compile(r"^### (?P<section>.*?)\s*$")
+re_subsection = re.compile(r"^#### (?P<subsection>.*?)\s*$")
+
+# Bump when the parsing rules change, to invalidate saved results.
+parser_version = 2
+scorecard_cache_file = '.ggi_cache/scorecards.json'
+# Saved results not used for this long are dropped.
+scorecard_cache_ttl = 30 * 24 * 3600
+
+Task = namedtuple('Task', ['is_completed', 'task'])
+# `workflow` is a tuple of (subsection, lines) pairs, in document order.
+Scorecard = namedtuple('Scorecard', ['activity_id', 'description', 'workflow', 'tasks'])
+
+
+def parse_scorecard(body: str):
+    """
+    Parse an issue body in a single pass and return a Scorecard.
+
+    The result is the same as the historical two-pass parser: lines before
+    the first subsection of the Scorecard are dropped, and so are the last
+    two lines of the last subsection (html stuff) when there are more than
+    two subsections. Raises KeyError if the body has no Description.
+    """
+    activity_id = ''
+    description = None
+    workflow = None
+    tasks = None
+    section = 'Introduction'
+    for line in body.split('\n'):
+        if line.startswith('Activity ID: ['):
+            match = re_activity_id.match(line)
+            if match:
+                activity_id = match.group(1)
+                continue
+        if line.startswith('### '):
+            section = line[4:].rstrip()
+            if section == 'Description':
+                description = []
+            elif section == 'Scorecard':
+                subsection = 'Default'
+                workflow = {subsection: []}
+                tasks = []
+        elif section == 'Description':
+            description.append(line)
+        elif section == 'Scorecard':
+            if line.startswith('#### '):
+                subsection = line[5:].rstrip()
+                workflow[subsection] = []
+            elif line != '':
+                workflow[subsection].append(line)
+                if '- [' in line:
+                    match = re_tasks.match(line)
+                    if match:
+                        tasks.append(Task(match.group('is_completed') == 'x', match.group('task')))
+
+    if description is None:
+        raise KeyError('Description')
+    if workflow is None:
+        workflow = {}
+        tasks = []
+    else:
+        # Remove first element (useless html stuff)
+        del workflow['Default']
+        # Remove last two elements (useless html stuff too)
+        if len(workflow) > 2:
+            last = workflow[next(reversed(workflow))]
+            del last[-1]
+            del last[-1]
+    return Scorecard(activity_id, tuple(description),
+                     tuple((s, tuple(lines)) for s, lines in workflow.items()),
+                     tuple(tasks))
+
+
+class ScorecardCache:
+    """
+    Memoizes parsed scorecards by a hash of the issue body.
+
+    Entries are saved along with the time they were last used, and
+    dropped once unused for `scorecard_cache_ttl` seconds.
+    """
+
+    def __init__(self, path=scorecard_cache_file):
+        self.path = path
+        self.entries = {}
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, body):
+        return hashlib.sha256(body.encode()).hexdigest()
+
+    def parse(self, body: str):
+        """
+        Return the Scorecard of a body, parsing it only if not seen before.
+        """
+        key = self.get_key(body)
+        scorecard = self.entries.get(key)
+        if scorecard is None:
+            scorecard = parse_scorecard(body)
+            self.misses += 1
+        else:
+            self.hits += 1
+        with self.lock:
+            self.entries[key] = scorecard
+            self.seen[key] = time.time()
+        return scorecard
+
+    def load(self):
+        """
+        Read saved scorecards, ignoring them if written by another parser.
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        if stored.get('version') != parser_version:
+            print(f"- Ignoring scorecard cache {self.path} (version {stored.get('version')}).")
+            return
+        for key, (seen, a_id, description, workflow, tasks) in stored['scorecards'].items():
+            self.entries[key] = Scorecard(a_id, tuple(description),
+                                          tuple((s, tuple(lines)) for s, lines in workflow),
+                                          tuple(Task(*t) for t in tasks))
+            self.seen[key] = seen
+        print(f"- Loaded {len(self.entries)} scorecard(s) from {self.path}.")
+
+    def save(self):
+        """
+        Write the scorecards used recently, atomically.
+        """
+        limit = time.time() - scorecard_cache_ttl
+        with self.lock:
+            stored = {key: [self.seen[key], *scorecard]
+                      for key, scorecard in self.entries.items() if self.seen[key] > limit}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': parser_version, 'scorecards': stored}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def report(self):
+        print(f"\n# Scorecards: {self.hits} memoized, {self.misses} parsed.")
+
+
+scorecards = ScorecardCache()
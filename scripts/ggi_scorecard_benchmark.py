@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Micro-benchmark of the scorecard parser.
+
+Synthetic issue bodies are parsed with the historical two-pass parser,
+the single-pass parser, and through the memo. Results of both parsers
+are checked to be identical, then the cost per issue is printed.
+
+usage: ggi_scorecard_benchmark [-h] [-n ISSUES] [-l LINES] [-r ROUNDS]
+"""
+
+import argparse
+import random
+import time
+from collections import OrderedDict
+
+from ggi_scorecard import *
+
+
+def parse_args():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(prog='ggi_scorecard_benchmark')
+    parser.add_argument('-n', '--issues', dest='opt_issues', type=int, default=200,
+                        help='Number of synthetic issues')
+    parser.add_argument('-l', '--lines', dest='opt_lines', type=int, default=2000,
+                        help='Approximate number of lines per issue body')
+    parser.add_argument('-r', '--rounds', dest='opt_rounds', type=int, default=3,
+                        help='Number of rounds, the best one is reported')
+    return parser.parse_args()
+
+
+def legacy_extract_workflow(activity_desc: str):
+    """
+    Historical two-pass parser, kept as a reference.
+    """
+    paragraphs = activity_desc.split('\n')
+    content_t = 'Introduction'
+    content = OrderedDict()
+    content = {content_t: []}
+    a_id = ""
+    for p in paragraphs:
+        activity_id_match = re_activity_id.match(p)
+        if activity_id_match:
+            a_id = activity_id_match.group(1)
+            continue
+        match_section = re.search(re_section, p)
+        if match_section:
+            content_t = match_section.group('section')
+            content[content_t] = []
+        else:
+            content[content_t].append(p)
+    subsection = 'Default'
+    workflow = {subsection: []}
+    tasks = []
+    if 'Scorecard' in content:
+        for p in content['Scorecard']:
+            match_subsection = re.search(re_subsection, p)
+            if match_subsection:
+                subsection = match_subsection.group('subsection')
+                workflow[subsection] = []
+            elif p != '':
+                workflow[subsection].append(p)
+                match_tasks = re.search(re_tasks, p)
+                if match_tasks:
+                    is_completed = match_tasks.group('is_completed')
+                    is_completed = True if is_completed == 'x' else False
+                    task = match_tasks.group('task')
+                    tasks.append({'is_completed': is_completed, 'task': task})
+    del workflow['Default']
+    if len(list(workflow)) > 2:
+        del workflow[list(workflow)[-1]][-1]
+        del workflow[list(workflow)[-1]][-1]
+    return a_id, content['Description'], workflow, tasks
+
+
+def build_body(rnd, lines):
+    """
+    Build a synthetic issue body of about `lines` lines, shaped like the
+    bodies created by ggi_deploy.
+    """
+    subsections = max(3, lines // 200)
+    per_section = max(1, lines // (2 * subsections + 2))
+    body = ['Activity ID: [GGI-A-%02d](https://ospo-alliance.org/ggi/activities/).' % rnd.randint(1, 99),
+            '', '### Description']
+    body += [f"Some description text, line {i}, about **governance**." for i in range(lines // 2)]
+    body += ['', '### Scorecard', '<br/>']
+    for s in range(subsections):
+        body += [f"#### Subsection {s}", '']
+        for t in range(per_section):
+            done = 'x' if rnd.random() < 0.5 else ' '
+            body.append(f"- [{done}] Task {s}.{t} to be done.")
+            body.append(f"  Some explanation for task {s}.{t}.")
+    body += ['', '</details>', '<br/>']
+    return '\n'.join(body)
+
+
+def best_of(rounds, func, bodies):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for body in bodies:
+            func(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """
+    Main sequence.
+    """
+    args = parse_args()
+    rnd = random.Random(42)
+    bodies = [build_body(rnd, args.opt_lines) for _ in range(args.opt_issues)]
+    size = sum(len(b) for b in bodies) / len(bodies)
+    print(f"# {len(bodies)} synthetic issues, {size / 1024:.1f} KiB per body.")
+
+    for body in bodies:
+        scorecard = parse_scorecard(body)
+        workflow = {s: list(lines) for s, lines in scorecard.workflow}
+        tasks = [{'is_completed': t.is_completed, 'task': t.task} for t in scorecard.tasks]
+        if legacy_extract_workflow(body) != (scorecard.activity_id, list(scorecard.description),
+                                             workflow, tasks):
+            print("Single-pass parser differs from the reference parser. Exiting.")
+            exit(1)
+
+    memo = ScorecardCache(path=None)
+    memo_func = memo.parse
+    for body in bodies:
+        memo_func(body)
+
+    for name, func in [('two-pass parser', legacy_extract_workflow),
+                       ('single-pass parser', parse_scorecard),
+                       ('memoized', memo_func)]:
+        elapsed = best_of(args.opt_rounds, func, bodies)
+        print(f"  {name:20} {elapsed * 1e6 / len(bodies):10.1f} us per issue")
+
+
+if __name__ == '__main__':
+    main()
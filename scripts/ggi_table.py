@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Minimal column tables for the issues, tasks and history lines of a board.
+
+A Table offers the small part of the pandas DataFrame API used to write
+the website: columns by name, `shape` and `to_csv`. The same code can
+then handle tables and DataFrames, and the core path never imports
+pandas. Flow metrics and the history store need pandas, and convert
+tables with `as_dataframe`.
+
+CSV output matches DataFrame.to_csv for the values returned by the
+forges: strings, integers, datetimes and None. Integer columns holding
+None are the exception: they are written as integers, where pandas
+converts them to floats. The forges never return such columns.
+"""
+
+import csv
+import io
+
+
+class Column(list):
+    """
+    Values of a table column, with the Series methods used by the website.
+    """
+
+    def tolist(self):
+        return list(self)
+
+    def sum(self):
+        return sum(value for value in self if value is not None)
+
+
+class Table:
+    """
+    Rows of values, with named columns.
+    """
+
+    def __init__(self, rows, columns):
+        self.columns = list(columns)
+        self.rows = [list(row) for row in rows]
+
+    def __getitem__(self, column):
+        idx = self.columns.index(column)
+        return Column(row[idx] for row in self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def shape(self):
+        return len(self.rows), len(self.columns)
+
+    def to_csv(self, columns=None, index=False):
+        """
+        Write the table, or the given columns, as CSV text. Tables have
+        no index, `index` is only accepted for DataFrame compatibility.
+        """
+        columns = columns or self.columns
+        idx = [self.columns.index(column) for column in columns]
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(columns)
+        writer.writerows([row[i] for i in idx] for row in self.rows)
+        return out.getvalue()
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.rows, columns=self.columns)
+
+
+def as_dataframe(table):
+    """
+    Return a table as a pandas DataFrame, converting it if needed.
+    """
+    return table.to_dataframe() if isinstance(table, Table) else table
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# ######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Daily snapshots of the board, used for the trend charts of the dashboard.
+
+Snapshots are stored in a CSV file per board, in the `.ggi_cache`
+directory out of the website template, with one line per day on which
+the board changed: the number of issues per status, per goal and status,
+and the task completion totals.
+
+    .ggi_cache/snapshots/ggi_my-ggi-board.csv
+
+The store is only kept by the CI cache, and cannot be rebuilt from the
+board: a warning is printed if it is lost, see check_store in
+ggi_update_website.
+
+    date,status:Not Selected,...,goal:Usage Goal:Done,...,tasks_done,tasks_total
+    2024-01-01,20,...,1,...,12,150
+
+Adding a snapshot only reads the header and the last line of the file.
+It is skipped if the values did not change, and replaces the last line
+if it is from the same day. Rendering reads the file once. The raw label
+events are never replayed.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+
+from ggi_dashboard import all_roles
+
+# Bytes read at the end of the file to find the last snapshot.
+tail_size = 64 * 1024
+
+snapshots_dir = os.path.join('.ggi_cache', 'snapshots')
+
+
+def get_snapshots_file(project: str):
+    """
+    Compute the snapshot file of a project, e.g. `ggi/my-ggi-board`.
+    """
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', project)
+    return os.path.join(snapshots_dir, f'{slug}.csv')
+
+
+def get_snapshot_columns(dashboard):
+    """
+    Columns of a snapshot, computed from the dashboard cube.
+    """
+    columns = [f'status:{s}' for s in dashboard.statuses]
+    columns += [f'goal:{g}:{s}' for g in dashboard.goals for s in dashboard.statuses]
+    return columns + ['tasks_done', 'tasks_total']
+
+
+def get_snapshot_values(dashboard, tasks_done, tasks_total):
+    """
+    Values of a snapshot, in the order of get_snapshot_columns.
+    """
+    role = dashboard.roles.index(all_roles)
+    per_goal = [per_role[role] for per_role in dashboard.cube]
+    values = [sum(counts[s] for counts in per_goal) for s in range(len(dashboard.statuses))]
+    values += [count for counts in per_goal for count in counts]
+    return values + [int(tasks_done), int(tasks_total)]
+
+
+def format_csv_line(row):
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerow(row)
+    return out.getvalue()
+
+
+def migrate_snapshots(path, header):
+    """
+    Rewrite the snapshot file with a new header, e.g. when goals changed.
+    Columns that did not exist before are set to 0.
+    """
+    with open(path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    with open(path + '.tmp', 'w', newline='') as f:
+        f.write(format_csv_line(header))
+        for row in rows:
+            f.write(format_csv_line([row.get(col) or 0 for col in header]))
+    os.replace(path + '.tmp', path)
+    print(f"- Snapshots {path} migrated to new columns ({len(rows)} day(s)).")
+
+
+def append_snapshot(path, day: str, columns, values):
+    """
+    Add the snapshot of a day, replacing the last one if of the same day.
+    Nothing is written if the values are the same as the last snapshot.
+
+    Returns True if the file changed.
+    """
+    header = ['date'] + columns
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if os.path.isfile(path):
+        with open(path, 'r', newline='') as f:
+            stored_header = next(csv.reader(f), None)
+        if stored_header != header:
+            migrate_snapshots(path, header)
+    else:
+        with open(path, 'w', newline='') as f:
+            f.write(format_csv_line(header))
+
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        start = max(0, size - tail_size)
+        f.seek(start)
+        tail = f.read()
+        last = tail.rstrip(b'\n').rfind(b'\n') + 1
+        line = format_csv_line([day] + values).encode()
+        if tail[last:].split(b',', 1)[-1] == line.split(b',', 1)[-1]:
+            return False
+        if tail[last:].startswith(day.encode() + b','):
+            f.seek(start + last)
+            f.truncate()
+        f.write(line)
+    return True
+
+
+def render_trend(path):
+    """
+    Read all snapshots and return the trend series as a JSON object:
+    dates, issues per status, and task completion totals.
+    """
+    dates = []
+    statuses = {}
+    tasks_done = []
+    tasks_total = []
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            dates.append(row['date'])
+            for col, value in row.items():
+                if col.startswith('status:'):
+                    statuses.setdefault(col[len('status:'):], []).append(int(value))
+            tasks_done.append(int(row['tasks_done']))
+            tasks_total.append(int(row['tasks_total']))
+    return json.dumps({'dates': dates, 'statuses': statuses,
+                       'tasks_done': tasks_done, 'tasks_total': tasks_total})
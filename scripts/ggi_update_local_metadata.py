@@ -12,24 +12,31 @@
 # This script:
 # - downloads the Activities Metadata JSON file from the GGI repository
 # - saves additional file source information
-# - dumps the resulting JSON file in the local filesystem, 
+# - dumps the resulting JSON file in the local filesystem,
 #   so it can be manually committed to the my-gg-board repository.
+# - writes a run report to web/ggi_runs, see ggi_instrument.
 
-# usage: ggi_deploy [-h] [-r]
+# usage: ggi_update_local_metadata [-h] [-r REFERENCE] [-s SHA256] [-i] [--profile]
 #
 # optional arguments:
-#   -h, --help        Show this help message and exit
-#   -r, --refefence   Target branch or tag
+#   -h, --help         Show this help message and exit
+#   -r, --reference    Target branch or tag
+#   -s, --sha256       Expected SHA-256 checksum of the downloaded archive
+#   -i, --incremental  Only download activity files changed since last refresh,
+#                      cannot be used with -s
+#   --profile          Profile the run with cProfile, next to the run report
 #
 
 import argparse
-import copy
 import datetime
+import hashlib
 import json
 import os
-import requests 
+import requests
 import tarfile
-import tempfile
+import urllib.parse
+
+from ggi_instrument import instrument
 
 local_conf_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))+'/conf'
 local_activities_file_path = local_conf_dir + '/ggi_activities_full.json'
@@ -38,73 +45,276 @@ remote_git_url='https://gitlab.ow2.org'
 remote_git_project='ggi/ggi'
 remote_git_reference='main'
 
-tmp_gz_dir = tempfile.TemporaryDirectory()
-tmp_gz_filename=tmp_gz_dir.name+'/ggi_content.tar.bz2'
-tmp_gz_filename='/tmp/ggi_content.tar.bz2'
+# Size of the buffers used to read and decompress the archive stream.
+stream_buffer_size = 1024 * 1024
+
+content_dir = '/handbook/content/'
+metadata_file = 'ggi_activities_metadata.json'
+
+# Content-addressed cache of handbook files, keyed by git blob SHA, and
+# last known tree of every reference, for incremental refreshes.
+handbook_cache_dir = os.path.dirname(local_conf_dir) + '/.ggi_cache/handbook'
+run_report_dir = os.path.dirname(local_conf_dir) + '/web/ggi_runs'
+
+
+def parse_args():
+    """
+    Parse arguments from command line.
+    """
+    parser = argparse.ArgumentParser(prog='ggi_update_local_metadata')
+    parser.add_argument('-r', '--reference',
+        dest='target_git_ref',
+        action='store',
+        default=remote_git_reference,
+        help='Specify target branch or tag')
+    parser.add_argument('-s', '--sha256',
+        dest='expected_sha256',
+        action='store',
+        default=None,
+        help='Expected SHA-256 checksum of the downloaded archive')
+    parser.add_argument('-i', '--incremental',
+        dest='opt_incremental',
+        action='store_true',
+        help='Only download activity files changed since last refresh')
+    parser.add_argument('--profile',
+        dest='opt_profile',
+        action='store_true',
+        help='Profile the run with cProfile, next to the run report')
+    args = parser.parse_args()
+    # Incremental refreshes download individual files, not the archive.
+    if args.opt_incremental and args.expected_sha256:
+        parser.error('-s/--sha256 cannot be used with -i/--incremental')
+    return args
+
+
+class HashingReader:
+    """
+    File-like wrapper computing the SHA-256 checksum and size of the
+    bytes read through it.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        """
+        Read the remaining bytes, so the checksum covers the whole stream.
+        """
+        while self.read(stream_buffer_size):
+            pass
+
+
+def get_contents_url(reference):
+    """
+    Build the download URL of the handbook content archive, e.g.
+    https://gitlab.ow2.org/ggi/ggi/-/archive/main/ggi-main.tar.bz2?path=handbook/content
+    """
+    return remote_git_url + '/' + \
+        remote_git_project + '/-/archive/' + \
+        reference + '/ggi-' + \
+        reference + '.tar.bz2?path=handbook/content'
+
+
+def download_activities(url, expected_sha256=None):
+    """
+    Download the handbook archive and extract activities in a single pass.
+
+    The archive is decompressed straight from the HTTP response, without
+    any temporary file. Only the metadata file and markdown files of the
+    content directory are kept; as the metadata file may come after the
+    activities in the archive, markdown files read before it are kept until
+    we know which ones are referenced.
+
+    Returns the activities metadata, with the content of every activity,
+    and the SHA-256 checksum of the archive.
+    """
+    print(f"\n# Download Activities from remote repository")
+    print(f"# URL: {url}")
+    resp = requests.get(url, stream=True)
+    if (resp.status_code != 200):
+        print("Status code: " + str(resp.status_code))
+        exit(1)
+    resp.raw.decode_content = True
+    reader = HashingReader(resp.raw)
+
+    activities_content = None
+    files = {}
+    with tarfile.open(fileobj=reader, mode='r|bz2', bufsize=stream_buffer_size) as tf:
+        for member in tf:
+            if not member.isfile() or content_dir not in member.name:
+                continue
+            path = member.name.split(content_dir, 1)[1]
+            if path == metadata_file:
+                activities_content = json.load(tf.extractfile(member))
+                referenced = {a['path'] for a in activities_content['activities']}
+                files = {p: c for p, c in files.items() if p in referenced}
+            elif path.endswith('.md') and (activities_content is None or path in referenced):
+                files[path] = tf.extractfile(member).read().decode()
+    reader.drain()
+    resp.close()
+    instrument.record_response(resp, reader.size)
+
+    checksum = reader.sha256.hexdigest()
+    print(f"# Downloaded {reader.size} bytes, SHA-256 {checksum}")
+    if expected_sha256 and checksum != expected_sha256.lower():
+        print(f"Checksum mismatch, expected {expected_sha256}. Exiting.")
+        exit(1)
+    if activities_content is None:
+        print(f"Cannot find {metadata_file} in archive. Exiting.")
+        exit(1)
+
+    print("\n# Build activities")
+    for activity in activities_content['activities']:
+        print(f"  - Building activity [{activity['id']}]..")
+        activity['content'] = files[activity['path']]
+
+    return activities_content, checksum
+
+
+def get_blob_sha(content: bytes):
+    """
+    Compute the git blob SHA of a file content.
+    """
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+def get_remote_tree(reference):
+    """
+    List the files of the handbook content directory for a reference,
+    with their git blob SHA, through the GitLab repository tree API.
+    Files are listed recursively, by path relative to the content
+    directory, as in the archive.
+
+    The tree is saved in the cache, and read from there if the remote
+    repository cannot be reached.
+    """
+    tree_file = f"{handbook_cache_dir}/trees/{urllib.parse.quote(reference, safe='')}.json"
+    api_url = f"{remote_git_url}/api/v4/projects/{urllib.parse.quote(remote_git_project, safe='')}/repository/tree"
+    tree = {}
+    page = '1'
+    try:
+        with requests.Session() as session:
+            while page:
+                resp = session.get(api_url, params={'path': content_dir.strip('/'), 'ref': reference,
+                                                    'recursive': 'true', 'per_page': 100, 'page': page},
+                                   timeout=30)
+                instrument.record_response(resp)
+                resp.raise_for_status()
+                tree.update({f['path'].split(content_dir.lstrip('/'), 1)[1]: f['id']
+                             for f in resp.json() if f['type'] == 'blob'})
+                page = resp.headers.get('X-Next-Page')
+    except requests.exceptions.RequestException as e:
+        if not os.path.isfile(tree_file):
+            print(f"Cannot list remote files ({e}), and no cached tree for {reference}. Exiting.")
+            exit(1)
+        print(f"# Cannot list remote files ({e}), using cached tree {tree_file}.")
+        with open(tree_file, 'r') as f:
+            return json.load(f), True
+
+    os.makedirs(os.path.dirname(tree_file), exist_ok=True)
+    with open(tree_file, 'w') as f:
+        json.dump(tree, f, indent=2)
+    return tree, False
+
+
+def read_blob(sha, offline):
+    """
+    Read a handbook file from the cache by its blob SHA, downloading it
+    first if it is not cached yet.
+    """
+    blob_file = f"{handbook_cache_dir}/blobs/{sha}"
+    if not os.path.isfile(blob_file):
+        if offline:
+            print(f"Blob {sha} is not cached and remote is unreachable. Exiting.")
+            exit(1)
+        api_url = f"{remote_git_url}/api/v4/projects/{urllib.parse.quote(remote_git_project, safe='')}" + \
+                  f"/repository/blobs/{sha}/raw"
+        resp = requests.get(api_url, timeout=30)
+        instrument.record_response(resp)
+        resp.raise_for_status()
+        if get_blob_sha(resp.content) != sha:
+            print(f"Blob {sha} does not match its SHA. Exiting.")
+            exit(1)
+        os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+        with open(blob_file + '.tmp', 'wb') as f:
+            f.write(resp.content)
+        os.replace(blob_file + '.tmp', blob_file)
+    with open(blob_file, 'rb') as f:
+        return f.read().decode()
+
+
+def refresh_activities(reference):
+    """
+    Rebuild activities from the content-addressed cache of handbook files.
+
+    Only files whose blob SHA is not cached yet are downloaded, so that an
+    unchanged reference costs a single tree listing, and works offline.
+
+    Returns the activities metadata, with the content of every activity.
+    """
+    print(f"\n# Refresh Activities from remote repository, reference {reference}")
+    tree, offline = get_remote_tree(reference)
+    if metadata_file not in tree:
+        print(f"Cannot find {metadata_file} in {reference}. Exiting.")
+        exit(1)
+
+    activities_content = json.loads(read_blob(tree[metadata_file], offline))
+    for activity in activities_content['activities']:
+        if activity['path'] not in tree:
+            print(f"Cannot find {activity['path']} of activity [{activity['id']}] in {reference}. Exiting.")
+            exit(1)
+    missing = [a['path'] for a in activities_content['activities']
+               if not os.path.isfile(f"{handbook_cache_dir}/blobs/{tree[a['path']]}")]
+    print(f"# {len(activities_content['activities']) - len(missing)} activity file(s) cached, " +
+          f"{len(missing)} to download.")
+
+    print("\n# Build activities")
+    for activity in activities_content['activities']:
+        print(f"  - Building activity [{activity['id']}]..")
+        activity['content'] = read_blob(tree[activity['path']], offline)
+
+    return activities_content
+
+
+def main():
+    """
+    Main sequence.
+    """
+    args = parse_args()
+    instrument.start('ggi_update_local_metadata', report_dir=run_report_dir, profile=args.opt_profile)
+
+    with instrument.span('fetch'):
+        if args.opt_incremental:
+            activities_content = refresh_activities(args.target_git_ref)
+            checksum = None
+        else:
+            activities_content, checksum = download_activities(
+                get_contents_url(args.target_git_ref), args.expected_sha256)
+
+    # Add activities reference metadata
+    activities_content.update({"source": {}})
+    metadata_source = activities_content.get("source")
+    metadata_source.update({"git-remote" : remote_git_url})
+    metadata_source.update({"git-project" : remote_git_project})
+    metadata_source.update({"git-reference" : args.target_git_ref})
+    metadata_source.update({"download-timestamp" : datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+    if checksum:
+        metadata_source.update({"sha256" : checksum})
+    print(f"# Additional source information:\n" + json.dumps(metadata_source, indent=True) + "\n")
+
+    # Save file locally
+    print(f"# Save file in locally: {local_activities_file_path}")
+    with instrument.span('write'), open(local_activities_file_path, 'w') as out_file:
+        json.dump(activities_content, out_file, indent=2)
 
-#
-# Parse arguments from command line.
-#
 
-parser = argparse.ArgumentParser(prog='ggi_deploy')
-parser.add_argument('-r', '--reference',
-    dest='target_git_ref',
-    action='store',
-    default=remote_git_reference,
-    help='Specify target branch or tag')
-args = parser.parse_args()
-
-# Build download URL
-# https://gitlab.ow2.org/ggi/ggi/-/archive/main/ggi-main.tar.bz2?path=handbook/content
-remote_git_contents_url = \
-    remote_git_url + '/' + \
-    remote_git_project + '/-/archive/' + \
-    args.target_git_ref + '/ggi-' + \
-    args.target_git_ref + '.tar.bz2?path=handbook/content'
-
-print(f"\n# Download Activities from remote repository")
-print(f"# URL: {remote_git_contents_url}")
-resp = requests.get(remote_git_contents_url)
-if (resp.status_code != 200):
-    print("Status code: " + resp.status_code)
-
-# And store content as a gz file in a temporary folder
-with open(tmp_gz_filename, 'wb') as fd:
-    for chunk in resp.iter_content(chunk_size=128):
-        fd.write(chunk)
-
-activities = []
-print("\n# Build activities")
-tf = tarfile.open(tmp_gz_filename, 'r:bz2')
-tf_main_folder=tf.next()
-tmp_gz_dir.cleanup() # Delete temporary folder and file
-
-# Load Metadata file
-activities_content = json.load(tf.extractfile(
-          tf_main_folder.name
-          + '/handbook/content/' 
-          + 'ggi_activities_metadata.json'))
-# Add actual Activities description
-for activity in activities_content['activities']:
-    print(f"  - Building activity [{activity['id']}]..")
-    content = tf.extractfile(
-          tf_main_folder.name
-          + '/handbook/content/' 
-          + activity['path']
-      ).readlines()
-    activity['content'] = "".join( [ i.decode() for i in content ] )
-    activities.append(activity)
-
-# Add activities reference metadata
-activities_content.update({"source": {}})
-metadata_source = activities_content.get("source")
-metadata_source.update({"git-remote" : remote_git_url})
-metadata_source.update({"git-project" : remote_git_project})
-metadata_source.update({"git-reference" : args.target_git_ref})
-metadata_source.update({"download-timestamp" : datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-print(f"# Additional source information:\n" + json.dumps(metadata_source, indent=True) + "\n")
-
-# Save file locally
-print(f"# Save file in locally: {local_activities_file_path}")
-with open(local_activities_file_path, 'w') as out_file:
-    json.dump(activities_content, out_file, indent=2)
+if __name__ == '__main__':
+    main()
@@ -15,30 +15,46 @@ This script:
 - retrieves information from the gitlab project,
 - updates the static website with new information and plots
 
+Issues, tasks and history lines are kept in ggi_table tables, and pandas
+is only imported by flow metrics and the history store, which are skipped
+if it is not installed.
 """
 
 import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
 import re
-from collections import OrderedDict
-from fileinput import FileInput
-from os import listdir
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from typing import List
 
+from ggi_dashboard import *
+from ggi_scorecard import *
+from ggi_table import Table, as_dataframe
+from ggi_trends import append_snapshot, get_snapshot_columns, get_snapshot_values, get_snapshots_file, render_trend
+
 # Define some variables.
 
 file_conf = 'conf/ggi_deployment.json'
 file_meta = 'conf/ggi_activities_metadata.json'
+file_activities = 'conf/ggi_activities_full.json'
 file_json_out = 'ggi_activities_full.json'
 
-# Define regexps
+# Manifest of the generated files of a website, and their hashes.
+manifest_name = '.ggi_manifest.json'
+# Exit status used with --unchanged-status when no generated file changed.
+unchanged_exit_status = 3
 
-# Identify tasks in description:
-re_tasks = re.compile(r"^\s*- \[(?P<is_completed>.)\] (?P<task>.+)$")
-# Identify tasks in description:
-re_activity_id = re.compile(r"^Activity ID: \[(GGI-A-\d\d)\]\(.+\).$")
-# Identify sections for workflow parsing.
-re_section = re.compile(r"^### (?P<section>.*?)\s*$")
-re_subsection = re.compile(r"^#### (?P<subsection>.*?)\s*$")
+# Files written during this run, path: SHA-256 of their content. Fleet
+# boards are written by parallel threads.
+generated_files = {}
+generated_files_lock = threading.Lock()
 
 
 def parse_args():
@@ -52,6 +68,35 @@ def parse_args():
                         dest='opt_verbose',
                         action='store_true',
                         help='More logging.')
+    parser.add_argument('-w', '--workers',
+                        dest='opt_workers',
+                        type=int,
+                        default=8,
+                        help='Number of parallel workers used to fetch issues (default: 8).')
+    parser.add_argument('-g', '--graphql',
+                        dest='opt_graphql',
+                        action='store_true',
+                        help='Fetch issues through the GitHub GraphQL API (GitHub only).')
+    parser.add_argument('-i', '--incremental',
+                        dest='opt_incremental',
+                        action='store_true',
+                        help='Only fetch issues updated since last run, using the board cache.')
+    parser.add_argument('-c', '--http-cache',
+                        dest='opt_http_cache',
+                        action='store_true',
+                        help='Revalidate forge GET requests against a local HTTP cache (ETag).')
+    parser.add_argument('-u', '--unchanged-status',
+                        dest='opt_unchanged_status',
+                        action='store_true',
+                        help=f'Exit with status {unchanged_exit_status} if no generated file changed.')
+    parser.add_argument('-s', '--history-store',
+                        dest='opt_history_store',
+                        action='store_true',
+                        help='Append label events to the history store, and export all stored events.')
+    parser.add_argument('--profile',
+                        dest='opt_profile',
+                        action='store_true',
+                        help='Profile the run with cProfile, next to the run report in web/ggi_runs.')
     args = parser.parse_args()
 
     return args
@@ -60,52 +105,113 @@ def parse_args():
 def extract_workflow(activity_desc: str):
     """
     Extract specific sections from an issue description.
+
+    Parsing is memoized by `scorecards`, see ggi_scorecard.
     """
-    paragraphs = activity_desc.split('\n')
-    content_t = 'Introduction'
-    content = OrderedDict()
-    content = {content_t: []}
-    a_id = ""
-    for p in paragraphs:
-        activity_id_match = re_activity_id.match(p)
-        if activity_id_match:
-            a_id = activity_id_match.group(1)
-            continue
-        match_section = re.search(re_section, p)
-        if match_section:
-            content_t = match_section.group('section')
-            content[content_t] = []
-        else:
-            content[content_t].append(p)
-    subsection = 'Default'
-    workflow = {subsection: []}
-    # Parse the scorecard section.
-    tasks = []
-    if 'Scorecard' in content:
-        for p in content['Scorecard']:
-            match_subsection = re.search(re_subsection, p)
-            if match_subsection:
-                subsection = match_subsection.group('subsection')
-                workflow[subsection] = []
-            elif p != '':
-                workflow[subsection].append(p)
-                # Now identify tasks
-                match_tasks = re.search(re_tasks, p)
-                if match_tasks:
-                    is_completed = match_tasks.group('is_completed')
-                    is_completed = True if is_completed == 'x' else False
-                    task = match_tasks.group('task')
-                    tasks.append({'is_completed': is_completed, 'task': task})
-    # Remove first element (useless html stuff)
-    del workflow['Default']
-    # Remove last two elements (useless html stuff too)
-    if len(list(workflow)) > 2:
-        del workflow[list(workflow)[-1]][-1]
-        del workflow[list(workflow)[-1]][-1]
-    return a_id, content['Description'], workflow, tasks
-
-
-def write_to_csv(issues, tasks, events):
+    scorecard = scorecards.parse(activity_desc)
+    workflow = {subsection: list(lines) for subsection, lines in scorecard.workflow}
+    tasks = [{'is_completed': t.is_completed, 'task': t.task} for t in scorecard.tasks]
+    return scorecard.activity_id, list(scorecard.description), workflow, tasks
+
+
+def write_file_if_changed(path, content: str, current: str = None):
+    """
+    Write a file atomically, unless it already has this exact content,
+    and record its hash for the manifest.
+
+    `current` is the content of the file, if the caller already read it.
+    Returns True if the file was written.
+    """
+    data = content.encode()
+    with generated_files_lock:
+        generated_files[os.path.normpath(path)] = hashlib.sha256(data).hexdigest()
+    if current is not None:
+        if content == current:
+            return False
+    elif os.path.isfile(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def save_manifest(web_dir='web'):
+    """
+    Record the files generated in a website and their hashes in its
+    manifest, and compare them with the previous manifest.
+
+    Returns the list of files added, changed or removed since then.
+    """
+    manifest_file = os.path.join(web_dir, manifest_name)
+    previous = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f)['files']
+    prefix = os.path.normpath(web_dir) + os.sep
+    with generated_files_lock:
+        files = {os.path.relpath(path, web_dir): digest
+                 for path, digest in generated_files.items() if path.startswith(prefix)}
+    changed = sorted(path for path in set(files) | set(previous)
+                     if files.get(path) != previous.get(path))
+
+    with open(manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f, indent=2, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    print(f"\n# Manifest {manifest_file}: {len(files)} generated file(s), {len(changed)} changed.")
+    [print(f"- {path}") for path in changed]
+    return changed
+
+
+def has_pandas():
+    return importlib.util.find_spec('pandas') is not None
+
+
+def to_tables(issues, tasks, hist):
+    """
+    Convert the issues, tasks and hist lists returned by the forges to
+    tables, see ggi_table.
+    """
+    issues_cols = ['issue_id', 'activity_id', 'state', 'title', 'labels',
+                   'updated_at', 'url', 'desc', 'workflow', 'tasks_total', 'tasks_done']
+    issues = Table(issues, issues_cols)
+    tasks_cols = ['issue_id', 'state', 'task']
+    tasks = Table(tasks, tasks_cols)
+    hist_cols = ['time', 'issue_id', 'event_id', 'type', 'author', 'action', 'url']
+    hist = Table(hist, hist_cols)
+    return issues, tasks, hist
+
+
+def check_store(path, web_dir='web'):
+    """
+    Warn if a store of the `.ggi_cache` directory is missing although the
+    website was generated before, e.g. when the CI cache was evicted: the
+    store restarts empty, and past data cannot be rebuilt.
+    """
+    if not os.path.exists(path) and os.path.isfile(os.path.join(web_dir, manifest_name)):
+        print(f"- Warning: {path} is missing although {web_dir} was generated before, " +
+              "it restarts empty. Restore it from the CI cache to keep past data.")
+
+
+def store_history(params, hist, web_dir='web'):
+    """
+    Append label events to the history store of the board, and return all
+    stored events, including the ones of closed issues. See ggi_history.
+    """
+    if not has_pandas():
+        print("- pandas is not installed, the history store is not updated.")
+        return hist
+    from ggi_history import append_history, get_history_dir, read_history
+
+    project = params.get('GGI_GITLAB_PROJECT') or params['GGI_GITHUB_PROJECT']
+    check_store(get_history_dir(project), web_dir)
+    append_history(project, as_dataframe(hist))
+    return read_history(project)
+
+
+def write_to_csv(issues, tasks, events, web_dir='web'):
     """
     Print all issues, tasks and events to CSV files.
 
@@ -113,14 +219,14 @@ def write_to_csv(issues, tasks, events):
     and provided to the user as downloads for further analysis.
     """
     print("\n# Writing issues and history to files.")
-    issues.to_csv('web/content/includes/issues.csv',
-                  columns=['issue_id', 'activity_id', 'state', 'title', 'labels',
-                           'updated_at', 'url', 'tasks_total', 'tasks_done'], index=False)
-    events.to_csv('web/content/includes/labels_hist.csv', index=False)
-    tasks.to_csv('web/content/includes/tasks.csv', index=False)
+    write_file_if_changed(f'{web_dir}/content/includes/issues.csv', issues.to_csv(
+        columns=['issue_id', 'activity_id', 'state', 'title', 'labels',
+                 'updated_at', 'url', 'tasks_total', 'tasks_done'], index=False))
+    write_file_if_changed(f'{web_dir}/content/includes/labels_hist.csv', events.to_csv(index=False))
+    write_file_if_changed(f'{web_dir}/content/includes/tasks.csv', tasks.to_csv(index=False))
 
 
-def write_activities_to_md(issues: List):
+def write_activities_to_md(issues: List, web_dir='web'):
     # Generate list of current activities
     print("\n# Writing issues.")
 
@@ -161,107 +267,177 @@ def write_activities_to_md(issues: List):
             my_workflow += '\n\n'
         my_issue.append(f"{my_workflow}")
 
-        filename = f'web/content/scorecards/activity_{activity_id}.md'
-        with open(filename, 'w') as f:
-            f.write('\n'.join(my_issue))
+        filename = f'{web_dir}/content/scorecards/activity_{activity_id}.md'
+        write_file_if_changed(filename, '\n'.join(my_issue))
 
+    # Remove the scorecards of activities which are not on the board any more.
+    current = {f'activity_{activity_id}.md' for activity_id in issues['activity_id']}
+    for filename in glob.glob(f'{web_dir}/content/scorecards/activity_*.md'):
+        if os.path.basename(filename) not in current:
+            os.remove(filename)
+            print(f"- Removed scorecard {filename}.")
 
-def write_data_points(issues, params):
+
+def read_activities_metadata():
     """
-    Generates data points for the various dashboard plots.
+    Read the activities metadata (goals, roles, activities).
+    """
+    with open(file_activities, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_data_points(issues, params, web_dir='web', snapshots_file=None):
     """
+    Generates data points for the various dashboard plots.
 
-    # Identify activities depending on their progress
-    issues_not_started = issues.loc[issues['labels'].str.contains(params['progress_labels']['not_started']),]
-    issues_in_progress = issues.loc[issues['labels'].str.contains(params['progress_labels']['in_progress']),]
-    issues_done = issues.loc[issues['labels'].str.contains(params['progress_labels']['done']),]
+    All counts are read from the goal x role x status cube, see ggi_dashboard.
+    Snapshots for the trend chart go to `snapshots_file`, by default the
+    one of the board in the cache directory, see ggi_trends.
+    """
+    metadata = params.get('metadata') or read_activities_metadata()
+    dashboard = build_dashboard(issues['labels'].tolist(), metadata, params['progress_labels'])
+    not_started, in_progress, done = count_statuses(dashboard)[:3]
 
     # Generate all activities stats.
-    ggi_data_all_activities = f'[{issues_not_started.shape[0]}, {issues_in_progress.shape[0]}, {issues_done.shape[0]}]'
-    with open('web/content/includes/ggi_data_all_activities.inc', 'w') as f:
-        f.write(ggi_data_all_activities)
-
-    # Generate data points for the dashboard - goals - done
-    done_stats = [
-        int(issues_done['labels'].str.contains('Usage').sum()),
-        int(issues_done['labels'].str.contains('Trust').sum()),
-        int(issues_done['labels'].str.contains('Culture').sum()),
-        int(issues_done['labels'].str.contains('Engagement').sum()),
-        int(issues_done['labels'].str.contains('Strategy').sum())
-    ]
-    with open('web/content/includes/ggi_data_goals_done.inc', 'w') as f:
-        f.write(str(done_stats))
-
-    # Generate data points for the dashboard - goals - in_progress
-    in_progress_stats = [
-        int(issues_in_progress['labels'].str.contains('Usage').sum()),
-        int(issues_in_progress['labels'].str.contains('Trust').sum()),
-        int(issues_in_progress['labels'].str.contains('Culture').sum()),
-        int(issues_in_progress['labels'].str.contains('Engagement').sum()),
-        int(issues_in_progress['labels'].str.contains('Strategy').sum())
-    ]
-    with open('web/content/includes/ggi_data_goals_in_progress.inc', 'w') as f:
-        f.write(str(in_progress_stats))
-
-    # Generate data points for the dashboard - goals - not_started
-    not_started_stats = [
-        int(issues_not_started['labels'].str.contains('Usage').sum()),
-        int(issues_not_started['labels'].str.contains('Trust').sum()),
-        int(issues_not_started['labels'].str.contains('Culture').sum()),
-        int(issues_not_started['labels'].str.contains('Engagement').sum()),
-        int(issues_not_started['labels'].str.contains('Strategy').sum())
-    ]
-    with open('web/content/includes/ggi_data_goals_not_started.inc', 'w') as f:
-        f.write(str(not_started_stats))
+    ggi_data_all_activities = f'[{not_started}, {in_progress}, {done}]'
+    write_file_if_changed(f'{web_dir}/content/includes/ggi_data_all_activities.inc', ggi_data_all_activities)
+
+    # Generate data points for the dashboard - goals per status, in the
+    # order of the goal names.
+    write_file_if_changed(f'{web_dir}/content/includes/ggi_data_goals.inc', json.dumps(dashboard.goals))
+    for status in ['done', 'in_progress', 'not_started']:
+        stats = count_goals(dashboard, params['progress_labels'][status])
+        write_file_if_changed(f'{web_dir}/content/includes/ggi_data_goals_{status}.inc', str(stats))
 
     # Generate activities basic statistics, with links to be used from home page.
     activities_stats = f'Identified {issues.shape[0]} activities overall.\n'
-    activities_stats += f'* {issues_not_started.shape[0]} are <span class="w3-tag w3-light-grey">{params["progress_labels"]["not_started"]}</span>\n'
-    activities_stats += f'* {issues_in_progress.shape[0]} are <span class="w3-tag w3-light-grey">{params["progress_labels"]["in_progress"]}</span>\n'
-    activities_stats += f'* {issues_done.shape[0]} are <span class="w3-tag w3-light-grey">{params["progress_labels"]["done"]}</span>\n'
-    with open('web/content/includes/activities_stats_dashboard.inc', 'w') as f:
-        f.write(activities_stats)
+    activities_stats += f'* {not_started} are <span class="w3-tag w3-light-grey">{params["progress_labels"]["not_started"]}</span>\n'
+    activities_stats += f'* {in_progress} are <span class="w3-tag w3-light-grey">{params["progress_labels"]["in_progress"]}</span>\n'
+    activities_stats += f'* {done} are <span class="w3-tag w3-light-grey">{params["progress_labels"]["done"]}</span>\n'
+    write_file_if_changed(f'{web_dir}/content/includes/activities_stats_dashboard.inc', activities_stats)
 
     # Used for the activities table dataset
-    activities_dataset = []
-    for index, issue in issues.iterrows():
-        activity_id = issue['activity_id']
-        title = issue['title']
-        tasks_done = issue['tasks_done']
-        tasks_total = issue['tasks_total']
-        if params['progress_labels']['not_started'] in issue['labels']:
-            status = params['progress_labels']['not_started']
-        elif params['progress_labels']['in_progress'] in issue['labels']:
-            status = params['progress_labels']['in_progress']
-        elif params['progress_labels']['done'] in issue['labels']:
-            status = params['progress_labels']['done']
-        else:
-            status = 'Unknown'
+    activities_dataset = [list(row) for row in zip(
+        issues['activity_id'].tolist(),
+        [dashboard.statuses[s] for s in dashboard.status],
+        issues['title'].tolist(),
+        issues['tasks_done'].tolist(),
+        issues['tasks_total'].tolist())]
 
-        activities_dataset.append([activity_id, status, title, tasks_done, tasks_total])
-
-    with open('web/content/includes/activities.js.inc', 'w') as f:
-        f.write(str(activities_dataset))
+    write_file_if_changed(f'{web_dir}/content/includes/activities.js.inc', str(activities_dataset))
 
     # Empty (or not) the initialisation banner text in index
     # if at least one activity is started.
-    if issues_not_started.shape[0] < 25:
-        with open('web/content/includes/initialisation.inc', 'w') as f:
-            f.write('')
+    if not_started < 25:
+        write_file_if_changed(f'{web_dir}/content/includes/initialisation.inc', '')
+
+    # Add today's snapshot to the trend store, and render the trend chart
+    # data from it. Stores written in the website by previous versions
+    # are moved to the cache.
+    if snapshots_file is None:
+        snapshots_file = get_snapshots_file(params.get('GGI_GITLAB_PROJECT') or params['GGI_GITHUB_PROJECT'])
+    legacy_file = f'{web_dir}/content/includes/ggi_snapshots.csv'
+    if os.path.isfile(legacy_file):
+        if os.path.isfile(snapshots_file):
+            os.remove(legacy_file)
+        else:
+            os.makedirs(os.path.dirname(snapshots_file), exist_ok=True)
+            shutil.move(legacy_file, snapshots_file)
+            print(f"- Moved trend snapshots {legacy_file} to {snapshots_file}.")
+    check_store(snapshots_file, web_dir)
+    append_snapshot(snapshots_file, str(date.today()), get_snapshot_columns(dashboard),
+                    get_snapshot_values(dashboard, issues['tasks_done'].sum(), issues['tasks_total'].sum()))
+    write_file_if_changed(f'{web_dir}/content/includes/ggi_data_trend.inc', render_trend(snapshots_file))
 
 
-def update_keywords(file_in, keywords):
+def write_flow_metrics(issues, hist, params, web_dir='web'):
+    """
+    Replay progress label events into time-in-status and cumulative flow
+    data points, see ggi_replay.
+    """
+    print("\n# Writing flow metrics.")
+    if not has_pandas():
+        print("- pandas is not installed, skipping flow metrics.")
+        return
+    from ggi_replay import (cumulative_flow, get_issue_activities, get_status_intervals, time_in_status,
+                            time_in_status_by_goal)
+
+    metadata = params.get('metadata') or read_activities_metadata()
+    statuses = [params['progress_labels']['not_started'], params['progress_labels']['in_progress'],
+                params['progress_labels']['done']]
+    intervals = get_status_intervals(as_dataframe(hist), statuses)
+
+    per_activity = time_in_status(intervals, get_issue_activities(as_dataframe(issues), metadata))
+    write_file_if_changed(f'{web_dir}/content/includes/time_in_status.csv',
+                          per_activity.round({'days': 2}).to_csv(index=False))
+    goals = [goal['name'] for goal in metadata['goals']]
+    by_goal = time_in_status_by_goal(per_activity, goals, statuses)
+    write_file_if_changed(f'{web_dir}/content/includes/ggi_data_time_in_status.inc',
+                          json.dumps({'goals': goals, 'statuses': by_goal}))
+
+    days, flow = cumulative_flow(intervals, statuses)
+    write_file_if_changed(f'{web_dir}/content/includes/ggi_data_flow.inc',
+                          json.dumps({'dates': days, 'statuses': flow}))
+    print(f"- Replayed {len(intervals)} status interval(s) over {len(days)} day(s).")
+
+
+def compile_keywords(keywords):
+    """
+    Compile all keywords into a single matcher, longest first so that a
+    keyword never shadows a longer one sharing its prefix.
+    """
+    return re.compile('|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
+
+def update_keywords(file_in, keywords, matcher=None):
     """
     Reads a file, and replace every occurrence of one keyword with
-    its replacement string.
+    its replacement string, in a single pass.
+
+    Returns the number of replacements of each keyword.
+    """
+    matcher = matcher or compile_keywords(keywords)
+    counts = Counter()
+
+    def replace(match):
+        counts[match.group(0)] += 1
+        return keywords[match.group(0)]
+
+    with open(file_in, 'r') as f:
+        content = f.read()
+    write_file_if_changed(file_in, matcher.sub(replace, content), current=content)
+    return counts
+
+
+def update_website_keywords(params, web_dir='web', workers=8):
+    """
+    Replace URLs and date keywords in the static website files.
+
+    Files are processed in parallel, and replacements reported per file.
     """
-    occurrences = []
-    print(f"\n# Replacing keywords in file {file_in}.")
-    for keyword in keywords:
-        for line in FileInput(file_in, inplace=1, backup='.bak'):
-            if keyword in line:
-                occurrences.append(f'- Changing "{keyword}" to "{keywords[keyword]}" in {file_in}.')
-                line = line.replace(keyword, keywords[keyword])
-            print(line, end='')
-    [print(o) for o in occurrences]
-    print(f'Replacement done for {file_in}.')
+    print("\n# Replacing keywords in static website.")
+
+    # List of strings to be replaced.
+    print("\n# List of keywords and values:")
+    keywords = {
+        '[GGI_URL]': params['GGI_URL'],
+        '[GGI_PAGES_URL]': params['GGI_PAGES_URL'],
+        '[GGI_ACTIVITIES_URL]': params['GGI_ACTIVITIES_URL'],
+        '[GGI_CURRENT_DATE]': str(date.today())
+    }
+    # Print the list of keywords to be replaced in files.
+    [print(f"- {k} {keywords[k]}") for k in keywords.keys()]
+
+    files = [f'{web_dir}/config.toml',
+             f'{web_dir}/content/includes/initialisation.inc',
+             f'{web_dir}/content/scorecards/_index.md']
+    # files.append('README.md')
+    files += [file for file in sorted(glob.glob(f"{web_dir}/content/*.md")) if os.path.isfile(file)]
+
+    print("\n# Replacing keywords in files.")
+    matcher = compile_keywords(keywords)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda file: update_keywords(file, keywords, matcher), files))
+    for file, counts in zip(files, results):
+        replaced = ', '.join(f'"{k}" x{n}' for k, n in counts.items())
+        print(f"- {file}: {sum(counts.values())} replacement(s)" + (f" ({replaced})" if counts else ''))
@@ -16,12 +16,13 @@ import glob
 import json
 import os
 import urllib.parse
-from datetime import date
-
-import pandas as pd
-import tldextract
-from github import Auth, Github
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 
+from ggi_board_cache import *
+from ggi_http import ForgeSession, HttpCache, get_github_throttle, install_github_session, report_throttles
+from ggi_graphql import GraphQLClient, get_graphql_url
+from ggi_instrument import instrument
 from ggi_update_website import *
 
 
@@ -58,6 +59,13 @@ def retrieve_env():
         print("- Cannot find env var GGI_GITHUB_TOKEN. Please set it and re-run me.")
         exit(1)
 
+    return set_board_urls(params)
+
+
+def set_board_urls(params: dict):
+    """
+    Compute the URLs of the board from the GitHub project and host.
+    """
     if 'github_host' in params and params['github_host'] != 'null':
         print(f"- Using GitHub on-premises host {params['github_host']} " +
               "from configuration file.")
@@ -74,82 +82,241 @@ def retrieve_env():
             re.sub('^.*/', '', params['GGI_GITHUB_PROJECT']))
         print("- Using public GitHub instance.")
 
+    params['GGI_URL'] = params['GGI_GITHUB_URL']
     params['GGI_ACTIVITIES_URL']= urllib.parse.urljoin(params['GGI_GITHUB_URL'] + '/', 'issues')
 
     return params
 
+def harvest_github_issue(i):
+    """
+    Parse a single GitHub issue and retrieve its label events.
+
+    Returns the issue line, its tasks and its history lines, so the
+    caller can gather results from several workers in a stable order.
+    """
+    issue_tasks = []
+    issue_hist = []
+
+    desc = i.body
+    with instrument.span('parse'):
+        a_id, description, workflow, a_tasks = extract_workflow(desc)
+    for t in a_tasks:
+        issue_tasks.append([a_id,
+                            'completed' if t['is_completed'] else 'open',
+                            t['task']])
+    short_desc = '\n'.join(description)
+    tasks_total = len(a_tasks)
+    tasks_done = len([t for t in a_tasks if t['is_completed']])
+    #TODO comprendre pourquoi i.state et pas le label de progression
+    #TODO comprendre pourquoi tasks_total et done sont mal calculés pour GitHub
+    issue = [i.id, a_id, i.state, i.title, ','.join([label.name for label in i.labels]),
+             i.updated_at, i.url, short_desc, workflow,
+             tasks_total, tasks_done]
+
+    for event in i.get_events():
+        if event.event == "labeled" or event.event == "unlabeled":
+            n_type = 'label'
+            label = event.label.name if event.label else ''
+            n_action = f"{event.event} {label}"
+            user = event.actor.login if event.actor else 'unknown'
+            line = [
+                event.created_at,  # Date de l'événement
+                i.number,  # Numéro de l'issue
+                event.id,  # ID de l'événement
+                n_type,  # Type d'événement (toujours 'label')
+                user,  # Utilisateur qui a déclenché l'événement
+                n_action,  # Action effectuée (labeled/unlabeled)
+                i.html_url  # URL de l'issue
+            ]
+            issue_hist.append(line)
+
+    return issue, issue_tasks, issue_hist
+
+
 def retrieve_github_issues(params: dict):
+    """
+    Retrieve issues from GitHub instance.
+
+    Issue pages are walked in the main thread while each issue is handed
+    over to a bounded pool of `params['fetch_workers']` workers, which
+    parse its description and fetch its events in parallel. Results are
+    collected in submission order, so lists are identical to a serial run.
+
+    If `params['incremental']` is set, only issues updated since the last
+    sync are fetched and merged into the board cache, from which the
+    lists are then rebuilt.
+    """
+    from github import Auth, Github
+
+    workers = params.get('fetch_workers', 1)
+
     print(f"\n# Retrieving project from GitHub at {params['GGI_GITHUB_URL']}.")
     # Using an access token
     auth = Auth.Token(params['GGI_GITHUB_TOKEN'])
+    api_url = params['GGI_API_URL'] or 'https://api.github.com'
+    install_github_session(ForgeSession(cache=params.get('http_cache'), pool_size=workers,
+                                        throttle=get_github_throttle(api_url)), api_url)
+    # Pacing and rate-limit retries are done by the shared throttle,
+    # and connections are shared by all workers.
     if params['GGI_API_URL'] == None :
-        g = Github(auth=auth)
+        g = Github(auth=auth, pool_size=workers, retry=0, seconds_between_requests=None)
     else:
-        g = Github(auth=auth, base_url=params['GGI_API_URL'])
+        g = Github(auth=auth, base_url=params['GGI_API_URL'], retry=0,
+                   pool_size=workers, seconds_between_requests=None)
     repo = g.get_repo(params["GGI_GITHUB_PROJECT"])
 
-    """
-    Retrieve issues from GitHub instance.
-    """
+    # In incremental mode, only ask for issues updated since the last sync,
+    # including the ones closed meanwhile so they can be dropped.
+    cache = None
+    if params.get('incremental'):
+        cache = load_board_cache(params['GGI_GITHUB_PROJECT'])
+    sync_time = get_sync_time()
 
     # Define columns for recorded dataframes.
     issues = []
     tasks = []
     hist = []
+    removed = []
 
-    print("# Fetching issues..")
-    repo_issues = repo.get_issues()
+    print(f"# Fetching issues with {workers} worker(s)..")
+    if cache and cache['last_sync']:
+        repo_issues = repo.get_issues(state='all', since=datetime.fromisoformat(cache['last_sync']))
+    else:
+        repo_issues = repo.get_issues()
 
     print(f"  Found {repo_issues.totalCount} issues.")
 
-    for i in repo_issues:
-        desc = i.body
-        paragraphs = desc.split('\n\n')
-        lines = desc.split('\n')
-        a_id, description, workflow, a_tasks = extract_workflow(desc)
-        for t in a_tasks:
-            tasks.append([a_id,
-                          'completed' if t['is_completed'] else 'open',
-                          t['task']])
-        short_desc = '\n'.join(description)
-        tasks_total = len(a_tasks)
-        tasks_done = len([t for t in a_tasks if t['is_completed']])
-        #TODO comprendre pourquoi i.state et pas le label de progression
-        #TODO comprendre pourquoi tasks_total et done sont mal calculés pour GitHub
-        issues.append([i.id, a_id, i.state, i.title, ','.join([label.name for label in i.labels]),
-                       i.updated_at, i.url, short_desc, workflow,
-                       tasks_total, tasks_done])
-
-        # Retrieve information about labels.
-        # for n in i.resourcelabelevents.list():
-        #     event = i.resourcelabelevents.get(n.id)
-        #     n_type = 'label'
-        #     label = n.label['name'] if n.label else ''
-        #     n_action = f"{n.action} {label}"
-        #     user = n.user['username'] if n.user else 'unknown'
-        #     line = [n.created_at, i.iid,
-        #             n.id, n_type, user,
-        #             n_action, i.web_url]
-        #     hist.append(line)
-
-        for event in i.get_events():
-            if event.event == "labeled" or event.event == "unlabeled":
-                n_type = 'label'
-                label = event.label.name if event.label else ''
-                n_action = f"{event.event} {label}"
-                user = event.actor.login if event.actor else 'unknown'
-                line = [
-                    event.created_at,  # Date de l'événement
-                    i.number,  # Numéro de l'issue
-                    event.id,  # ID de l'événement
-                    n_type,  # Type d'événement (toujours 'label')
-                    user,  # Utilisateur qui a déclenché l'événement
-                    n_action,  # Action effectuée (labeled/unlabeled)
-                    i.html_url  # URL de l'issue
-                ]
-                hist.append(line)
-
-        #print(f"- {i.id} - {a_id} - {i.title} - {i.url} - {i.updated_at}.")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for i in repo_issues:
+            if i.state == 'open':
+                futures.append(executor.submit(instrument.bind(harvest_github_issue), i))
+            else:
+                removed.append(i.id)
+        harvested = [future.result() for future in futures]
+
+    g.close()
+
+    if cache is not None:
+        merge_board_cache(cache, harvested, removed, sync_time)
+        save_board_cache(cache)
+        return flatten_board_cache(cache)
+
+    for issue, issue_tasks, issue_hist in harvested:
+        issues.append(issue)
+        tasks.extend(issue_tasks)
+        hist.extend(issue_hist)
+
+    return issues, tasks, hist
+
+
+# Only fields consumed by extract_workflow and write_data_points are requested.
+graphql_timeline_fields = """
+            pageInfo { hasNextPage endCursor }
+            nodes {
+              __typename
+              ... on LabeledEvent { id createdAt actor { login } label { name } }
+              ... on UnlabeledEvent { id createdAt actor { login } label { name } }
+            }
+"""
+
+# Issues are listed newest first, as with the REST API and the board cache.
+graphql_issues_query = """
+    query GgiIssues($owner: String!, $name: String!, $cursor: String) {
+      rateLimit { cost remaining }
+      repository(owner: $owner, name: $name) {
+        issues(first: 100, after: $cursor, states: OPEN, orderBy: {field: CREATED_AT, direction: DESC}) {
+          pageInfo { hasNextPage endCursor }
+          nodes {
+            databaseId number title body state updatedAt url
+            labels(first: 100) { nodes { name } }
+            timelineItems(first: 100, itemTypes: [LABELED_EVENT, UNLABELED_EVENT]) {
+""" + graphql_timeline_fields + """
+            }
+          }
+        }
+      }
+    }
+"""
+
+graphql_timeline_query = """
+    query GgiIssueTimeline($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+      rateLimit { cost remaining }
+      repository(owner: $owner, name: $name) {
+        issue(number: $number) {
+          timelineItems(first: 100, after: $cursor, itemTypes: [LABELED_EVENT, UNLABELED_EVENT]) {
+""" + graphql_timeline_fields + """
+          }
+        }
+      }
+    }
+"""
+
+
+def retrieve_github_issues_graphql(params: dict):
+    """
+    Retrieve issues from GitHub instance through the GraphQL API.
+
+    Issues, labels and labeled/unlabeled timeline items are fetched 100
+    nodes at a time; only issues with more than 100 label events need
+    extra requests. Lines have the same layout as retrieve_github_issues,
+    except for event ids which are GraphQL node ids.
+    """
+    print(f"\n# Retrieving project from GitHub GraphQL at {params['GGI_GITHUB_URL']}.")
+    client = GraphQLClient(get_graphql_url(params['GGI_API_URL']), params['GGI_GITHUB_TOKEN'])
+    owner, name = params['GGI_GITHUB_PROJECT'].split('/')
+    api_url = params['GGI_API_URL'] or 'https://api.github.com'
+
+    # Define columns for recorded dataframes.
+    issues = []
+    tasks = []
+    hist = []
+
+    print("# Fetching issues..")
+    cursor = None
+    while True:
+        data = client.query(graphql_issues_query,
+                            {'owner': owner, 'name': name, 'cursor': cursor})
+        page = data['repository']['issues']
+        for node in page['nodes']:
+            with instrument.span('parse'):
+                a_id, description, workflow, a_tasks = extract_workflow(node['body'])
+            for t in a_tasks:
+                tasks.append([a_id,
+                              'completed' if t['is_completed'] else 'open',
+                              t['task']])
+            tasks_total = len(a_tasks)
+            tasks_done = len([t for t in a_tasks if t['is_completed']])
+            issues.append([node['databaseId'], a_id, node['state'].lower(), node['title'],
+                           ','.join([label['name'] for label in node['labels']['nodes']]),
+                           datetime.fromisoformat(node['updatedAt'].replace('Z', '+00:00')),
+                           f"{api_url}/repos/{owner}/{name}/issues/{node['number']}",
+                           '\n'.join(description), workflow,
+                           tasks_total, tasks_done])
+
+            timeline = node['timelineItems']
+            while True:
+                for event in timeline['nodes']:
+                    label = event['label']['name'] if event['label'] else ''
+                    action = 'labeled' if event['__typename'] == 'LabeledEvent' else 'unlabeled'
+                    user = event['actor']['login'] if event['actor'] else 'unknown'
+                    hist.append([datetime.fromisoformat(event['createdAt'].replace('Z', '+00:00')),
+                                 node['number'], event['id'], 'label', user,
+                                 f"{action} {label}", node['url']])
+                if not timeline['pageInfo']['hasNextPage']:
+                    break
+                data = client.query(graphql_timeline_query,
+                                    {'owner': owner, 'name': name, 'number': node['number'],
+                                     'cursor': timeline['pageInfo']['endCursor']})
+                timeline = data['repository']['issue']['timelineItems']
+
+        if not page['pageInfo']['hasNextPage']:
+            break
+        cursor = page['pageInfo']['endCursor']
+
+    print(f"  Found {len(issues)} issues.")
+    client.report()
+    client.close()
 
     return issues, tasks, hist
 
@@ -160,50 +327,44 @@ def main():
     """
 
     args = parse_args()
-
-    params = retrieve_env()
-    print(params)
-
-    issues, tasks, hist = retrieve_github_issues(params)
-
-    # Convert lists to dataframes
-    issues_cols = ['issue_id', 'activity_id', 'state', 'title', 'labels',
-                   'updated_at', 'url', 'desc', 'workflow', 'tasks_total', 'tasks_done']
-    issues = pd.DataFrame(issues, columns=issues_cols)
-    tasks_cols = ['issue_id', 'state', 'task']
-    tasks = pd.DataFrame(tasks, columns=tasks_cols)
-    hist_cols = ['time', 'issue_id', 'event_id', 'type', 'author', 'action', 'url']
-    hist = pd.DataFrame(hist, columns=hist_cols)
-
-    write_to_csv(issues, tasks, hist)
-    write_activities_to_md(issues)
-    write_data_points(issues, params)
-
-    #
-    # Replace URLs, date
-    #
-    print("\n# Replacing keywords in static website.")
-
-    # List of strings to be replaced.
-    print("\n# List of keywords and values:")
-    keywords = {
-        '[GGI_URL]': params['GGI_GITHUB_URL'],
-        '[GGI_PAGES_URL]': params['GGI_PAGES_URL'],
-        '[GGI_ACTIVITIES_URL]': params['GGI_ACTIVITIES_URL'],
-        '[GGI_CURRENT_DATE]': str(date.today())
-    }
-    # Print the list of keywords to be replaced in files.
-    [print(f"- {k} {keywords[k]}") for k in keywords.keys()]
-
-    print("\n# Replacing keywords in files.")
-    update_keywords('web/config.toml', keywords)
-    update_keywords('web/content/includes/initialisation.inc', keywords)
-    update_keywords('web/content/scorecards/_index.md', keywords)
-    # update_keywords('README.md', keywords)
-    files = glob.glob("web/content/*.md")
-    for file in files:
-        if os.path.isfile(file):
-            update_keywords(file, keywords)
+    instrument.start('ggi_update_website_github', profile=args.opt_profile)
+
+    with instrument.span('env'):
+        params = retrieve_env()
+        params['fetch_workers'] = max(1, args.opt_workers)
+        params['incremental'] = args.opt_incremental
+        print(params)
+        params['http_cache'] = HttpCache() if args.opt_http_cache else None
+
+        scorecards.load()
+    with instrument.span('fetch'):
+        if args.opt_graphql:
+            if args.opt_incremental:
+                print("- Incremental mode is not available with GraphQL, doing a full sync.")
+            issues, tasks, hist = retrieve_github_issues_graphql(params)
+        else:
+            issues, tasks, hist = retrieve_github_issues(params)
+
+    with instrument.span('aggregate'):
+        issues, tasks, hist = to_tables(issues, tasks, hist)
+        if args.opt_history_store:
+            hist = store_history(params, hist)
+
+    if params['http_cache']:
+        params['http_cache'].report()
+    report_throttles()
+    scorecards.save()
+    scorecards.report()
+
+    with instrument.span('write'):
+        write_to_csv(issues, tasks, hist)
+        write_activities_to_md(issues)
+        write_data_points(issues, params)
+        write_flow_metrics(issues, hist, params)
+
+    with instrument.span('keywords'):
+        update_website_keywords(params)
+    changed = save_manifest()
     try:
         with open('web/content/_index.md', 'r') as file:
             file_content = file.read()
@@ -214,6 +375,10 @@ def main():
         print('an error occurred')
     print("Done.")
 
+    if args.opt_unchanged_status and not changed:
+        print("No content change.")
+        exit(unchanged_exit_status)
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
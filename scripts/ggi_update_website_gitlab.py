@@ -16,12 +16,12 @@ import glob
 import json
 import os
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
-import gitlab
-import pandas as pd
-import tldextract
-
+from ggi_board_cache import *
+from ggi_http import ForgeSession, HttpCache, get_host_throttle, report_throttles
+from ggi_instrument import instrument
 from ggi_update_website import *
 
 
@@ -64,64 +64,148 @@ def retrieve_env():
         params['GGI_PAGES_URL'] = os.environ['CI_PAGES_URL']
     else:
         print("- Cannot find an env var for GGI_PAGES_URL. Computing it from conf.")
-        pieces = tldextract.extract(params['GGI_GITLAB_URL'])
+
+    return set_board_urls(params)
+
+
+def set_board_urls(params: dict):
+    """
+    Compute the URLs of the board from the GitLab URL and project.
+
+    The Pages URL is only computed if not already set.
+    """
+    if not params.get('GGI_PAGES_URL'):
         params['GGI_PAGES_URL'] = 'https://' + params['GGI_GITLAB_PROJECT'].split('/')[0] + \
-                                  "." + pieces.domain + ".io/" + params['GGI_GITLAB_PROJECT'].split('/')[-1]
+                                  "." + get_domain(params['GGI_GITLAB_URL']) + ".io/" + \
+                                  params['GGI_GITLAB_PROJECT'].split('/')[-1]
 
     params['GGI_URL'] = urllib.parse.urljoin(params['GGI_GITLAB_URL'], params['GGI_GITLAB_PROJECT'])
     params['GGI_ACTIVITIES_URL'] = os.path.join(params['GGI_URL'] + '/', '-/boards')
 
     return params
 
+
+# Domain extractor, built on first use.
+domain_extractor = None
+
+
+def get_domain(url):
+    """
+    Get the registered domain of a URL without its suffix, e.g. `ow2` for
+    https://gitlab.ow2.org.
+
+    Only the public suffix list bundled with tldextract is used, it is
+    never downloaded.
+    """
+    global domain_extractor
+    if domain_extractor is None:
+        import tldextract
+        domain_extractor = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+    return domain_extractor(url).domain
+
+def harvest_gitlab_issue(i):
+    """
+    Parse a single GitLab issue and retrieve all its label events.
+
+    Label events are paged through at 100 per request; the listed events
+    already carry all the fields we need, so they are never re-fetched
+    one by one.
+    """
+    issue_tasks = []
+    issue_hist = []
+
+    desc = i.description
+    with instrument.span('parse'):
+        a_id, description, workflow, a_tasks = extract_workflow(desc)
+    for t in a_tasks:
+        issue_tasks.append([a_id,
+                            'completed' if t['is_completed'] else 'open',
+                            t['task']])
+    short_desc = '\n'.join(description)
+    tasks_total = len(a_tasks)
+    tasks_done = len([t for t in a_tasks if t['is_completed']])
+    issue = [i.iid, a_id, i.state, i.title, ','.join(i.labels),
+             i.updated_at, i.web_url, short_desc, workflow,
+             tasks_total, tasks_done]
+
+    # Retrieve information about labels.
+    for n in i.resourcelabelevents.list(all=True, per_page=100):
+        n_type = 'label'
+        label = n.label['name'] if n.label else ''
+        n_action = f"{n.action} {label}"
+        user = n.user['username'] if n.user else 'unknown'
+        line = [n.created_at, i.iid,
+                n.id, n_type, user,
+                n_action, i.web_url]
+        issue_hist.append(line)
+
+    print(f"- {i.iid} - {a_id} - {i.title} - {i.web_url} - {i.updated_at}.")
+
+    return issue, issue_tasks, issue_hist
+
+
 def retrieve_gitlab_issues(params: dict):
     """
     Retrieve issues from GitLab instance.
+
+    Issues are handed over to a bounded pool of `params['fetch_workers']`
+    workers sharing one pooled (and optionally caching) HTTP session, and
+    results are collected in submission order so lists are identical to a
+    serial run.
+
+    If `params['incremental']` is set, only issues updated since the last
+    sync are fetched and merged into the board cache, from which the
+    lists are then rebuilt.
     """
+    import gitlab
+
+    workers = params.get('fetch_workers', 1)
+
     print(f"\n# Connection to GitLab at {params['GGI_GITLAB_URL']} " +
           f"- {params['GGI_GITLAB_PROJECT']}.")
+    session = ForgeSession(cache=params.get('http_cache'), pool_size=workers,
+                           throttle=get_host_throttle(params['GGI_GITLAB_URL']))
     gl = gitlab.Gitlab(url=params['GGI_GITLAB_URL'],
-                       per_page=50,
-                       private_token=params['GGI_GITLAB_TOKEN'])
+                       per_page=100,
+                       private_token=params['GGI_GITLAB_TOKEN'],
+                       session=session)
     project = gl.projects.get(params['GGI_GITLAB_PROJECT'])
 
-    print("# Fetching issues..")
-    gl_issues = project.issues.list(state='opened', all=True)
+    # In incremental mode, only ask for issues updated since the last sync,
+    # including the ones closed meanwhile so they can be dropped.
+    cache = None
+    if params.get('incremental'):
+        cache = load_board_cache(params['GGI_GITLAB_PROJECT'])
+    sync_time = get_sync_time()
+
+    print(f"# Fetching issues with {workers} worker(s)..")
+    if cache and cache['last_sync']:
+        gl_issues = project.issues.list(updated_after=cache['last_sync'], all=True)
+    else:
+        gl_issues = project.issues.list(state='opened', all=True)
     print(f"  Found {len(gl_issues)} issues.")
 
     # Define columns for recorded dataframes.
     issues = []
     tasks = []
     hist = []
+    removed = [i.iid for i in gl_issues if i.state != 'opened']
 
-    for i in gl_issues:
-        desc = i.description
-        paragraphs = desc.split('\n\n')
-        lines = desc.split('\n')
-        a_id, description, workflow, a_tasks = extract_workflow(desc)
-        for t in a_tasks:
-            tasks.append([a_id,
-                          'completed' if t['is_completed'] else 'open',
-                          t['task']])
-        short_desc = '\n'.join(description)
-        tasks_total = len(a_tasks)
-        tasks_done = len([t for t in a_tasks if t['is_completed']])
-        issues.append([i.iid, a_id, i.state, i.title, ','.join(i.labels),
-                       i.updated_at, i.web_url, short_desc, workflow,
-                       tasks_total, tasks_done])
-
-        # Retrieve information about labels.
-        for n in i.resourcelabelevents.list():
-            event = i.resourcelabelevents.get(n.id)
-            n_type = 'label'
-            label = n.label['name'] if n.label else ''
-            n_action = f"{n.action} {label}"
-            user = n.user['username'] if n.user else 'unknown'
-            line = [n.created_at, i.iid,
-                    n.id, n_type, user,
-                    n_action, i.web_url]
-            hist.append(line)
-
-        print(f"- {i.iid} - {a_id} - {i.title} - {i.web_url} - {i.updated_at}.")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        harvested = list(executor.map(instrument.bind(harvest_gitlab_issue),
+                                      [i for i in gl_issues if i.state == 'opened']))
+
+    session.close()
+
+    if cache is not None:
+        merge_board_cache(cache, harvested, removed, sync_time)
+        save_board_cache(cache)
+        return flatten_board_cache(cache)
+
+    for issue, issue_tasks, issue_hist in harvested:
+        issues.append(issue)
+        tasks.extend(issue_tasks)
+        hist.extend(issue_hist)
 
     return issues, tasks, hist
 
@@ -132,57 +216,50 @@ def main():
     """
 
     args = parse_args()
-
-    params = retrieve_env()
-    #print(params)
-
-    issues, tasks, hist = retrieve_gitlab_issues(params)
-    
-    # Convert lists to dataframes
-    issues_cols = ['issue_id', 'activity_id', 'state', 'title', 'labels',
-                   'updated_at', 'url', 'desc', 'workflow', 'tasks_total', 'tasks_done']
-    issues = pd.DataFrame(issues, columns=issues_cols)
-    tasks_cols = ['issue_id', 'state', 'task']
-    tasks = pd.DataFrame(tasks, columns=tasks_cols)
-    hist_cols = ['time', 'issue_id', 'event_id', 'type', 'author', 'action', 'url']
-    hist = pd.DataFrame(hist, columns=hist_cols)
+    instrument.start('ggi_update_website_gitlab', profile=args.opt_profile)
+
+    with instrument.span('env'):
+        params = retrieve_env()
+        params['fetch_workers'] = max(1, args.opt_workers)
+        params['incremental'] = args.opt_incremental
+        params['http_cache'] = HttpCache() if args.opt_http_cache else None
+        #print(params)
+
+        scorecards.load()
+    with instrument.span('fetch'):
+        issues, tasks, hist = retrieve_gitlab_issues(params)
+
+    with instrument.span('aggregate'):
+        issues, tasks, hist = to_tables(issues, tasks, hist)
+        if args.opt_history_store:
+            hist = store_history(params, hist)
+
+    if params['http_cache']:
+        params['http_cache'].report()
+    report_throttles()
+    scorecards.save()
+    scorecards.report()
 
     #print(f"Issues {issues}")
     #print(f"Tasks {tasks}")
     #print(f"Hist {hist}")
 
-    write_to_csv(issues, tasks, hist)
-    write_activities_to_md(issues)
-    write_data_points(issues, params)
-
-    #
-    # Replace URLs, date
-    #
-    print("\n# Replacing keywords in static website.")
-
-    # List of strings to be replaced.
-    print("\n# List of keywords and values:")
-    keywords = {
-        '[GGI_URL]': params['GGI_URL'],
-        '[GGI_PAGES_URL]': params['GGI_PAGES_URL'],
-        '[GGI_ACTIVITIES_URL]': params['GGI_ACTIVITIES_URL'],
-        '[GGI_CURRENT_DATE]': str(date.today())
-    }
-    # Print the list of keywords to be replaced in files.
-    [print(f"- {k} {keywords[k]}") for k in keywords.keys()]
-
-    # Replacing keywords in files.
-    update_keywords('web/config.toml', keywords)
-    update_keywords('web/content/includes/initialisation.inc', keywords)
-    update_keywords('web/content/scorecards/_index.md', keywords)
-    # update_keywords('README.md', keywords)
-    files = glob.glob("web/content/*.md")
-    for file in files:
-        if os.path.isfile(file):
-            update_keywords(file, keywords)
+    with instrument.span('write'):
+        write_to_csv(issues, tasks, hist)
+        write_activities_to_md(issues)
+        write_data_points(issues, params)
+        write_flow_metrics(issues, hist, params)
+
+    with instrument.span('keywords'):
+        update_website_keywords(params)
+    changed = save_manifest()
 
     print("Done.")
 
+    if args.opt_unchanged_status and not changed:
+        print("No content change.")
+        exit(unchanged_exit_status)
+
 
 if __name__ == '__main__':
     main()
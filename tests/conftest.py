@@ -0,0 +1,34 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Tests of the scripts, run from the repository root with:
+
+    python -m pytest tests
+
+Scripts are imported as top-level modules, as when they are run.
+"""
+
+import os
+import sys
+
+import pytest
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root_dir, 'scripts'))
+
+
+@pytest.fixture
+def in_tmp_path(tmp_path, monkeypatch):
+    """
+    Run the test from a temporary directory, for the scripts writing
+    relative to the current directory.
+    """
+    monkeypatch.chdir(tmp_path)
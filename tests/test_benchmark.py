@@ -0,0 +1,33 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Synthetic boards of the benchmark.
+"""
+
+import json
+import random
+
+import ggi_deploy
+from ggi_benchmark import generate_bodies, parse_bodies
+
+
+def test_synthetic_activity_ids_are_distinct():
+    with open(ggi_deploy.activities_file, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    with open(ggi_deploy.init_scorecard_file, 'r', encoding='utf-8') as f:
+        init_scorecard = f.readlines()
+    bodies = generate_bodies(1000, metadata, init_scorecard, random.Random(42))
+    issues, _ = parse_bodies(bodies, metadata)
+    ids = [issue[1] for issue in issues]
+    assert len(set(ids)) == 1000
+    assert ids[0] == 'GGI-A-1' and ids[-1] == 'GGI-A-1000'
+    # The deploy side reads the same ids.
+    assert [ggi_deploy.get_activity_id(body) for body in bodies] == ids
@@ -0,0 +1,75 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Board state cache of incremental updates, in a temporary directory.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from ggi_board_cache import flatten_board_cache, load_board_cache, merge_board_cache, save_board_cache
+
+project = 'ggi/my-ggi-board'
+sync_time = datetime(2024, 3, 1, 10, 0, tzinfo=timezone.utc)
+
+
+pytestmark = pytest.mark.usefixtures('in_tmp_path')
+
+
+def harvest(issue_id, updated_at):
+    issue = [issue_id, f'GGI-A-{issue_id:02}', 'opened', f'Issue {issue_id}', '', updated_at,
+             f'https://forge.invalid/issues/{issue_id}', '', {}, 1, 0]
+    tasks = [[f'GGI-A-{issue_id:02}', 'open', 'objective 0']]
+    hist = [[updated_at, issue_id, f'{issue_id}-1', 'label', 'tester', 'add In Progress', issue[6]]]
+    return issue, tasks, hist
+
+
+def test_load_missing_cache():
+    cache = load_board_cache(project)
+    assert cache['issues'] == {}
+    assert cache['last_sync'] is None
+
+
+def test_merge_and_flatten():
+    cache = load_board_cache(project)
+    merge_board_cache(cache, [harvest(1, '2024-01-01'), harvest(2, '2024-01-02'), harvest(10, '2024-01-03')],
+                      [], sync_time)
+    merge_board_cache(cache, [harvest(2, '2024-02-02')], [1], sync_time)
+
+    issues, tasks, hist = flatten_board_cache(cache)
+    # Newest first, by numeric id.
+    assert [issue[0] for issue in issues] == [10, 2]
+    assert [issue[5] for issue in issues] == ['2024-01-03', '2024-02-02']
+    assert len(tasks) == 2
+    assert [line[0] for line in hist] == ['2024-01-03', '2024-02-02']
+    assert cache['last_sync'] == sync_time.isoformat()
+
+
+def test_save_and_load():
+    cache = load_board_cache(project)
+    updated_at = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    merge_board_cache(cache, [harvest(1, updated_at)], [], sync_time)
+    save_board_cache(cache)
+
+    loaded = load_board_cache(project)
+    assert loaded['last_sync'] == sync_time.isoformat()
+    # Dates are stored as strings, as rendered in the generated files.
+    assert loaded['issues']['1']['updated_at'] == str(updated_at)
+    assert flatten_board_cache(loaded)[0][0][5] == str(updated_at)
+
+
+def test_load_other_version():
+    cache = load_board_cache(project)
+    merge_board_cache(cache, [harvest(1, '2024-01-01')], [], sync_time)
+    cache['version'] = 0
+    save_board_cache(cache)
+    assert load_board_cache(project)['issues'] == {}
@@ -0,0 +1,52 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Goal x role x status cube of the dashboard.
+"""
+
+from ggi_dashboard import all_roles, build_dashboard, count_goals, count_statuses, unknown_status
+
+metadata = {'goals': [{'name': 'Trust Goal'}, {'name': 'Usage Goal'}], 'roles': ['OSPO Leader', 'Developers']}
+progress_labels = {'not_started': 'Not Started', 'in_progress': 'In Progress', 'done': 'Done'}
+
+
+def test_build_dashboard():
+    labels = [
+        'Usage Goal,OSPO Leader,Done',
+        'Usage Goal,Developers,In Progress',
+        # Exclusive status: the first one in (not started, in progress, done) order.
+        'Trust Goal,In Progress,Done',
+        # Labels are matched exactly.
+        'Trust Goal,Nearly Done, Developers ',
+        'Usage Goal,Not Started',
+        '',
+    ]
+    dashboard = build_dashboard(labels, metadata, progress_labels)
+    assert dashboard.goals == ['Trust Goal', 'Usage Goal']
+    assert dashboard.roles == ['OSPO Leader', 'Developers', all_roles]
+    assert dashboard.statuses == ['Not Started', 'In Progress', 'Done', unknown_status]
+    assert dashboard.status == [2, 1, 1, 3, 0, 3]
+    assert count_statuses(dashboard) == [1, 2, 1, 2]
+
+    assert count_goals(dashboard, 'Done') == [0, 1]
+    assert count_goals(dashboard, 'In Progress') == [1, 1]
+    assert count_goals(dashboard, 'Not Started') == [0, 1]
+    assert count_goals(dashboard, unknown_status) == [1, 0]
+    assert count_goals(dashboard, 'Done', 'OSPO Leader') == [0, 1]
+    assert count_goals(dashboard, unknown_status, 'Developers') == [1, 0]
+    assert count_goals(dashboard, 'In Progress', 'Developers') == [0, 1]
+
+
+def test_build_dashboard_empty():
+    dashboard = build_dashboard([], metadata, progress_labels)
+    assert dashboard.status == []
+    assert count_statuses(dashboard) == [0, 0, 0, 0]
+    assert count_goals(dashboard, 'Done') == [0, 0]
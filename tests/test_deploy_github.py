@@ -0,0 +1,110 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Population of the Goals board, with a GraphQL client answering partial
+errors.
+"""
+
+import re
+
+import pytest
+
+import ggi_deploy_github
+from ggi_graphql import GraphQLError
+
+params = {'github_url': 'https://github.com', 'github_token': 'x', 'github_project': 'ggi/board'}
+options = [{'id': 'O_usage', 'name': 'Usage Goal'}, {'id': 'O_trust', 'name': 'Trust Goal'}]
+
+
+class StubClient:
+    """
+    Answers the board queries from a list of issues and board items.
+    Aliases whose ids are listed in `failing` answer null with an error.
+    """
+
+    def __init__(self, issues, items, failing=()):
+        self.issues = issues
+        self.items = items
+        self.failing = set(failing)
+        self.mutations = []
+
+    def query(self, query, variables):
+        name = re.match(r"\s*(?:query|mutation)\s+(\w+)", query).group(1)
+        if name == 'GgiProjectBoard':
+            return {'node': {'field': {'id': 'F_goal', 'options': options}, 'items': {
+                'pageInfo': {'hasNextPage': False, 'endCursor': None},
+                'nodes': [{'id': item['id'], 'content': {'id': item['content']},
+                           'fieldValueByName': {'optionId': item['option']} if item['option'] else None}
+                          for item in self.items]}}}
+        if name == 'GgiBoardIssues':
+            return {'repository': {'issues': {'pageInfo': {'hasNextPage': False, 'endCursor': None},
+                                              'nodes': self.issues}}}
+        # Mutations only reference their ids through variables.
+        assert '"' not in query
+        self.mutations.append(name)
+        data = {}
+        errors = []
+        for alias, key in re.findall(r"(\w+): \w+\(input: \{[^}]*(?:contentId|itemId): \$(\w+)", query):
+            if variables[key] in self.failing:
+                data[alias] = None
+                errors.append({'path': [alias], 'message': f"Could not resolve {variables[key]}."})
+            elif name == 'GgiAddItems':
+                self.items.append({'id': f"PVTI_{variables[key]}", 'content': variables[key], 'option': None})
+                data[alias] = {'item': {'id': f"PVTI_{variables[key]}"}}
+            else:
+                option = variables['o' + key[1:]]
+                next(item for item in self.items if item['id'] == variables[key])['option'] = option
+                data[alias] = {'projectV2Item': {'id': variables[key]}}
+        if errors:
+            raise GraphQLError(errors, data)
+        return data
+
+    def report(self):
+        pass
+
+
+def get_issue(idx, goal='Usage Goal'):
+    return {'id': f"I_{idx}", 'title': f"Issue {idx}", 'labels': {'nodes': [{'name': goal}]}}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    def install(*args, **kwargs):
+        client = StubClient(*args, **kwargs)
+        monkeypatch.setattr(ggi_deploy_github, 'get_github_graphql_client', lambda params: client)
+        return client
+    return install
+
+
+def test_populate_board(stub):
+    client = stub([get_issue(1), get_issue(2, 'Trust Goal'), get_issue(3)], [])
+    assert ggi_deploy_github.populate_project_graphql(params, 'P_1', batch_size=2) == []
+    assert client.mutations == ['GgiAddItems', 'GgiAddItems', 'GgiSetGoals', 'GgiSetGoals']
+    assert [item['option'] for item in client.items] == ['O_usage', 'O_trust', 'O_usage']
+
+
+def test_populate_board_partial_failures(stub):
+    client = stub([get_issue(1), get_issue(2), get_issue(3)], [], failing=['I_2', 'PVTI_I_3'])
+    failed = ggi_deploy_github.populate_project_graphql(params, 'P_1')
+    assert sorted(failed) == ['Issue 2', 'Issue 3']
+    assert {item['id']: item['option'] for item in client.items} == {'PVTI_I_1': 'O_usage', 'PVTI_I_3': None}
+
+    # The next run adds the missing issue and sets the item left unset.
+    client.failing.clear()
+    assert ggi_deploy_github.populate_project_graphql(params, 'P_1') == []
+    assert {item['id']: item['option'] for item in client.items} == \
+        {'PVTI_I_1': 'O_usage', 'PVTI_I_2': 'O_usage', 'PVTI_I_3': 'O_usage'}
+
+
+def test_populate_board_without_goal_label(stub):
+    client = stub([get_issue(1, 'Some Label')], [])
+    assert ggi_deploy_github.populate_project_graphql(params, 'P_1') == []
+    assert client.mutations == ['GgiAddItems']
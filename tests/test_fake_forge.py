@@ -0,0 +1,128 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Deploy and fleet scripts run offline against the fake forge, on an
+ephemeral port, from a copy of the repository in a temporary directory.
+"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+from conftest import root_dir
+
+project_gitlab = 'ggi/my-ggi-board-gitlab'
+project_github = 'ggi/my-ggi-board-github'
+generated_files = ['issues.csv', 'tasks.csv', 'activities.js.inc']
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    for name in ['scripts', 'conf', 'web']:
+        shutil.copytree(os.path.join(root_dir, name), tmp_path / name,
+                        ignore=shutil.ignore_patterns('__pycache__', 'public', 'ggi_runs', '.ggi_manifest.json'))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_forge(workdir):
+    """
+    Start the fake forge and return a function running a script against
+    it, from the working copy.
+    """
+    servers = []
+
+    def start(*options):
+        port = get_free_port()
+        server = subprocess.Popen([sys.executable, 'scripts/ggi_fake_forge.py', '-p', str(port), *options],
+                                  cwd=workdir, stdout=subprocess.DEVNULL)
+        servers.append(server)
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return f"http://127.0.0.1:{port}"
+            except OSError:
+                time.sleep(0.1)
+        pytest.fail("The fake forge did not start.")
+
+    yield start
+    for server in servers:
+        server.terminate()
+        server.wait()
+
+
+def run_script(workdir, *args, **env):
+    return subprocess.run([sys.executable, *args], cwd=workdir, capture_output=True, text=True,
+                          env=dict(os.environ, **env))
+
+
+def count_issues(base, api_path):
+    return len(requests.get(f"{base}{api_path}", params={'per_page': 100, 'state': 'all'}).json())
+
+
+def test_deploy(workdir, fake_forge):
+    base = fake_forge('--empty')
+    with open(workdir / 'conf' / 'ggi_activities_full.json', 'r', encoding='utf-8') as f:
+        activities = len(json.load(f)['activities'])
+    gitlab_env = {'GGI_GITLAB_URL': base, 'GGI_GITLAB_PROJECT': project_gitlab, 'GGI_GITLAB_TOKEN': 'x'}
+    github_env = {'GGI_GITHUB_URL': base, 'GGI_GITHUB_PROJECT': project_github, 'GGI_GITHUB_TOKEN': 'x'}
+    # Both backends report the same board plan in dry-run mode.
+    for script, env in [('scripts/ggi_deploy_gitlab.py', gitlab_env), ('scripts/ggi_deploy_github.py', github_env)]:
+        result = run_script(workdir, script, '-a', '-b', '-n', **env)
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert ' Would create board' in result.stdout
+    assert count_issues(base, f"/api/v3/repos/{project_github}/issues") == 0
+
+    # The second run of each deploy finds everything in place.
+    for _ in range(2):
+        result = run_script(workdir, 'scripts/ggi_deploy_gitlab.py', '-a', '-b', **gitlab_env)
+        assert result.returncode == 0, result.stdout + result.stderr
+        result = run_script(workdir, 'scripts/ggi_deploy_github.py', '-a', '-b', '-g', **github_env)
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert count_issues(base, f"/api/v4/projects/{project_gitlab.replace('/', '%2F')}/issues") == activities
+        assert count_issues(base, f"/api/v3/repos/{project_github}/issues") == activities
+
+
+def test_fleet_incremental(workdir, fake_forge):
+    base = fake_forge()
+    with open(workdir / 'conf' / 'ggi_fleet_fake.json', 'r', encoding='utf-8') as f:
+        fleet = json.load(f)
+    for board in fleet['boards']:
+        for key in ['gitlab_url', 'github_host']:
+            if key in board:
+                board[key] = base
+    with open(workdir / 'ggi_fleet_test.json', 'w', encoding='utf-8') as f:
+        json.dump(fleet, f)
+
+    result = run_script(workdir, 'scripts/ggi_fleet.py', '-f', 'ggi_fleet_test.json', '-s', GGI_FAKE_TOKEN='x')
+    assert result.returncode == 0, result.stdout + result.stderr
+    includes = [workdir / fleet['output_dir'] / board['name'] / 'content' / 'includes' / name
+                for board in fleet['boards'] for name in generated_files]
+    full = [path.read_text() for path in includes]
+
+    # An incremental run of unchanged boards writes the same files.
+    result = run_script(workdir, 'scripts/ggi_fleet.py', '-f', 'ggi_fleet_test.json', '-s', '-i', '-u',
+                        GGI_FAKE_TOKEN='x')
+    assert result.returncode == 3, result.stdout + result.stderr
+    assert [path.read_text() for path in includes] == full
@@ -0,0 +1,75 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+History store of label events, in a temporary directory.
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from ggi_history import append_history, get_history_dir, hist_cols, read_history, write_history_partition
+
+project = 'ggi/my-ggi-board'
+
+
+pytestmark = pytest.mark.usefixtures('in_tmp_path')
+
+
+def get_hist(event_ids):
+    events = [
+        ('2024-01-30T10:00:00Z', 1, 'add Not Started'),
+        ('2024-02-01T10:00:00Z', 1, 'add In Progress'),
+        ('2024-02-02T10:00:00Z', 2, 'add In Progress'),
+    ]
+    return pd.DataFrame([[time, issue, event_id, 'label', 'tester', action, f'https://forge.invalid/issues/{issue}']
+                         for (time, issue, action), event_id in zip(events, event_ids)], columns=hist_cols)
+
+
+def test_append_history_by_month():
+    assert append_history(project, get_hist([1, 2, 3])) == 3
+    assert sorted(os.listdir(get_history_dir(project))) == ['2024-01.csv.gz', '2024-02.csv.gz']
+    assert append_history(project, get_hist([1, 2, 3])) == 0
+
+    hist = read_history(project)
+    assert hist['event_id'].tolist() == ['1', '2', '3']
+    assert hist['time'].is_monotonic_increasing
+    assert str(hist['time'].dtype) == 'datetime64[ns, UTC]'
+    assert hist['action'].dtype == 'category'
+
+
+def test_append_history_across_apis():
+    # Events fetched with REST, then with GraphQL: same events, other ids.
+    append_history(project, get_hist([1, 2, 3]))
+    assert append_history(project, get_hist(['LE_1', 'LE_2', 'LE_3'])) == 0
+    assert len(read_history(project)) == 3
+
+
+def test_append_history_new_events_only():
+    append_history(project, get_hist([1, 2, 3]).iloc[:2])
+    assert append_history(project, get_hist([1, 2, 3])) == 1
+    assert len(read_history(project)) == 3
+
+
+def test_read_history_drops_events_stored_twice():
+    # Partitions written by previous versions, de-duplicating on event ids.
+    both = pd.concat([get_hist([1, 2, 3]), get_hist(['LE_1', 'LE_2', 'LE_3'])], ignore_index=True)
+    both['time'] = pd.to_datetime(both['time'], utc=True)
+    for month, events in both.groupby(both['time'].dt.strftime('%Y-%m')):
+        write_history_partition(project, month, events)
+    assert read_history(project)['event_id'].tolist() == ['1', '2', '3']
+
+
+def test_read_history_empty():
+    hist = read_history(project)
+    assert hist.empty
+    assert hist.columns.tolist() == hist_cols
@@ -0,0 +1,97 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Replay of progress label events, on a hand-built event list.
+"""
+
+import pandas as pd
+
+from ggi_replay import cumulative_flow, get_status_intervals, time_in_status
+
+statuses = ['Not Started', 'In Progress', 'Done']
+hist_cols = ['time', 'issue_id', 'event_id', 'type', 'author', 'action', 'url']
+
+
+def get_hist():
+    events = [
+        # Issue 1 goes through all statuses, GitLab verbs.
+        ('2024-01-01T10:00:00Z', 1, 'add Not Started'),
+        ('2024-01-02T10:00:00Z', 1, 'remove Not Started'),
+        ('2024-01-02T10:00:00Z', 1, 'add In Progress'),
+        ('2024-01-04T10:00:00Z', 1, 'add In Progress'),
+        ('2024-01-05T10:00:00Z', 1, 'remove In Progress'),
+        ('2024-01-05T10:00:00Z', 1, 'add Done'),
+        # Issue 2 is still in progress, GitHub verbs, with a goal label.
+        ('2024-01-03T00:00:00Z', 2, 'labeled Usage Goal'),
+        ('2024-01-03T00:00:00Z', 2, 'unlabeled Not Started'),
+        ('2024-01-03T10:00:00Z', 2, 'labeled In Progress'),
+        # Issue 3 has other labels only.
+        ('2024-01-06T10:00:00Z', 3, 'add Usage Goal'),
+    ]
+    return pd.DataFrame([[time, issue, f'{issue}-{idx}', 'label', 'tester', action,
+                          f'https://forge.invalid/issues/{issue}']
+                         for idx, (time, issue, action) in enumerate(events)], columns=hist_cols)
+
+
+def get_days(intervals, issue, label):
+    rows = intervals[(intervals['issue'] == issue) & (intervals['label'] == label)]
+    return ((rows['end'] - rows['start']).dt.total_seconds() / 86400).tolist()
+
+
+def test_status_intervals():
+    intervals = get_status_intervals(get_hist(), statuses)
+    assert len(intervals) == 4
+    assert get_days(intervals, 1, 'Not Started') == [1.0]
+    # The second "add" does not open another interval.
+    assert get_days(intervals, 1, 'In Progress') == [3.0]
+    # Labels still held end at the last label event of the board.
+    assert get_days(intervals, 1, 'Done') == [1.0]
+    assert get_days(intervals, 2, 'In Progress') == [3.0]
+    assert intervals.set_index(['issue', 'label'])['open'].to_dict() == {
+        (1, 'Not Started'): False, (1, 'In Progress'): False, (1, 'Done'): True, (2, 'In Progress'): True}
+
+
+def test_status_intervals_until_now():
+    now = pd.Timestamp('2024-01-10T10:00:00Z')
+    intervals = get_status_intervals(get_hist(), statuses, now=now)
+    assert get_days(intervals, 1, 'Done') == [5.0]
+    assert get_days(intervals, 1, 'In Progress') == [3.0]
+
+
+def test_time_in_status():
+    intervals = get_status_intervals(get_hist(), statuses)
+    activities = pd.DataFrame({'issue': [1, 2, 3], 'activity_id': ['GGI-A-01', 'GGI-A-02', 'GGI-A-03'],
+                               'goal': ['Usage Goal', 'Usage Goal', 'Trust Goal']})
+    per_activity = time_in_status(intervals, activities)
+    assert per_activity.to_dict('records') == [
+        {'activity_id': 'GGI-A-01', 'goal': 'Usage Goal', 'status': 'Done', 'days': 1.0},
+        {'activity_id': 'GGI-A-01', 'goal': 'Usage Goal', 'status': 'In Progress', 'days': 3.0},
+        {'activity_id': 'GGI-A-01', 'goal': 'Usage Goal', 'status': 'Not Started', 'days': 1.0},
+        {'activity_id': 'GGI-A-02', 'goal': 'Usage Goal', 'status': 'In Progress', 'days': 3.0},
+    ]
+
+
+def test_cumulative_flow():
+    days, flow = cumulative_flow(get_status_intervals(get_hist(), statuses), statuses)
+    assert days == ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05', '2024-01-06']
+    assert flow == {
+        'Not Started': [1, 0, 0, 0, 0, 0],
+        'In Progress': [0, 1, 2, 2, 1, 1],
+        'Done': [0, 0, 0, 0, 1, 1],
+    }
+
+
+def test_cumulative_flow_until_now():
+    intervals = get_status_intervals(get_hist(), statuses)
+    days, flow = cumulative_flow(intervals, statuses, now=pd.Timestamp('2024-01-08T00:00:00Z'))
+    assert days[-3:] == ['2024-01-06', '2024-01-07', '2024-01-08']
+    assert flow['In Progress'][-3:] == [1, 1, 1]
+    assert cumulative_flow(intervals.iloc[:0], statuses) == ([], {status: [] for status in statuses})
@@ -0,0 +1,80 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+The single-pass scorecard parser against the historical parser, on the
+issue bodies ggi_deploy builds from the activities of the handbook.
+"""
+
+import argparse
+import json
+import random
+
+import pytest
+
+import ggi_deploy
+from ggi_scorecard import ScorecardCache, parse_scorecard
+from ggi_scorecard_benchmark import legacy_extract_workflow
+
+
+def get_bodies(opt_random):
+    with open(ggi_deploy.activities_file, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    with open(ggi_deploy.init_scorecard_file, 'r', encoding='utf-8') as f:
+        init_scorecard = f.readlines()
+    args = argparse.Namespace(opt_random=opt_random)
+    rnd = random.Random(42)
+    return [ggi_deploy.extract_sections(args, init_scorecard, activity, rnd)
+            for activity in metadata['activities']]
+
+
+def as_legacy(scorecard):
+    workflow = {s: list(lines) for s, lines in scorecard.workflow}
+    tasks = [{'is_completed': t.is_completed, 'task': t.task} for t in scorecard.tasks]
+    return scorecard.activity_id, list(scorecard.description), workflow, tasks
+
+
+@pytest.mark.parametrize('opt_random', [False, True])
+def test_parse_scorecard_matches_legacy(opt_random):
+    bodies = get_bodies(opt_random)
+    assert bodies
+    for body in bodies:
+        assert as_legacy(parse_scorecard(body)) == legacy_extract_workflow(body)
+
+
+def test_parse_scorecard_reads_tasks():
+    scorecard = parse_scorecard(get_bodies(True)[0])
+    assert scorecard.activity_id.startswith('GGI-A-')
+    assert scorecard.tasks
+    assert all(t.task.startswith('objective ') for t in scorecard.tasks)
+
+
+def test_parse_scorecard_without_scorecard_section():
+    body = 'Activity ID: [GGI-A-01](https://example.org).\n\n### Description\n\nSome text.'
+    assert as_legacy(parse_scorecard(body)) == ('GGI-A-01', ['', 'Some text.'], {}, [])
+
+
+def test_parse_scorecard_without_description():
+    with pytest.raises(KeyError):
+        parse_scorecard('### Scorecard\n\n- [x] done')
+
+
+def test_scorecard_cache_round_trip(tmp_path):
+    bodies = get_bodies(True)[:5]
+    cache = ScorecardCache(path=str(tmp_path / 'scorecards.json'))
+    parsed = [cache.parse(body) for body in bodies]
+    assert cache.parse(bodies[0]) is parsed[0]
+    assert (cache.hits, cache.misses) == (1, 5)
+    cache.save()
+
+    loaded = ScorecardCache(path=cache.path)
+    loaded.load()
+    assert [loaded.parse(body) for body in bodies] == parsed
+    assert (loaded.hits, loaded.misses) == (5, 0)
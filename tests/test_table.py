@@ -0,0 +1,83 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Tables against pandas DataFrames, on rows shaped like the ones returned
+by the forges.
+"""
+
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from ggi_table import Table, as_dataframe
+from ggi_update_website import to_tables
+
+issues_csv_cols = ['issue_id', 'activity_id', 'state', 'title', 'labels',
+                   'updated_at', 'url', 'tasks_total', 'tasks_done']
+
+
+def get_rows():
+    """
+    Issues, tasks and hist lines, as from GitHub (datetimes) and GitLab
+    (strings), with None values and text needing CSV quoting.
+    """
+    updated = datetime(2024, 3, 1, 10, 20, 30, tzinfo=timezone.utc)
+    issues = [
+        [1, 'GGI-A-01', 'open', 'Inventory, "first" step', 'Usage Goal,In Progress',
+         updated, 'https://forge.invalid/issues/1', 'Line 1\nLine 2', {}, 4, 1],
+        [2, None, 'closed', 'Élan', None,
+         updated.replace(microsecond=123456), 'https://forge.invalid/issues/2', '', {}, 0, 0],
+        [3, 'GGI-A-03', 'opened', 'No date', '',
+         None, 'https://forge.invalid/issues/3', None, {}, 10, 10],
+    ]
+    tasks = [['GGI-A-01', 'completed', 'objective 0'], ['GGI-A-01', 'open', 'objective, 1'],
+             [None, 'open', 'objective "2"']]
+    hist = [
+        [updated, 1, 1001, 'label', 'alice', 'labeled In Progress', 'https://forge.invalid/issues/1'],
+        [updated.replace(microsecond=5), 2, 'LE_kwDO', 'label', 'bob', 'unlabeled Done',
+         'https://forge.invalid/issues/2'],
+        ['2024-03-02T08:00:00.000Z', 3, 1003, 'label', None, 'add Not Started',
+         'https://forge.invalid/issues/3'],
+    ]
+    return issues, tasks, hist
+
+
+def test_to_csv_matches_pandas():
+    issues, tasks, hist = get_rows()
+    tables = to_tables(issues, tasks, hist)
+    frames = [pd.DataFrame(table.rows, columns=table.columns) for table in tables]
+
+    assert tables[0].to_csv(columns=issues_csv_cols, index=False) == \
+        frames[0].to_csv(columns=issues_csv_cols, index=False)
+    for table, frame in zip(tables[1:], frames[1:]):
+        assert table.to_csv(index=False) == frame.to_csv(index=False)
+
+
+def test_columns_match_pandas():
+    issues, tasks, hist = to_tables(*get_rows())
+    frame = as_dataframe(issues)
+    assert issues.shape == frame.shape
+    assert len(issues) == len(frame)
+    for col in ['issue_id', 'activity_id', 'tasks_total', 'tasks_done']:
+        assert issues[col].tolist() == frame[col].where(frame[col].notna(), None).tolist()
+    assert issues['tasks_done'].sum() == frame['tasks_done'].sum()
+
+
+def test_empty_table_matches_pandas():
+    cols = ['time', 'issue_id', 'event_id']
+    assert Table([], cols).to_csv(index=False) == pd.DataFrame([], columns=cols).to_csv(index=False)
+
+
+def test_integer_columns_with_none_stay_integers():
+    # pandas converts such columns to floats, see ggi_table.
+    table = Table([[1, None], [2, 5]], ['issue_id', 'tasks_total'])
+    assert table.to_csv() == 'issue_id,tasks_total\n1,\n2,5\n'
+    assert table['tasks_total'].sum() == 5
@@ -0,0 +1,77 @@
+######################################################################
+# Copyright (c) 2022 Boris Baldassari, Nico Toussaint and others
+#
+# This program and the accompanying materials are made
+# available under the terms of the Eclipse Public License 2.0
+# which is available at https://www.eclipse.org/legal/epl-2.0/
+#
+# SPDX-License-Identifier: EPL-2.0
+######################################################################
+
+"""
+Daily snapshots of the board, in a temporary file.
+"""
+
+import json
+import os
+
+from ggi_trends import append_snapshot, get_snapshots_file, render_trend
+from ggi_update_website import check_store, manifest_name
+
+columns = ['status:Not Started', 'status:Done', 'tasks_done', 'tasks_total']
+
+
+def read_lines(path):
+    with open(path, 'r') as f:
+        return f.read().splitlines()
+
+
+def test_get_snapshots_file():
+    assert get_snapshots_file('ggi/my-ggi-board') == os.path.join('.ggi_cache', 'snapshots', 'ggi_my-ggi-board.csv')
+
+
+def test_append_snapshot(tmp_path):
+    path = str(tmp_path / 'snapshots' / 'board.csv')
+    assert append_snapshot(path, '2024-01-01', columns, [3, 0, 1, 10])
+    # Unchanged values, on the same day or later: nothing is written.
+    assert not append_snapshot(path, '2024-01-01', columns, [3, 0, 1, 10])
+    assert not append_snapshot(path, '2024-01-02', columns, [3, 0, 1, 10])
+    assert append_snapshot(path, '2024-01-03', columns, [2, 1, 4, 10])
+    # Same day: the last line is replaced.
+    assert append_snapshot(path, '2024-01-03', columns, [1, 2, 5, 10])
+    assert read_lines(path) == ['date,' + ','.join(columns), '2024-01-01,3,0,1,10', '2024-01-03,1,2,5,10']
+
+
+def test_append_snapshot_new_columns(tmp_path):
+    path = str(tmp_path / 'board.csv')
+    append_snapshot(path, '2024-01-01', columns, [3, 0, 1, 10])
+    new_columns = columns[:2] + ['status:In Progress'] + columns[2:]
+    assert append_snapshot(path, '2024-01-02', new_columns, [2, 0, 1, 1, 10])
+    assert read_lines(path) == ['date,' + ','.join(new_columns), '2024-01-01,3,0,0,1,10', '2024-01-02,2,0,1,1,10']
+
+
+def test_render_trend(tmp_path):
+    path = str(tmp_path / 'board.csv')
+    append_snapshot(path, '2024-01-01', columns, [3, 0, 1, 10])
+    append_snapshot(path, '2024-01-02', columns, [2, 1, 4, 10])
+    assert json.loads(render_trend(path)) == {
+        'dates': ['2024-01-01', '2024-01-02'],
+        'statuses': {'Not Started': [3, 2], 'Done': [0, 1]},
+        'tasks_done': [1, 4],
+        'tasks_total': [10, 10],
+    }
+
+
+def test_check_store(tmp_path, capsys):
+    web_dir = tmp_path / 'web'
+    web_dir.mkdir()
+    store = str(tmp_path / 'board.csv')
+    # First run: no website generated yet.
+    check_store(store, str(web_dir))
+    assert capsys.readouterr().out == ''
+    (web_dir / manifest_name).write_text('{}')
+    check_store(store, str(web_dir))
+    assert 'Warning' in capsys.readouterr().out
+    append_snapshot(store, '2024-01-01', columns, [3, 0, 1, 10])
+    check_store(store, str(web_dir))
+    assert capsys.readouterr().out == ''